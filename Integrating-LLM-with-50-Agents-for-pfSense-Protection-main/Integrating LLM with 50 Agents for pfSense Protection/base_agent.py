@@ -12,12 +12,24 @@ import threading
 import time
 import uuid
 from abc import ABC, abstractmethod
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import partial
 from typing import Any, Dict, List, Optional, Callable
 from dataclasses import dataclass, asdict
 import aiohttp
 import pika
-from pika.adapters.asyncio_connection import AsyncioConnection
+
+from .batch_publisher import BatchPublisher, PublishError
+from .compression import SUPPORTED_ENCODINGS, MessageCompressor, decompress
+from .connection_pool import get_transport
+from .dedupe_cache import DedupeCache
+from .dispatcher import MessageDispatcher
+from .metrics import get_metrics
+from .priority_queue import PriorityMessageQueue
+from .message_codec import (
+    HEADER_EXPIRES_AT, JSON_CONTENT_TYPE, get_codec, get_codec_by_name, now_ms, routing_headers,
+    supported_content_types
+)
 
 
 @dataclass
@@ -31,19 +43,29 @@ class AgentMessage:
     payload: Dict[str, Any]
     timestamp: datetime
     priority: int = 1  # 1=low, 2=medium, 3=high, 4=critical
+    expires_at: Optional[datetime] = None  # None = never expires
+    
+    def is_expired(self, now: Optional[datetime] = None) -> bool:
+        """Whether the message is past its expiry and no longer worth handling."""
+        return self.expires_at is not None and self.expires_at <= (now or datetime.now())
     
     def to_json(self) -> str:
         """Convert message to JSON string."""
-        data = asdict(self)
-        data['timestamp'] = self.timestamp.isoformat()
-        return json.dumps(data)
+        return self.encode(JSON_CONTENT_TYPE).decode()
     
     @classmethod
     def from_json(cls, json_str: str) -> 'AgentMessage':
         """Create message from JSON string."""
-        data = json.loads(json_str)
-        data['timestamp'] = datetime.fromisoformat(data['timestamp'])
-        return cls(**data)
+        return cls.decode(json_str, JSON_CONTENT_TYPE)
+    
+    def encode(self, content_type: Optional[str] = None) -> bytes:
+        """Encode message with the codec registered for a content type."""
+        return get_codec(content_type).encode(self)
+    
+    @classmethod
+    def decode(cls, body: bytes, content_type: Optional[str] = None) -> 'AgentMessage':
+        """Decode message bytes using the codec for their content type."""
+        return cls(**get_codec(content_type).decode_fields(body))
 
 
 @dataclass
@@ -56,18 +78,51 @@ class AgentConfig:
     enabled: bool = True
     log_level: str = "INFO"
     heartbeat_interval: int = 30  # seconds
-    max_retries: int = 3
+    heartbeat_ttl: float = 0  # seconds; 0 = heartbeats never expire
+    max_retries: int = 3  # rabbitmq.retry_attempts, also for pooled connections
     retry_delay: int = 5  # seconds
     rabbitmq_url: str = "amqp://localhost:5672"
+    transport: str = "amqp"  # amqp, inprocess
     llm_api_url: str = "http://localhost:8000/api/llm"
     pfsense_host: str = "localhost"
     pfsense_ssh_port: int = 22
     pfsense_username: str = "admin"
     subscribed_topics: List[str] = None
+    message_codec: str = "json"  # json, binary
+    # Deflate bodies of at least this many bytes; 0 disables compression
+    compression_threshold: int = 0
+    compression_thresholds: Dict[str, int] = None  # per topic pattern, when enabled
+    compression_level: int = 6
+    publish_batch_size: int = 0  # 0 disables batched publishing
+    publish_batch_delay_ms: int = 50
+    connection_pool_size: int = 2  # shared AMQP connections per process
+    channels_per_connection: int = 32
+    message_queue_size: int = 10000  # performance.message_queue_size
+    queue_aging_interval: float = 5.0  # seconds before a waiting message gains a level
+    # Concurrent handlers per message type: 0 = unbounded, 1 = in order
+    message_concurrency: Dict[str, int] = None
+    default_message_concurrency: int = 8
+    max_pending_handlers: int = 100  # performance.async_pool_size
+    metrics_port: int = 0  # monitoring.metrics_port; 0 leaves serving to the broker
+    # Window of recently received message IDs; duplicates are acked and dropped
+    dedupe_window_size: int = 10000
+    dedupe_ttl: float = 600.0  # seconds
+    dedupe_bloom_capacity: int = 0  # > 0 remembers IDs beyond the window approximately
+    llm: Dict[str, Any] = None  # the llm section; configures the shared LLM client
     
     def __post_init__(self):
         if self.subscribed_topics is None:
             self.subscribed_topics = []
+        if self.llm is None:
+            self.llm = {}
+        if self.compression_thresholds is None:
+            self.compression_thresholds = {}
+        if self.message_concurrency is None:
+            self.message_concurrency = {
+                'heartbeat': 0,
+                'alert': 4,
+                'task_result': 1
+            }
 
 
 class BaseAgent(ABC):
@@ -94,11 +149,49 @@ class BaseAgent(ABC):
         # Setup logging
         self.logger = self._setup_logging()
         
+        # Prometheus metrics shared with the other agents in the process
+        self.metrics = get_metrics()
+        self._received_counter = self.metrics.child(self.metrics.messages_received, self.agent_type)
+        self._sent_counter = self.metrics.child(self.metrics.messages_sent, self.agent_type)
+        self._error_counter = self.metrics.child(self.metrics.agent_errors, self.agent_type)
+        self._expired_counter = self.metrics.child(self.metrics.messages_expired, self.agent_id)
+        
         # Communication components
-        self.connection = None
+        self.transport = get_transport(
+            config.transport,
+            max_connections=config.connection_pool_size,
+            max_channels_per_connection=config.channels_per_connection,
+            retry_attempts=config.max_retries,
+            retry_delay=config.retry_delay
+        )
         self.channel = None
         self.message_handlers: Dict[str, Callable] = {}
-        self.message_queue = asyncio.Queue()
+        self.message_queue = PriorityMessageQueue(
+            maxsize=config.message_queue_size,
+            aging_interval=config.queue_aging_interval
+        )
+        self.codec = get_codec_by_name(config.message_codec)
+        self.compressor = MessageCompressor(
+            threshold=config.compression_threshold,
+            topic_thresholds=config.compression_thresholds,
+            level=config.compression_level,
+            observer=self.metrics.observe_compression
+        )
+        self.publisher: Optional[BatchPublisher] = None
+        self.dedupe = DedupeCache(
+            max_entries=config.dedupe_window_size,
+            ttl=config.dedupe_ttl,
+            bloom_capacity=config.dedupe_bloom_capacity
+        )
+        
+        self.dispatcher = MessageDispatcher(
+            handler=self._handle_dispatched_message,
+            concurrency_limits=config.message_concurrency,
+            default_limit=config.default_message_concurrency,
+            max_pending=config.max_pending_handlers,
+            latency_observer=partial(self.metrics.observe_handler, self.agent_type),
+            logger=self.logger
+        )
         
         # Threading for async operations
         self.loop = None
@@ -109,6 +202,8 @@ class BaseAgent(ABC):
             'messages_sent': 0,
             'messages_received': 0,
             'errors': 0,
+            'duplicates_dropped': 0,
+            'messages_expired': 0,
             'start_time': None,
             'last_activity': None
         }
@@ -139,8 +234,13 @@ class BaseAgent(ABC):
         self.logger.info(f"Starting agent {self.agent_id}")
         self.is_running = True
         self.stats['start_time'] = datetime.now()
+        self.metrics.register_queue(self.agent_id, self.message_queue)
+        self.metrics.register_dedupe_cache(self.agent_id, self.dedupe)
         
         try:
+            if self.config.metrics_port:
+                self.metrics.start_server(self.config.metrics_port)
+            
             # Initialize communication
             await self._setup_communication()
             
@@ -160,68 +260,136 @@ class BaseAgent(ABC):
             raise
     
     async def stop(self):
-        """Stop the agent gracefully."""
+        """
+        Stop the agent gracefully.
+        
+        Raises PublishError, once shutdown has completed, if buffered
+        messages could not be published.
+        """
         self.logger.info(f"Stopping agent {self.agent_id}")
         self.is_running = False
+        publish_error = None
         
         try:
+            # Let in-flight handlers finish, cancelling stragglers
+            await self.dispatcher.shutdown()
+            
             # Call agent-specific cleanup
             await self.cleanup()
             
-            # Close communication
+            # Publish anything still buffered
+            if self.publisher:
+                try:
+                    await self.publisher.stop()
+                except PublishError as e:
+                    publish_error = e
+            
+            # Return the channel; the shared connection stays open for other agents
             if self.channel:
-                await self.channel.close()
-            if self.connection:
-                await self.connection.close()
+                await self.transport.release_channel(self.channel)
+            
+            self.metrics.unregister_queue(self.agent_id)
+            self.metrics.unregister_dedupe_cache(self.agent_id)
                 
         except Exception as e:
             self.logger.error(f"Error stopping agent: {e}")
+        
+        if publish_error is not None:
+            raise publish_error
     
     async def _setup_communication(self):
-        """Setup RabbitMQ connection and channels."""
+        """Setup the message transport and channels."""
         try:
-            # Connect to RabbitMQ
-            connection_params = pika.URLParameters(self.config.rabbitmq_url)
-            self.connection = await AsyncioConnection.create(connection_params)
-            self.channel = await self.connection.channel()
-            
-            # Declare exchanges and queues
-            await self.channel.exchange_declare(
-                exchange='pfsense_agents',
-                exchange_type='topic',
-                durable=True
+            # Get a channel on a connection shared with co-located agents
+            channel = await self.transport.acquire_channel(
+                self.config.rabbitmq_url,
+                on_reopen=self._setup_channel
             )
+            await self._setup_channel(channel)
             
-            # Create agent-specific queue
-            queue_name = f"agent.{self.agent_id}"
-            await self.channel.queue_declare(queue=queue_name, durable=True)
-            
-            # Bind to subscribed topics
-            for topic in self.config.subscribed_topics:
-                await self.channel.queue_bind(
-                    exchange='pfsense_agents',
-                    queue=queue_name,
-                    routing_key=topic
+            # Batched publishing relies on publisher confirms
+            if self.config.publish_batch_size > 0:
+                self.publisher = BatchPublisher(
+                    publish=self._basic_publish,
+                    max_batch_size=self.config.publish_batch_size,
+                    max_delay_ms=self.config.publish_batch_delay_ms,
+                    batch_observer=self.metrics.observe_batch,
+                    logger=self.logger
                 )
             
-            # Start consuming messages
-            await self.channel.basic_consume(
-                queue=queue_name,
-                on_message_callback=self._on_message_received
-            )
-            
             self.logger.info("Communication setup completed")
             
         except Exception as e:
             self.logger.error(f"Failed to setup communication: {e}")
             raise
     
+    async def _setup_channel(self, channel):
+        """Declare queues, bindings and consumers on a (re)opened channel."""
+        self.channel = channel
+        
+        # Declare exchanges and queues
+        await self.transport.declare_exchange(self.channel, 'pfsense_agents', 'topic')
+        
+        # Create agent-specific queue
+        queue_name = f"agent.{self.agent_id}"
+        await self.channel.queue_declare(queue=queue_name, durable=True)
+        
+        # Bind to subscribed topics
+        for topic in self.config.subscribed_topics:
+            await self.channel.queue_bind(
+                exchange='pfsense_agents',
+                queue=queue_name,
+                routing_key=topic
+            )
+        
+        # Start consuming messages
+        await self.channel.basic_consume(
+            queue=queue_name,
+            on_message_callback=self._on_message_received
+        )
+        
+        if self.config.publish_batch_size > 0:
+            await self.channel.confirm_delivery()
+    
+    async def _basic_publish(self, **publish_kwargs):
+        """Publish on the current channel, which changes after a reconnect."""
+        await self.channel.basic_publish(**publish_kwargs)
+    
     async def _on_message_received(self, channel, method, properties, body):
         """Handle incoming messages."""
         try:
-            message = AgentMessage.from_json(body.decode())
+            # Skip messages that expired while queued, using the header alone
+            expires_at = (properties.headers or {}).get(HEADER_EXPIRES_AT)
+            if expires_at is not None and expires_at <= now_ms():
+                self._drop_expired()
+                await channel.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            
+            # Drop redeliveries and repeated publishes, before decoding when possible
+            message = None
+            message_id = properties.message_id
+            if not message_id:
+                message = AgentMessage.decode(
+                    decompress(body, properties.content_encoding), properties.content_type
+                )
+                message_id = message.id
+            
+            if self.dedupe.seen(message_id):
+                self.stats['duplicates_dropped'] += 1
+                self.logger.debug(f"Dropped duplicate message {message_id}")
+                await channel.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            
+            if message is None:
+                message = AgentMessage.decode(
+                    decompress(body, properties.content_encoding), properties.content_type
+                )
+            if message.expires_at is None and expires_at is not None:
+                # JSON bodies leave the expiry to the header
+                message.expires_at = datetime.fromtimestamp(expires_at / 1000)
             self.stats['messages_received'] += 1
             self.stats['last_activity'] = datetime.now()
+            self._received_counter.inc()
             
             self.logger.debug(f"Received message: {message.message_type} from {message.sender_id}")
             
@@ -234,6 +402,7 @@ class BaseAgent(ABC):
         except Exception as e:
             self.logger.error(f"Error processing received message: {e}")
             self.stats['errors'] += 1
+            self._error_counter.inc()
             await channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
     
     async def _message_processor(self):
@@ -246,8 +415,13 @@ class BaseAgent(ABC):
                     timeout=1.0
                 )
                 
-                # Handle the message
-                await self.handle_message(message)
+                # Stale work is skipped so a backlog drains quickly
+                if message.expires_at is not None and message.is_expired():
+                    self._drop_expired()
+                    continue
+                
+                # Handle the message concurrently with others
+                await self.dispatcher.dispatch(message)
                 
             except asyncio.TimeoutError:
                 continue
@@ -255,14 +429,35 @@ class BaseAgent(ABC):
                 self.logger.error(f"Error in message processor: {e}")
                 self.stats['errors'] += 1
     
+    def _drop_expired(self):
+        """Count a message skipped because it expired before it was handled."""
+        self.stats['messages_expired'] += 1
+        self._expired_counter.inc()
+    
+    async def _handle_dispatched_message(self, message: AgentMessage):
+        """Run handle_message for one dispatched message, counting failures."""
+        try:
+            await self.handle_message(message)
+        except Exception as e:
+            self.logger.error(f"Error handling {message.message_type} message: {e}")
+            self.stats['errors'] += 1
+            self._error_counter.inc()
+    
     async def send_message(self, 
                           message_type: str,
                           topic: str,
                           payload: Dict[str, Any],
                           recipient_id: Optional[str] = None,
-                          priority: int = 1):
-        """Send a message to other agents."""
+                          priority: int = 1,
+                          ttl: Optional[float] = None):
+        """
+        Send a message to other agents.
+        
+        With a ttl in seconds, the message expires that long after it is sent:
+        queues discard it and receivers skip it instead of handling it late.
+        """
         try:
+            timestamp = datetime.now()
             message = AgentMessage(
                 id=str(uuid.uuid4()),
                 sender_id=self.agent_id,
@@ -270,33 +465,62 @@ class BaseAgent(ABC):
                 message_type=message_type,
                 topic=topic,
                 payload=payload,
-                timestamp=datetime.now(),
-                priority=priority
+                timestamp=timestamp,
+                priority=priority,
+                expires_at=timestamp + timedelta(seconds=ttl) if ttl is not None else None
             )
             
-            # Publish to RabbitMQ
-            await self.channel.basic_publish(
-                exchange='pfsense_agents',
-                routing_key=topic,
-                body=message.to_json().encode(),
-                properties=pika.BasicProperties(
+            body, content_encoding = self.compressor.compress(topic, self.codec.encode(message))
+            
+            publish_kwargs = {
+                'exchange': 'pfsense_agents',
+                'routing_key': topic,
+                'body': body,
+                'properties': pika.BasicProperties(
+                    content_type=self.codec.content_type,
+                    content_encoding=content_encoding,
+                    message_id=message.id,
+                    type=message_type,
                     priority=priority,
-                    timestamp=int(time.time())
+                    timestamp=int(time.time()),
+                    expiration=str(int(ttl * 1000)) if ttl is not None else None,
+                    headers=routing_headers(message)
                 )
-            )
+            }
+            
+            # Publish to RabbitMQ, through the batch publisher when enabled
+            if self.publisher:
+                await self.publisher.publish(priority=priority, **publish_kwargs)
+            else:
+                await self._basic_publish(**publish_kwargs)
             
             self.stats['messages_sent'] += 1
             self.stats['last_activity'] = datetime.now()
+            self._sent_counter.inc()
             
             self.logger.debug(f"Sent message: {message_type} to topic {topic}")
             
         except Exception as e:
             self.logger.error(f"Error sending message: {e}")
             self.stats['errors'] += 1
+            self._error_counter.inc()
             raise
     
+    async def flush_messages(self):
+        """
+        Wait until every message sent so far has been published and confirmed.
+        
+        send_message returns once a message is buffered, so this is where
+        batched messages that were nacked or failed to publish surface, as a
+        PublishError listing them.
+        """
+        if self.publisher:
+            await self.publisher.flush()
+    
     async def query_llm(self, prompt: str, context: Dict[str, Any] = None) -> str:
         """Query the LLM for analysis or decision making."""
+        start_time = time.perf_counter()
+        failed = True
         try:
             payload = {
                 'prompt': prompt,
@@ -313,6 +537,7 @@ class BaseAgent(ABC):
                 ) as response:
                     if response.status == 200:
                         result = await response.json()
+                        failed = False
                         return result.get('response', '')
                     else:
                         self.logger.error(f"LLM query failed with status {response.status}")
@@ -321,6 +546,8 @@ class BaseAgent(ABC):
         except Exception as e:
             self.logger.error(f"Error querying LLM: {e}")
             return ""
+        finally:
+            self.metrics.observe_llm('agent_query', time.perf_counter() - start_time, failed)
     
     async def _heartbeat_loop(self):
         """Send periodic heartbeat messages."""
@@ -341,13 +568,18 @@ class BaseAgent(ABC):
             'agent_type': self.agent_type,
             'status': 'healthy' if self.is_healthy else 'unhealthy',
             'stats': self.stats.copy(),
+            'queue_stats': self.message_queue.get_stats(),
+            'publish_stats': self.publisher.get_stats() if self.publisher else None,
+            'content_types': supported_content_types(self.codec),
+            'content_encodings': SUPPORTED_ENCODINGS,
             'timestamp': self.last_heartbeat.isoformat()
         }
         
         await self.send_message(
             message_type='heartbeat',
             topic='system.heartbeat',
-            payload=payload
+            payload=payload,
+            ttl=self.config.heartbeat_ttl or None
         )
     
     def get_status(self) -> Dict[str, Any]:
@@ -360,6 +592,11 @@ class BaseAgent(ABC):
             'is_healthy': self.is_healthy,
             'last_heartbeat': self.last_heartbeat.isoformat() if self.last_heartbeat else None,
             'stats': self.stats.copy(),
+            'queue_stats': self.message_queue.get_stats(),
+            'handler_stats': self.dispatcher.get_stats(),
+            'dedupe_stats': self.dedupe.get_stats(),
+            'publish_stats': self.publisher.get_stats() if self.publisher else None,
+            'compression_stats': self.compressor.get_stats(),
             'config': asdict(self.config)
         }
     
@@ -0,0 +1,171 @@
+"""
+Batch Publisher for pfSense Multi-Agent System
+
+This module provides an opt-in publisher that coalesces outgoing messages and
+publishes them as pipelined batches, waiting for the publisher confirms of a
+whole batch at once instead of one round trip per message.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+CRITICAL_PRIORITY = 4
+
+
+class PublishError(Exception):
+    """
+    Raised by flush() when batched messages were not published.
+
+    failures holds the publish arguments of each lost message with the
+    exception its publish failed with, such as a nack from the broker.
+    """
+
+    def __init__(self, failures: List[Tuple[Dict[str, Any], BaseException]]):
+        self.failures = failures
+        super().__init__(f"{len(failures)} batched messages were not published: {failures[0][1]}")
+
+
+class BatchPublisher:
+    """
+    Coalesces publishes up to a batch size or a maximum delay.
+
+    Messages are buffered until either max_batch_size messages are pending or
+    max_delay_ms has passed since the first one was buffered. A batch is
+    published without awaiting each message, then all confirms are awaited
+    together. Critical-priority messages bypass the buffer entirely.
+
+    If given, batch_observer is called with the size of every flushed batch.
+    Failed publishes are kept and raised as a PublishError by the next
+    flush(), including those of batches flushed by size or by the timer.
+    """
+
+    def __init__(self,
+                 publish: Callable[..., Awaitable[Any]],
+                 max_batch_size: int = 100,
+                 max_delay_ms: int = 50,
+                 batch_observer: Optional[Callable[[int], None]] = None,
+                 logger: Optional[logging.Logger] = None):
+        self._publish = publish
+        self.batch_observer = batch_observer
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._pending: List[Dict[str, Any]] = []
+        self._failed: List[Tuple[Dict[str, Any], BaseException]] = []
+        self._flush_lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+        self.stats = {
+            'batches_flushed': 0,
+            'messages_batched': 0,
+            'messages_bypassed': 0,
+            'publish_errors': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'last_flush_latency_ms': 0.0,
+            'max_flush_latency_ms': 0.0,
+            'total_flush_latency_ms': 0.0
+        }
+
+    async def publish(self, priority: int = 1, **publish_kwargs):
+        """Queue a message for publishing; critical messages are sent immediately."""
+        if priority >= CRITICAL_PRIORITY:
+            self.stats['messages_bypassed'] += 1
+            await self._publish(**publish_kwargs)
+            return
+
+        self._pending.append(publish_kwargs)
+
+        if len(self._pending) >= self.max_batch_size:
+            await self._flush_pending()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after_delay())
+
+    async def flush(self):
+        """
+        Publish everything buffered so far and wait for its confirms.
+
+        Acts as a barrier: when it returns, every message queued before the
+        call, including batches already in flight, has been confirmed.
+        Raises PublishError listing the messages that were not, including
+        failures from earlier batches no flush() has reported yet.
+        """
+        await self._flush_pending()
+
+        if self._failed:
+            failures, self._failed = self._failed, []
+            raise PublishError(failures)
+
+    async def _flush_pending(self):
+        """Publish the buffered batch, recording failed publishes for flush()."""
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+
+        batch, self._pending = self._pending, []
+
+        async with self._flush_lock:
+            if not batch:
+                return
+
+            start_time = time.perf_counter()
+            results = await asyncio.gather(
+                *(self._publish(**publish_kwargs) for publish_kwargs in batch),
+                return_exceptions=True
+            )
+            latency_ms = (time.perf_counter() - start_time) * 1000
+
+            failures = [
+                (publish_kwargs, result)
+                for publish_kwargs, result in zip(batch, results)
+                if isinstance(result, Exception)
+            ]
+            if failures:
+                self.stats['publish_errors'] += len(failures)
+                self._failed.extend(failures)
+                self.logger.error(
+                    f"Failed to publish {len(failures)} of {len(batch)} batched messages: {failures[0][1]}"
+                )
+
+            self._record_batch(len(batch), latency_ms)
+
+    async def stop(self):
+        """Flush pending messages before shutdown; raises PublishError like flush()."""
+        await self.flush()
+
+    async def _flush_after_delay(self):
+        """Flush the current batch once the maximum delay has elapsed."""
+        try:
+            await asyncio.sleep(self.max_delay)
+            await self._flush_pending()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.logger.error(f"Error flushing message batch: {e}")
+
+    def _record_batch(self, batch_size: int, latency_ms: float):
+        """Update batch size and flush latency counters."""
+        self.stats['batches_flushed'] += 1
+        self.stats['messages_batched'] += batch_size
+        self.stats['last_batch_size'] = batch_size
+        self.stats['max_batch_size'] = max(self.stats['max_batch_size'], batch_size)
+        self.stats['last_flush_latency_ms'] = latency_ms
+        self.stats['max_flush_latency_ms'] = max(self.stats['max_flush_latency_ms'], latency_ms)
+        self.stats['total_flush_latency_ms'] += latency_ms
+
+        if self.batch_observer is not None:
+            self.batch_observer(batch_size)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get publisher counters including average batch size and latency."""
+        stats = self.stats.copy()
+        batches = stats['batches_flushed']
+        stats['pending'] = len(self._pending)
+        stats['unreported_failures'] = len(self._failed)
+        stats['avg_batch_size'] = stats['messages_batched'] / batches if batches else 0.0
+        stats['avg_flush_latency_ms'] = stats['total_flush_latency_ms'] / batches if batches else 0.0
+        return stats
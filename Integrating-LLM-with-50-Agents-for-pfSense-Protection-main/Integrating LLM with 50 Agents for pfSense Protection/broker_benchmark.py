@@ -0,0 +1,352 @@
+"""
+Broker Benchmark for pfSense Multi-Agent System
+
+Runs a MessageBroker on a private in-process transport against synthetic
+agents and measures how it copes with heartbeat, alert and broadcast traffic
+as the number of agents grows. Each scenario reports broker throughput,
+delivery throughput, end-to-end delivery latency (publish to recipient
+callback), broker latency (publish until the broker has processed the
+message, which is the only latency for heartbeats) and CPU time per message, so JSON results from different commits
+can be compared directly.
+
+Alerts are published straight to the broker queue so that they go through
+MessageBroker._route_message; heartbeats and broadcasts use the system topics
+the broker subscribes to. CPU time covers the whole process, including the
+synthetic agents, which only record a timestamp per delivery.
+
+Usage:
+    python -m communication.broker_benchmark [--agents 50 200 1000]
+        [--mix heartbeat alert broadcast mixed] [--messages N] [--window N]
+        [--json] [--output FILE] [--compare FILE]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import subprocess
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import pika
+
+from .message_broker import MessageBroker
+from ..core.base_agent import AgentMessage
+from ..core.inprocess_transport import InProcessTransport
+from ..core.message_codec import get_codec, get_codec_by_name, routing_headers
+
+
+AGENT_TYPES = ['log_analyzer', 'traffic_monitor', 'security_scanner', 'threat_intel']
+SEVERITIES = ['low', 'medium', 'high', 'critical']
+SUBSCRIPTION_PATTERNS = ['security.#', 'security.alerts.*', 'security.alerts.critical', 'network.#']
+
+MIXES = {
+    'heartbeat': {'heartbeat': 1.0},
+    'alert': {'alert': 1.0},
+    'broadcast': {'broadcast': 1.0},
+    'mixed': {'heartbeat': 0.7, 'alert': 0.25, 'broadcast': 0.05}
+}
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def _latency_summary(samples: List[float]) -> Dict[str, float]:
+    values = sorted(samples)
+    return {
+        'p50': _percentile(values, 0.5),
+        'p99': _percentile(values, 0.99),
+        'max': values[-1] if values else 0.0,
+        'mean': sum(values) / len(values) if values else 0.0
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+class DeliveryRecorder:
+    """Collects end-to-end latencies of deliveries to synthetic agents."""
+
+    def __init__(self):
+        self.sent_at: Dict[str, float] = {}
+        self.latencies_ms: List[float] = []
+        self.broker_latencies_ms: List[float] = []
+
+    def on_processed(self, message_id: str):
+        """Record the time from publish until the broker finished processing."""
+        sent_at = self.sent_at.get(message_id)
+        if sent_at is not None:
+            self.broker_latencies_ms.append((time.perf_counter() - sent_at) * 1000)
+
+    async def on_delivery(self, channel, method, properties, body):
+        now = time.perf_counter()
+        sent_at = self.sent_at.get(properties.message_id)
+        if sent_at is None:
+            # Broadcasts are re-issued with new ids; the original id is in the payload
+            payload = get_codec(properties.content_type).decode_fields(body)['payload']
+            sent_at = self.sent_at.get(payload.get('bench_id'))
+        if sent_at is not None:
+            self.latencies_ms.append((now - sent_at) * 1000)
+        await channel.basic_ack(delivery_tag=method.delivery_tag)
+
+
+class BrokerBenchmark:
+    """One scenario: a broker, its synthetic agents and a traffic mix."""
+
+    def __init__(self, agent_count: int, mix: str, message_count: int, window: int,
+                 subscriber_fraction: float, codec: str, seed: int):
+        self.agent_count = agent_count
+        self.mix = mix
+        self.message_count = message_count
+        self.window = window
+        self.subscriber_fraction = subscriber_fraction
+        self.codec = get_codec_by_name(codec)
+        self.rng = random.Random(seed)
+
+        self.transport = InProcessTransport()
+        self.recorder = DeliveryRecorder()
+        self.agent_ids = [f'bench_agent_{index}' for index in range(agent_count)]
+
+        self.processed = 0
+        self._window: Optional[asyncio.Semaphore] = None
+
+    async def setup(self):
+        """Start the broker and register every synthetic agent with it."""
+        self.broker = MessageBroker({'transport': 'inprocess', 'message_codec': self.codec.name})
+        self.broker.transport = self.transport
+        await self.broker._setup_rabbitmq()
+
+        # Count processed messages to keep a fixed number in flight
+        process = self.broker._process_broker_message
+
+        async def counted(envelope):
+            try:
+                await process(envelope)
+            finally:
+                self.recorder.on_processed(envelope.id)
+                self.processed += 1
+                self._window.release()
+
+        self.broker._process_broker_message = counted
+
+        self.channel = await self.transport.acquire_channel()
+        for index, agent_id in enumerate(self.agent_ids):
+            topics = [pattern for pattern in SUBSCRIPTION_PATTERNS
+                      if self.rng.random() < self.subscriber_fraction]
+
+            queue = f'agent.{agent_id}'
+            await self.channel.queue_declare(queue=queue)
+            await self.channel.queue_bind(queue=queue, exchange='pfsense_agents', routing_key=queue)
+            await self.channel.basic_consume(queue=queue, on_message_callback=self.recorder.on_delivery)
+
+            await self.broker._handle_agent_registration(AgentMessage(
+                id=str(uuid.uuid4()),
+                sender_id=agent_id,
+                recipient_id=None,
+                message_type='agent_registration',
+                topic='system.agent_registration',
+                payload={
+                    'agent_id': agent_id,
+                    'agent_type': AGENT_TYPES[index % len(AGENT_TYPES)],
+                    'subscribed_topics': topics,
+                    'content_types': [self.codec.content_type]
+                },
+                timestamp=datetime.now()
+            ))
+
+    def _next_message(self) -> AgentMessage:
+        """Build the next message of the configured mix."""
+        weights = MIXES[self.mix]
+        kind = self.rng.choices(list(weights), weights=list(weights.values()))[0]
+        sender = self.rng.choice(self.agent_ids)
+        message_id = str(uuid.uuid4())
+
+        if kind == 'heartbeat':
+            topic, payload = 'system.heartbeat', {'agent_id': sender, 'status': 'active'}
+        elif kind == 'alert':
+            topic = f'security.alerts.{self.rng.choice(SEVERITIES)}'
+            payload = {'description': 'Synthetic alert', 'source_ip': '192.0.2.10'}
+        else:
+            topic = 'system.broadcast'
+            payload = {
+                'target_filter': {'agent_type': self.rng.choice(AGENT_TYPES)},
+                'payload': {'bench_id': message_id, 'command': 'refresh'}
+            }
+
+        return AgentMessage(
+            id=message_id,
+            sender_id=sender,
+            recipient_id=None,
+            message_type=kind,
+            topic=topic,
+            payload=payload,
+            timestamp=datetime.now(),
+            priority=4 if topic.endswith('critical') else 2
+        )
+
+    async def _publish(self, message: AgentMessage):
+        # Control messages use their system topic, alerts go to the broker queue
+        exchange, routing_key = ('', 'message_broker') if message.message_type == 'alert' \
+            else ('pfsense_agents', message.topic)
+
+        self.recorder.sent_at[message.id] = time.perf_counter()
+        await self.channel.basic_publish(
+            exchange=exchange,
+            routing_key=routing_key,
+            body=self.codec.encode(message),
+            properties=pika.BasicProperties(
+                content_type=self.codec.content_type,
+                message_id=message.id,
+                type=message.message_type,
+                priority=message.priority,
+                headers=routing_headers(message)
+            )
+        )
+
+    async def run(self) -> Dict[str, Any]:
+        """Drive the traffic mix and return the scenario results."""
+        await self.setup()
+        messages = [self._next_message() for _ in range(self.message_count)]
+        self._window = asyncio.Semaphore(self.window)
+
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+
+        for message in messages:
+            await self._window.acquire()
+            await self._publish(message)
+
+        # Wait for the broker and every recipient queue to drain
+        while self.processed < self.message_count or any(len(queue) for queue in self.transport.queues.values()):
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        seconds = time.perf_counter() - start
+        cpu_seconds = time.process_time() - cpu_start
+
+        await self.transport.close()
+        await self.broker.live_updates.stop()
+
+        deliveries = len(self.recorder.latencies_ms)
+        return {
+            'agents': self.agent_count,
+            'mix': self.mix,
+            'messages': self.message_count,
+            'deliveries': deliveries,
+            'seconds': seconds,
+            'messages_per_sec': self.message_count / seconds,
+            'deliveries_per_sec': deliveries / seconds,
+            'latency_ms': _latency_summary(self.recorder.latencies_ms),
+            'broker_latency_ms': _latency_summary(self.recorder.broker_latencies_ms),
+            'cpu_us_per_message': cpu_seconds / self.message_count * 1e6
+        }
+
+
+async def run_benchmarks(agent_counts: List[int], mixes: List[str], message_count: int = 2000,
+                         window: int = 100, subscriber_fraction: float = 0.3,
+                         codec: str = 'json', seed: int = 42) -> Dict[str, Any]:
+    """Run every (agents, mix) scenario and return the results with run metadata."""
+    scenarios = []
+    for agent_count in agent_counts:
+        for mix in mixes:
+            benchmark = BrokerBenchmark(agent_count, mix, message_count, window,
+                                        subscriber_fraction, codec, seed)
+            scenarios.append(await benchmark.run())
+
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'timestamp': datetime.now().isoformat(),
+        'settings': {
+            'messages': message_count,
+            'window': window,
+            'subscriber_fraction': subscriber_fraction,
+            'codec': codec,
+            'seed': seed
+        },
+        'scenarios': scenarios
+    }
+
+
+def _relative_change(current: float, baseline: float) -> float:
+    return current / baseline - 1 if baseline else 0.0
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Relative change of throughput, p99 latency and CPU per scenario."""
+    previous = {(s['agents'], s['mix']): s for s in baseline.get('scenarios', [])}
+    changes = []
+    for scenario in current['scenarios']:
+        old = previous.get((scenario['agents'], scenario['mix']))
+        if old is None:
+            continue
+        changes.append({
+            'agents': scenario['agents'],
+            'mix': scenario['mix'],
+            'messages_per_sec_change': scenario['messages_per_sec'] / old['messages_per_sec'] - 1,
+            'p99_latency_change': _relative_change(scenario['latency_ms']['p99'], old['latency_ms']['p99']),
+            'broker_p99_latency_change': _relative_change(scenario['broker_latency_ms']['p99'],
+                                                          old['broker_latency_ms']['p99']),
+            'cpu_per_message_change': scenario['cpu_us_per_message'] / old['cpu_us_per_message'] - 1
+        })
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Message broker throughput and latency benchmark")
+    parser.add_argument('--agents', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--mix', nargs='+', choices=sorted(MIXES), default=['heartbeat', 'alert', 'broadcast', 'mixed'])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--window', type=int, default=100, help="Messages in flight")
+    parser.add_argument('--subscribers', type=float, default=0.3,
+                        help="Probability of an agent subscribing to each alert pattern")
+    parser.add_argument('--codec', choices=['json', 'binary'], default='json')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true', help="Emit results as JSON")
+    parser.add_argument('--output', help="Also write JSON results to this file")
+    parser.add_argument('--compare', help="Baseline JSON results to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run_benchmarks(args.agents, args.mix, args.messages, args.window,
+                                         args.subscribers, args.codec, args.seed))
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            results['comparison'] = compare_results(json.load(baseline_file), results)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'agents':>7} {'mix':<10} {'msg/s':>10} {'deliv/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'broker p99':>10} {'cpu us/msg':>11}")
+    for s in results['scenarios']:
+        print(f"{s['agents']:>7} {s['mix']:<10} {s['messages_per_sec']:>10,.0f} {s['deliveries_per_sec']:>10,.0f} "
+              f"{s['latency_ms']['p50']:>8.2f} {s['latency_ms']['p99']:>8.2f} {s['broker_latency_ms']['p99']:>10.2f} {s['cpu_us_per_message']:>11.1f}")
+
+    for change in results.get('comparison', []):
+        print(f"{change['agents']:>7} {change['mix']:<10} throughput {change['messages_per_sec_change']:+.1%} "
+              f"p99 {change['p99_latency_change']:+.1%} broker p99 {change['broker_p99_latency_change']:+.1%} cpu {change['cpu_per_message_change']:+.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Codec Micro-Benchmark for pfSense Multi-Agent System
+
+Compares encode/decode throughput of the legacy AgentMessage JSON path with the
+registered wire codecs on realistic heartbeat and log-batch payloads, with and
+without deflate compression of the encoded body.
+
+Usage:
+    python -m core.codec_benchmark [--iterations N] [--json]
+"""
+
+import argparse
+import json
+import timeit
+import uuid
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from .base_agent import AgentMessage
+from .compression import MessageCompressor, decompress
+from .message_codec import BinaryCodec, JsonCodec, MessageCodec
+
+
+def _legacy_encode(message: AgentMessage) -> bytes:
+    """Serialization path used before codecs existed (asdict + isoformat)."""
+    data = asdict(message)
+    data['timestamp'] = message.timestamp.isoformat()
+    return json.dumps(data, default=str).encode()
+
+
+def _legacy_decode(body: bytes) -> AgentMessage:
+    """Deserialization path used before codecs existed."""
+    data = json.loads(body.decode())
+    data['timestamp'] = datetime.fromisoformat(data['timestamp'])
+    return AgentMessage(**data)
+
+
+def build_heartbeat_message() -> AgentMessage:
+    """Heartbeat as sent by BaseAgent.send_heartbeat."""
+    now = datetime.now()
+    return AgentMessage(
+        id=str(uuid.uuid4()),
+        sender_id='log_analyzer_03',
+        recipient_id=None,
+        message_type='heartbeat',
+        topic='system.heartbeat',
+        payload={
+            'agent_id': 'log_analyzer_03',
+            'agent_type': 'log_analyzer',
+            'status': 'healthy',
+            'stats': {
+                'messages_sent': 18234,
+                'messages_received': 9121,
+                'errors': 3,
+                'start_time': (now - timedelta(hours=6)).isoformat(),
+                'last_activity': now.isoformat()
+            },
+            'timestamp': now.isoformat()
+        },
+        timestamp=now
+    )
+
+
+def build_log_batch_message(entries: int = 50) -> AgentMessage:
+    """Batch of parsed firewall log entries as built by the log analyzer."""
+    now = datetime.now()
+    log_data: List[Dict[str, Any]] = [
+        {
+            'timestamp': (now - timedelta(seconds=i)).isoformat(),
+            'message': f'block in on em0: (tos 0x0, ttl 52, id {40000 + i}, proto TCP (6)) '
+                       f'203.0.113.{i % 250}:{51000 + i} > 192.168.1.10:22: Flags [S]',
+            'parsed_fields': {
+                'action': 'block',
+                'interface': 'em0',
+                'protocol': 'TCP',
+                'src_ip': f'203.0.113.{i % 250}',
+                'dst_ip': '192.168.1.10',
+                'src_port': str(51000 + i),
+                'dst_port': '22'
+            }
+        }
+        for i in range(entries)
+    ]
+    return AgentMessage(
+        id=str(uuid.uuid4()),
+        sender_id='log_analyzer_01',
+        recipient_id='orchestrator',
+        message_type='log_batch',
+        topic='pfsense.logs',
+        payload={'log_type': 'firewall', 'entries': log_data},
+        timestamp=now,
+        priority=2
+    )
+
+
+def _measure(func, iterations: int) -> float:
+    """Return operations per second for func, best of three runs."""
+    best = min(timeit.repeat(func, number=iterations, repeat=3))
+    return iterations / best
+
+
+def run_benchmark(iterations: int = 20000) -> Dict[str, Dict[str, Any]]:
+    """Run the benchmark and return results keyed by payload then codec."""
+    messages = {
+        'heartbeat': build_heartbeat_message(),
+        'log_batch': build_log_batch_message()
+    }
+    codecs: Dict[str, MessageCodec] = {
+        'json': JsonCodec(),
+        'binary': BinaryCodec()
+    }
+    # Threshold 1 compresses every body, to show the cost on small ones too
+    compressor = MessageCompressor(threshold=1, min_ratio=0)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for payload_name, message in messages.items():
+        # Large payloads are much slower; keep the run time comparable
+        count = iterations if payload_name == 'heartbeat' else max(iterations // 20, 100)
+        body = _legacy_encode(message)
+        payload_results = {
+            'legacy': {
+                'encode_ops': _measure(lambda: _legacy_encode(message), count),
+                'decode_ops': _measure(lambda: _legacy_decode(body), count),
+                'size_bytes': len(body)
+            }
+        }
+
+        for codec_name, codec in codecs.items():
+            body = codec.encode(message)
+            payload_results[codec_name] = {
+                'encode_ops': _measure(lambda: codec.encode(message), count),
+                'decode_ops': _measure(lambda: AgentMessage(**codec.decode_fields(body)), count),
+                'size_bytes': len(body)
+            }
+
+            wire_body, encoding = compressor.compress(message.topic, body)
+            payload_results[f'{codec_name}+deflate'] = {
+                'encode_ops': _measure(lambda: compressor.compress(message.topic, codec.encode(message)), count),
+                'decode_ops': _measure(
+                    lambda: AgentMessage(**codec.decode_fields(decompress(wire_body, encoding))), count
+                ),
+                'size_bytes': len(wire_body)
+            }
+
+        results[payload_name] = payload_results
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AgentMessage codec micro-benchmark")
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--json', action='store_true', help="Emit results as JSON")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.iterations)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for payload_name, payload_results in results.items():
+        print(f"\n{payload_name}")
+        print(f"  {'codec':<15} {'encode/s':>12} {'decode/s':>12} {'bytes':>8}")
+        for codec_name, result in payload_results.items():
+            print(f"  {codec_name:<15} {result['encode_ops']:>12,.0f} "
+                  f"{result['decode_ops']:>12,.0f} {result['size_bytes']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Payload Compression for pfSense Multi-Agent System
+
+This module provides threshold-based compression of encoded message bodies.
+Compression is independent of the wire codec: a compressed body is flagged
+with the standard AMQP content_encoding property, and receivers decompress
+before selecting a decoder from the content type. Large statistics reports,
+analysis results and traffic baselines are repetitive JSON and typically
+shrink several times, while small messages such as heartbeats are sent as
+they are.
+"""
+
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .topic_trie import topic_matches
+
+
+DEFLATE_ENCODING = 'deflate'
+
+# Content encodings this process can decompress, advertised to the broker
+SUPPORTED_ENCODINGS: List[str] = [DEFLATE_ENCODING]
+
+# Threshold pattern reported for topics that use the default threshold
+DEFAULT_PATTERN = 'default'
+
+
+def decompress(body: bytes, content_encoding: Optional[str]) -> bytes:
+    """Undo the content encoding of a received body."""
+    if not content_encoding or content_encoding == 'identity':
+        return body
+    if content_encoding == DEFLATE_ENCODING:
+        return zlib.decompress(body)
+    raise ValueError(f"Unsupported content encoding: {content_encoding}")
+
+
+class MessageCompressor:
+    """
+    Compresses encoded bodies at or above a size threshold.
+
+    threshold is the default minimum body size in bytes; 0 turns compression
+    off entirely. topic_thresholds maps AMQP topic patterns to their own
+    minimum, and when several patterns match a topic the lowest applies.
+    Bodies that do not shrink by at least min_ratio are sent uncompressed,
+    so receivers do not pay for decompressing them. observer is called with
+    the threshold pattern that applied rather than the topic, so per-agent
+    topics do not each get their own series.
+    """
+
+    def __init__(self,
+                 threshold: int = 0,
+                 topic_thresholds: Optional[Dict[str, int]] = None,
+                 level: int = 6,
+                 min_ratio: float = 1.1,
+                 observer: Optional[Callable[[str, int, int], None]] = None):
+        self.threshold = threshold
+        self.topic_thresholds = topic_thresholds or {}
+        self.level = level
+        self.min_ratio = min_ratio
+        self.observer = observer
+        self._thresholds_by_topic: Dict[str, Tuple[int, str]] = {}
+
+        self.stats = {
+            'compressed': 0,
+            'incompressible': 0,
+            'bytes_in': 0,
+            'bytes_out': 0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def threshold_for(self, topic: str) -> int:
+        """Minimum body size to compress on a topic, resolved once per topic."""
+        return self._resolve(topic)[0]
+
+    def _resolve(self, topic: str) -> Tuple[int, str]:
+        resolved = self._thresholds_by_topic.get(topic)
+        if resolved is None:
+            matched = [(value, pattern) for pattern, value in self.topic_thresholds.items()
+                       if topic_matches(pattern, topic)]
+            resolved = min(matched) if matched else (self.threshold, DEFAULT_PATTERN)
+            self._thresholds_by_topic[topic] = resolved
+        return resolved
+
+    def compress(self, topic: str, body: bytes) -> Tuple[bytes, Optional[str]]:
+        """Return the body to publish and its content encoding (None if unchanged)."""
+        if not self.enabled:
+            return body, None
+        threshold, pattern = self._resolve(topic)
+        if len(body) < threshold:
+            return body, None
+
+        compressed = zlib.compress(body, self.level)
+        if self.observer:
+            self.observer(pattern, len(body), len(compressed))
+
+        if len(body) < len(compressed) * self.min_ratio:
+            self.stats['incompressible'] += 1
+            return body, None
+
+        self.stats['compressed'] += 1
+        self.stats['bytes_in'] += len(body)
+        self.stats['bytes_out'] += len(compressed)
+        return compressed, DEFLATE_ENCODING
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters and the overall ratio of compressed bodies."""
+        stats = self.stats.copy()
+        stats['ratio'] = stats['bytes_in'] / stats['bytes_out'] if stats['bytes_out'] else 1.0
+        return stats
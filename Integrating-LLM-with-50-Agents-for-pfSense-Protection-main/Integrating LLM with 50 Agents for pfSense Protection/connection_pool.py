@@ -0,0 +1,304 @@
+"""
+AMQP Connection Pool for pfSense Multi-Agent System
+
+This module provides a process-wide pool of shared RabbitMQ connections.
+Agents running in the same process get their own channel multiplexed on a
+small number of connections instead of opening a TCP connection each, and
+exchanges are declared once per connection rather than once per agent. It
+also selects the process-wide transport (RabbitMQ or in-process).
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+from .transport import ChannelCallback, MessageTransport
+from .inprocess_transport import get_inprocess_transport
+
+
+# Longest wait between attempts to re-establish a connection that is out of the pool
+MAX_RETRY_DELAY = 300.0
+
+
+@dataclass(eq=False)
+class PooledConnection:
+    """A shared connection and the channel leases opened on it."""
+    url: str
+    connection: Any
+    leases: Set[int] = field(default_factory=set)
+    declared_exchanges: Set[Tuple[str, str]] = field(default_factory=set)
+    closing: bool = False
+
+
+@dataclass
+class ChannelLease:
+    """A channel handed out to an agent, re-created after reconnects."""
+    lease_id: int
+    channel: Any
+    pooled: PooledConnection
+    on_reopen: Optional[ChannelCallback]
+
+
+class AMQPConnectionPool(MessageTransport):
+    """
+    Hands out channels on a small pool of shared AMQP connections.
+
+    A new connection is only opened when every existing connection for the
+    URL already carries max_channels_per_connection channels and the pool is
+    below max_connections. When a connection drops it is re-established in
+    the background and every lease on it gets a fresh channel through its
+    on_reopen callback. A connection still down after retry_attempts is taken
+    out of the pool, so no new channels are leased on it, and retried with
+    exponential backoff up to MAX_RETRY_DELAY until it is back or the pool
+    is closed.
+    """
+
+    def __init__(self,
+                 max_connections: int = 2,
+                 max_channels_per_connection: int = 32,
+                 retry_attempts: int = 3,
+                 retry_delay: int = 5):
+        self.logger = logging.getLogger(__name__)
+        self.max_connections = max_connections
+        self.max_channels_per_connection = max_channels_per_connection
+        self.retry_attempts = retry_attempts
+        self.retry_delay = retry_delay
+
+        self.connections: Dict[str, List[PooledConnection]] = {}
+        self.leases: Dict[int, ChannelLease] = {}
+        # Dropped connections taken out of the pool while they are retried
+        self.reconnecting: List[PooledConnection] = []
+        self._next_lease_id = 0
+        self._lock = asyncio.Lock()
+
+        self.stats = {
+            'connections_opened': 0,
+            'channels_opened': 0,
+            'exchanges_declared': 0,
+            'reconnects': 0,
+            'connections_removed': 0
+        }
+
+    async def acquire_channel(self, url: str, on_reopen: Optional[ChannelCallback] = None) -> Any:
+        """
+        Get a channel on a shared connection.
+
+        Args:
+            url: AMQP URL of the RabbitMQ server
+            on_reopen: Called with the replacement channel after a reconnect
+
+        Returns:
+            An open channel
+        """
+        async with self._lock:
+            pooled = await self._select_connection(url)
+
+            channel = await pooled.connection.channel()
+            self.stats['channels_opened'] += 1
+
+            self._next_lease_id += 1
+            lease = ChannelLease(
+                lease_id=self._next_lease_id,
+                channel=channel,
+                pooled=pooled,
+                on_reopen=on_reopen
+            )
+            self.leases[lease.lease_id] = lease
+            pooled.leases.add(lease.lease_id)
+
+            return channel
+
+    async def release_channel(self, channel: Any):
+        """Close a channel and return its slot to the pool."""
+        for lease_id, lease in list(self.leases.items()):
+            if lease.channel is channel:
+                del self.leases[lease_id]
+                lease.pooled.leases.discard(lease_id)
+                await channel.close()
+                return
+
+    async def declare_exchange(self,
+                               channel: Any,
+                               exchange: str = 'pfsense_agents',
+                               exchange_type: str = 'topic'):
+        """Declare an exchange unless it was already declared on this connection."""
+        pooled = self._pooled_for_channel(channel)
+        key = (exchange, exchange_type)
+
+        if pooled is not None and key in pooled.declared_exchanges:
+            return
+
+        await channel.exchange_declare(
+            exchange=exchange,
+            exchange_type=exchange_type,
+            durable=True
+        )
+        self.stats['exchanges_declared'] += 1
+
+        if pooled is not None:
+            pooled.declared_exchanges.add(key)
+
+    async def close(self):
+        """Close all pooled connections."""
+        for pooled_connections in self.connections.values():
+            for pooled in pooled_connections:
+                pooled.closing = True
+                await pooled.connection.close()
+        for pooled in self.reconnecting:
+            pooled.closing = True
+
+        self.connections.clear()
+        self.reconnecting.clear()
+        self.leases.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pool statistics."""
+        stats = self.stats.copy()
+        stats['open_connections'] = sum(len(pool) for pool in self.connections.values())
+        stats['open_channels'] = len(self.leases)
+        stats['reconnecting'] = len(self.reconnecting)
+        return stats
+
+    async def _select_connection(self, url: str) -> PooledConnection:
+        """Pick the least loaded connection, opening a new one if all are full."""
+        pool = self.connections.setdefault(url, [])
+
+        least_loaded = min(pool, key=lambda pooled: len(pooled.leases), default=None)
+
+        if least_loaded is None or (
+                len(least_loaded.leases) >= self.max_channels_per_connection
+                and len(pool) < self.max_connections):
+            least_loaded = PooledConnection(url=url, connection=await self._connect(url))
+            pool.append(least_loaded)
+            self._watch_connection(least_loaded)
+
+        return least_loaded
+
+    async def _connect(self, url: str) -> Any:
+        """Open a new AMQP connection."""
+        connection = await AsyncioConnection.create(pika.URLParameters(url))
+        self.stats['connections_opened'] += 1
+        self.logger.info(f"Opened pooled AMQP connection ({self.stats['connections_opened']} total)")
+        return connection
+
+    def _watch_connection(self, pooled: PooledConnection):
+        """Reconnect in the background when the connection is lost."""
+        def on_close(connection, reason):
+            if not pooled.closing:
+                self.logger.warning(f"Pooled AMQP connection lost: {reason}")
+                asyncio.create_task(self._reconnect(pooled))
+
+        pooled.connection.add_on_close_callback(on_close)
+
+    async def _reconnect(self, pooled: PooledConnection):
+        """Re-open a dropped connection and hand fresh channels to its leases."""
+        attempt = 0
+        delay = self.retry_delay
+        while not pooled.closing:
+            attempt += 1
+            try:
+                pooled.connection = await self._connect(pooled.url)
+                pooled.declared_exchanges.clear()
+                self._watch_connection(pooled)
+                self.stats['reconnects'] += 1
+                break
+            except Exception as e:
+                self.logger.error(f"Reconnect attempt {attempt} failed: {e}")
+
+            if attempt >= self.retry_attempts:
+                self._remove_from_pool(pooled)
+                self.logger.error(
+                    f"Pooled connection to {pooled.url} still down, "
+                    f"{len(pooled.leases)} channels waiting; retrying in {delay:.1f}s"
+                )
+            await asyncio.sleep(delay)
+            if attempt >= self.retry_attempts:
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+        else:
+            return
+
+        if pooled in self.reconnecting:
+            self.reconnecting.remove(pooled)
+            self.connections.setdefault(pooled.url, []).append(pooled)
+
+        for lease_id in list(pooled.leases):
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                continue
+
+            try:
+                lease.channel = await pooled.connection.channel()
+                self.stats['channels_opened'] += 1
+                if lease.on_reopen:
+                    await lease.on_reopen(lease.channel)
+            except Exception as e:
+                self.logger.error(f"Error reopening channel for lease {lease_id}: {e}")
+
+    def _remove_from_pool(self, pooled: PooledConnection):
+        """Stop leasing channels on a dropped connection while it is retried."""
+        pool = self.connections.get(pooled.url, [])
+        if pooled in pool:
+            pool.remove(pooled)
+            self.reconnecting.append(pooled)
+            self.stats['connections_removed'] += 1
+            self.logger.error(f"Removed pooled connection to {pooled.url} from the pool "
+                              f"after {self.retry_attempts} failed reconnect attempts")
+
+    def _pooled_for_channel(self, channel: Any) -> Optional[PooledConnection]:
+        """Find the pooled connection a channel belongs to."""
+        for lease in self.leases.values():
+            if lease.channel is channel:
+                return lease.pooled
+        return None
+
+
+# Singleton instance shared by all agents in the process
+_connection_pool = None
+
+def get_connection_pool(max_connections: int = 2,
+                        max_channels_per_connection: int = 32,
+                        retry_attempts: int = 3,
+                        retry_delay: int = 5) -> AMQPConnectionPool:
+    """Get the process-wide AMQP connection pool (settings apply on first call)."""
+    global _connection_pool
+    if _connection_pool is None:
+        _connection_pool = AMQPConnectionPool(
+            max_connections=max_connections,
+            max_channels_per_connection=max_channels_per_connection,
+            retry_attempts=retry_attempts,
+            retry_delay=retry_delay
+        )
+    return _connection_pool
+
+
+def get_transport(transport: str = 'amqp',
+                  max_connections: int = 2,
+                  max_channels_per_connection: int = 32,
+                  retry_attempts: int = 3,
+                  retry_delay: int = 5) -> MessageTransport:
+    """
+    Get the process-wide transport selected by communication.transport.
+
+    Args:
+        transport: 'amqp' for RabbitMQ through the connection pool, or
+            'inprocess' to keep all messaging inside this process
+        max_connections: Pool size, for the first AMQP call only
+        max_channels_per_connection: Channels per pooled connection
+        retry_attempts: Attempts to open or re-establish a pooled connection
+        retry_delay: Seconds between those attempts
+    """
+    if transport == 'inprocess':
+        return get_inprocess_transport()
+    if transport != 'amqp':
+        raise ValueError(f"Unknown transport: {transport}")
+
+    return get_connection_pool(
+        max_connections=max_connections,
+        max_channels_per_connection=max_channels_per_connection,
+        retry_attempts=retry_attempts,
+        retry_delay=retry_delay
+    )
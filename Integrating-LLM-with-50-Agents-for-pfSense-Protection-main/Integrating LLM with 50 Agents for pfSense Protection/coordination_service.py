@@ -83,7 +83,7 @@ class CoordinationService:
     - Performance monitoring and optimization
     """
     
-    def __init__(self, message_broker):
+    def __init__(self, message_broker, llm_config: Dict[str, Any] = None):
         self.message_broker = message_broker
         self.logger = logging.getLogger(__name__)
         
@@ -104,7 +104,7 @@ class CoordinationService:
         self.agent_performance: Dict[str, Dict[str, float]] = {}
         
         # LLM client for decision making
-        self.llm_client = get_llm_client()
+        self.llm_client = get_llm_client(llm_config)
         
         # Background tasks
         self.background_tasks: Set[asyncio.Task] = set()
@@ -0,0 +1,146 @@
+"""
+Message Deduplication for pfSense Multi-Agent System
+
+This module provides the bounded window of recently seen message IDs used
+by agents and the message broker to drop duplicate deliveries, such as
+messages redelivered after a reconnect or republished by a sender retrying
+an unconfirmed publish.
+"""
+
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class RotatingBloomFilter:
+    """
+    Two-generation Bloom filter over a sliding window of keys.
+
+    Keys are added to the current generation and looked up in both; when the
+    current generation reaches capacity keys or rotate_interval seconds, the
+    older one is discarded. A key is therefore remembered for at least one
+    generation, at a false-positive rate of about error_rate per generation.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001, rotate_interval: float = 600.0):
+        self.capacity = capacity
+        self.rotate_interval = rotate_interval
+
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+
+        self._current = bytearray((self.num_bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._count = 0
+        self._rotated_at = time.monotonic()
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key: str):
+        if self._count >= self.capacity or time.monotonic() - self._rotated_at >= self.rotate_interval:
+            self._rotate()
+
+        for position in self._positions(key):
+            self._current[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+
+    def __contains__(self, key: str) -> bool:
+        positions = self._positions(key)
+        return any(
+            all(bits[position >> 3] & (1 << (position & 7)) for position in positions)
+            for bits in (self._current, self._previous)
+        )
+
+    def _rotate(self):
+        self._previous = self._current
+        self._current = bytearray(len(self._previous))
+        self._count = 0
+        self._rotated_at = time.monotonic()
+
+
+class DedupeCache:
+    """
+    Window of recently seen message IDs.
+
+    IDs are kept exactly in an LRU of at most max_entries, each for ttl
+    seconds after it was last seen. For windows too large to hold exactly,
+    bloom_capacity enables a rotating Bloom filter that keeps remembering
+    IDs after they leave the LRU; it can report a small fraction of new IDs
+    as duplicates (bloom_error_rate), so leave it off where dropping a
+    message is worse than handling it twice.
+    """
+
+    def __init__(self,
+                 max_entries: int = 10000,
+                 ttl: float = 600.0,
+                 bloom_capacity: int = 0,
+                 bloom_error_rate: float = 0.0001):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._seen: 'OrderedDict[str, float]' = OrderedDict()
+        self.bloom: Optional[RotatingBloomFilter] = (
+            RotatingBloomFilter(bloom_capacity, bloom_error_rate, ttl) if bloom_capacity > 0 else None
+        )
+
+        self.stats = {
+            'checks': 0,
+            'hits': 0,
+            'bloom_hits': 0,
+            'evictions': 0,
+            'expirations': 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def seen(self, message_id: Optional[str]) -> bool:
+        """Record a message ID; returns True if it was already in the window."""
+        if not message_id:
+            return False
+
+        now = time.monotonic()
+        self.stats['checks'] += 1
+        self._expire(now)
+
+        if message_id in self._seen:
+            # Keep suppressing a message for as long as it keeps coming back
+            self._seen.move_to_end(message_id)
+            self._seen[message_id] = now
+            self.stats['hits'] += 1
+            return True
+
+        if self.bloom is not None:
+            if message_id in self.bloom:
+                self.stats['hits'] += 1
+                self.stats['bloom_hits'] += 1
+                return True
+            self.bloom.add(message_id)
+
+        self._seen[message_id] = now
+        if len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+            self.stats['evictions'] += 1
+        return False
+
+    def _expire(self, now: float):
+        """Drop IDs older than the TTL; the LRU is ordered by last sighting."""
+        deadline = now - self.ttl
+        while self._seen:
+            message_id, seen_at = next(iter(self._seen.items()))
+            if seen_at > deadline:
+                break
+            del self._seen[message_id]
+            self.stats['expirations'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters, current size and hit rate."""
+        stats = self.stats.copy()
+        stats['entries'] = len(self._seen)
+        stats['hit_rate'] = stats['hits'] / stats['checks'] if stats['checks'] else 0.0
+        return stats
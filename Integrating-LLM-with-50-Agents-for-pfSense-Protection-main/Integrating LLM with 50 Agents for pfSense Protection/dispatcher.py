@@ -0,0 +1,128 @@
+"""
+Message Dispatcher for pfSense Multi-Agent System
+
+This module runs agent message handlers concurrently. Each message type gets
+its own concurrency limit, so a slow LLM-backed handler can no longer hold up
+heartbeats, registrations and task results queued behind it.
+"""
+
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from .histogram import LatencyHistogram
+
+
+class MessageDispatcher:
+    """
+    Dispatches messages to a handler as tasks under per-type semaphores.
+
+    A limit of 0 (or None) runs handlers for that type without bound, a
+    limit of 1 processes that type strictly in arrival order, and any other
+    value caps how many handlers of the type run at once. Types without an
+    explicit limit use default_limit.
+    
+    Handler latencies are kept in per-type histograms and, if given, passed
+    to latency_observer as (message_type, seconds).
+    
+    At most max_pending handlers (running or waiting for their type's
+    semaphore) exist at once; beyond that dispatch() waits, leaving further
+    messages in the agent's priority queue where ordering and shedding apply.
+    """
+
+    def __init__(self,
+                 handler: Callable[[Any], Awaitable[None]],
+                 concurrency_limits: Optional[Dict[str, int]] = None,
+                 default_limit: int = 8,
+                 max_pending: int = 100,
+                 latency_observer: Optional[Callable[[str, float], None]] = None,
+                 logger: Optional[logging.Logger] = None):
+        self.handler = handler
+        self.latency_observer = latency_observer
+        self.concurrency_limits = concurrency_limits or {}
+        self.default_limit = default_limit
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._semaphores: Dict[str, Optional[asyncio.Semaphore]] = {}
+        self._capacity = asyncio.Semaphore(max_pending)
+        self._tasks: Set[asyncio.Task] = set()
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self._latency: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self._accepting = True
+
+    async def dispatch(self, message: Any) -> Optional[asyncio.Task]:
+        """Start handling a message in the background; returns its task."""
+        if not self._accepting:
+            self.logger.debug(f"Dispatcher shutting down, dropping {message.message_type}")
+            return None
+
+        await self._capacity.acquire()
+
+        task = asyncio.create_task(self._run(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+        return task
+
+    def _on_task_done(self, task: asyncio.Task):
+        """Free the task's pending slot."""
+        self._tasks.discard(task)
+        self._capacity.release()
+
+    async def shutdown(self, timeout: float = 10.0):
+        """
+        Stop accepting messages and drain in-flight handlers.
+
+        Handlers still running after timeout seconds are cancelled, and the
+        cancellations are awaited so no handler outlives the agent.
+        """
+        self._accepting = False
+
+        if not self._tasks:
+            return
+
+        pending = set(self._tasks)
+        done, still_running = await asyncio.wait(pending, timeout=timeout)
+
+        for task in still_running:
+            task.cancel()
+        if still_running:
+            self.logger.warning(f"Cancelled {len(still_running)} message handlers on shutdown")
+            await asyncio.gather(*still_running, return_exceptions=True)
+
+    async def _run(self, message: Any):
+        """Run the handler for one message under its type's semaphore."""
+        message_type = message.message_type
+        semaphore = self._semaphore_for(message_type)
+
+        if semaphore is not None:
+            await semaphore.acquire()
+
+        self._in_flight[message_type] += 1
+        start_time = time.perf_counter()
+        try:
+            await self.handler(message)
+        finally:
+            elapsed = time.perf_counter() - start_time
+            self._latency[message_type].observe(elapsed * 1000)
+            if self.latency_observer is not None:
+                self.latency_observer(message_type, elapsed)
+            self._in_flight[message_type] -= 1
+            if semaphore is not None:
+                semaphore.release()
+
+    def _semaphore_for(self, message_type: str) -> Optional[asyncio.Semaphore]:
+        """Get (creating on first use) the semaphore bounding a message type."""
+        if message_type not in self._semaphores:
+            limit = self.concurrency_limits.get(message_type, self.default_limit)
+            self._semaphores[message_type] = asyncio.Semaphore(limit) if limit else None
+        return self._semaphores[message_type]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """In-flight counts and per-type handler latency histograms."""
+        return {
+            'pending_tasks': len(self._tasks),
+            'in_flight': {t: n for t, n in self._in_flight.items() if n},
+            'handler_latency': {t: h.to_dict() for t, h in self._latency.items()}
+        }
@@ -0,0 +1,58 @@
+"""
+Latency Histogram for pfSense Multi-Agent System
+
+This module provides a small fixed-bucket histogram used to record handler
+and request latencies cheaply on hot paths and report them in status output.
+"""
+
+from bisect import bisect_left
+from typing import Any, Dict, Sequence
+
+
+DEFAULT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with approximate percentiles."""
+
+    def __init__(self, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)  # last slot is +Inf
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, latency_ms: float):
+        """Record one latency sample in milliseconds."""
+        self.counts[bisect_left(self.buckets_ms, latency_ms)] += 1
+        self.count += 1
+        self.total_ms += latency_ms
+        if latency_ms > self.max_ms:
+            self.max_ms = latency_ms
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bucket bound containing the given fraction of samples."""
+        if not self.count:
+            return 0.0
+
+        threshold = fraction * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= threshold:
+                return self.buckets_ms[index] if index < len(self.buckets_ms) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Summary suitable for JSON status responses."""
+        buckets = {f"le_{bound}": count for bound, count in zip(self.buckets_ms, self.counts)}
+        buckets['le_inf'] = self.counts[-1]
+
+        return {
+            'count': self.count,
+            'avg_ms': self.total_ms / self.count if self.count else 0.0,
+            'max_ms': self.max_ms,
+            'p50_ms': self.percentile(0.5),
+            'p99_ms': self.percentile(0.99),
+            'buckets': buckets
+        }
@@ -0,0 +1,83 @@
+"""
+History Streaming for pfSense Multi-Agent System
+
+This module provides the opaque pagination cursors and the chunked NDJSON
+writer used by the message broker's history endpoints. Stored message bodies
+are already compact JSON, so each NDJSON line wraps the stored bytes as-is
+instead of parsing and re-serializing them.
+"""
+
+import base64
+import json
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+
+def encode_cursor(state: Dict[str, Any]) -> str:
+    """Pack a resume position into an opaque URL-safe token."""
+    raw = json.dumps(state, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> Dict[str, Any]:
+    """Unpack a token created by encode_cursor; raises ValueError if invalid."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {e}")
+
+    if not isinstance(state, dict):
+        raise ValueError("invalid cursor")
+    return state
+
+
+def ndjson_record(body: bytes, offset: Optional[int] = None) -> bytes:
+    """Wrap a stored JSON message body as one NDJSON line without re-encoding it."""
+    if offset is None:
+        return b'{"message":' + body + b'}\n'
+    return b'{"offset":%d,"message":' % offset + body + b'}\n'
+
+
+class NdjsonStream:
+    """
+    Chunked NDJSON response that coalesces lines into writes of chunk_size.
+
+    The response is prepared on start() so the status line and headers reach
+    the client before the first record is read from storage.
+    """
+
+    def __init__(self, request: web.Request, chunk_size: int = 16384):
+        self.request = request
+        self.chunk_size = chunk_size
+        self.response = web.StreamResponse(headers={'Content-Type': NDJSON_CONTENT_TYPE})
+        self.response.enable_chunked_encoding()
+        self._buffer = bytearray()
+        self.lines_written = 0
+
+    async def start(self):
+        await self.response.prepare(self.request)
+
+    async def write_line(self, line: bytes):
+        """Buffer one line, writing the buffer out once it reaches chunk_size."""
+        self._buffer += line
+        self.lines_written += 1
+        if len(self._buffer) >= self.chunk_size:
+            await self._drain()
+
+    async def finish(self, trailer: Optional[Dict[str, Any]] = None) -> web.StreamResponse:
+        """Write an optional final JSON line and end the response."""
+        if trailer is not None:
+            self._buffer += json.dumps(trailer, separators=(',', ':')).encode() + b'\n'
+        await self._drain()
+        await self.response.write_eof()
+        return self.response
+
+    async def _drain(self):
+        if self._buffer:
+            await self.response.write(bytes(self._buffer))
+            self._buffer.clear()
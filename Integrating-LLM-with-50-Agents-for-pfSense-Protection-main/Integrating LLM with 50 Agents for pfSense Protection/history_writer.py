@@ -0,0 +1,162 @@
+"""
+History Writer for pfSense Multi-Agent System
+
+This module persists per-agent message history to Redis in the background.
+Routing only appends to an in-memory buffer; the writer flushes the buffer as
+pipelined batches with the per-agent length cap applied in the same pipeline,
+and sheds history instead of slowing routing down when Redis falls behind.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+class RedisHistoryWriter:
+    """
+    Buffered, pipelined writer for the messages:{agent_id} history lists.
+
+    A flush is triggered when batch_size records are buffered or
+    flush_interval_ms has passed. Each flush sends one LPUSH per agent with
+    all of its new bodies followed by an LTRIM to max_length, in a single
+    non-transactional pipeline. When more than max_pending records are
+    waiting the oldest are dropped, and a flush that fails with one of
+    timeout_errors is counted as a timeout and its records shed, so a slow
+    Redis only ever costs history, never routing latency.
+
+    The flush is never cancelled part way: that could leave pipeline replies
+    unread on a pooled connection, to be taken as the replies of the next
+    command. Bound it with the Redis client's socket_timeout instead, and
+    pass the client's timeout exception as timeout_errors.
+    """
+
+    def __init__(self,
+                 redis_client: Any,
+                 max_length: int = 1000,
+                 batch_size: int = 200,
+                 flush_interval_ms: int = 100,
+                 max_pending: int = 10000,
+                 timeout_errors: Tuple[type, ...] = (asyncio.TimeoutError,),
+                 logger: Optional[logging.Logger] = None):
+        self.redis_client = redis_client
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self.timeout_errors = timeout_errors
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._pending: Deque[Tuple[str, bytes]] = deque()
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.stats = {
+            'records_written': 0,
+            'records_shed': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'flush_timeouts': 0,
+            'last_flush_size': 0,
+            'last_flush_latency_ms': 0.0,
+            'max_flush_latency_ms': 0.0
+        }
+
+    def record(self, agent_id: str, body: bytes):
+        """Buffer one history entry for an agent; never waits on Redis."""
+        if len(self._pending) >= self.max_pending:
+            self._pending.popleft()
+            self.stats['records_shed'] += 1
+
+        self._pending.append((agent_id, body))
+
+        if len(self._pending) >= self.batch_size:
+            self._flush_requested.set()
+
+    def start(self) -> asyncio.Task:
+        """Start the background flush task."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        """Stop the flush task and write out what is still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        await self.flush()
+
+    async def flush(self):
+        """Write everything buffered so far in one pipeline."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            batch, self._pending = self._pending, deque()
+            by_agent = self._group_by_agent(batch)
+
+            pipe = self.redis_client.pipeline(transaction=False)
+            for agent_id, bodies in by_agent.items():
+                key = f'messages:{agent_id}'
+                pipe.lpush(key, *bodies)
+                pipe.ltrim(key, 0, self.max_length - 1)
+
+            start_time = time.perf_counter()
+            try:
+                await pipe.execute()
+            except self.timeout_errors:
+                self.stats['flush_timeouts'] += 1
+                self.stats['records_shed'] += len(batch)
+                self.logger.warning(f"Redis history flush timed out, shed {len(batch)} records")
+                return
+            except Exception as e:
+                self.stats['flush_errors'] += 1
+                self.stats['records_shed'] += len(batch)
+                self.logger.error(f"Error flushing message history: {e}")
+                return
+
+            latency_ms = (time.perf_counter() - start_time) * 1000
+            self.stats['flushes'] += 1
+            self.stats['records_written'] += len(batch)
+            self.stats['last_flush_size'] = len(batch)
+            self.stats['last_flush_latency_ms'] = latency_ms
+            self.stats['max_flush_latency_ms'] = max(self.stats['max_flush_latency_ms'], latency_ms)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get writer counters and the current backlog."""
+        stats = self.stats.copy()
+        stats['pending'] = len(self._pending)
+        return stats
+
+    async def _run(self):
+        """Flush on the size trigger or after flush_interval, whichever is first."""
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._flush_requested.clear()
+
+                await self.flush()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Error in history writer: {e}")
+
+    def _group_by_agent(self, batch: Deque[Tuple[str, bytes]]) -> Dict[str, List[bytes]]:
+        """Group a batch per agent, keeping at most max_length newest bodies each."""
+        by_agent: Dict[str, List[bytes]] = {}
+        for agent_id, body in batch:
+            by_agent.setdefault(agent_id, []).append(body)
+
+        for agent_id, bodies in by_agent.items():
+            if len(bodies) > self.max_length:
+                by_agent[agent_id] = bodies[-self.max_length:]
+
+        return by_agent
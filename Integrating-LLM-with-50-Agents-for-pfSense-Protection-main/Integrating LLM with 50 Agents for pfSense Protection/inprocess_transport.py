@@ -0,0 +1,336 @@
+"""
+In-Process Transport for pfSense Multi-Agent System
+
+This module provides an asyncio implementation of the message transport for
+single-node deployments and tests. Exchanges, queues and consumers live in
+the current process, so a message hop is a queue put instead of a network
+round trip, while agents and the broker keep using the same channel calls as
+with RabbitMQ: topic exchanges, per-agent queues, message priorities and
+explicit acknowledgements and per-message TTLs.
+"""
+
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .transport import ChannelCallback, MessageTransport
+from .topic_trie import TopicTrie
+
+
+@dataclass
+class QueuedMessage:
+    """A published message waiting in a queue."""
+    exchange: str
+    routing_key: str
+    body: bytes
+    properties: Any
+    priority: int = 0
+    redelivered: bool = False
+    expires_at: Optional[float] = None  # time.monotonic() deadline from the expiration property
+
+
+@dataclass
+class Delivery:
+    """Delivery information passed to consumers as the AMQP 'method' frame."""
+    delivery_tag: int
+    exchange: str
+    routing_key: str
+    redelivered: bool
+    consumer_tag: str
+
+
+class InProcessQueue:
+    """A named queue; higher priorities first, FIFO within a priority."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._heap: List[Tuple[int, int, QueuedMessage]] = []
+        self._sequence = itertools.count()
+        self._not_empty = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def put(self, message: QueuedMessage):
+        heapq.heappush(self._heap, (-message.priority, next(self._sequence), message))
+        self._not_empty.set()
+
+    async def get(self) -> QueuedMessage:
+        while not self._heap:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return heapq.heappop(self._heap)[2]
+
+
+class InProcessExchange:
+    """An exchange routing on its queue bindings."""
+
+    def __init__(self, name: str, exchange_type: str):
+        self.name = name
+        self.exchange_type = exchange_type
+        self.bindings = TopicTrie()
+
+    def bind(self, queue: str, routing_key: str):
+        # A fanout exchange ignores routing keys; '#' matches every key
+        self.bindings.add('#' if self.exchange_type == 'fanout' else routing_key, queue)
+
+    def unbind(self, queue: str, routing_key: str):
+        self.bindings.remove('#' if self.exchange_type == 'fanout' else routing_key, queue)
+
+    def route(self, routing_key: str) -> Set[str]:
+        return self.bindings.match(routing_key)
+
+
+class InProcessChannel:
+    """
+    Channel on the in-process transport.
+
+    Each basic_consume starts a consumer task that delivers one message at a
+    time and awaits the callback, like a pika channel. Deliveries stay
+    unacknowledged until basic_ack; basic_nack with requeue puts a message
+    back flagged as redelivered, and closing the channel requeues whatever
+    it has not acknowledged. As on RabbitMQ, a message past its TTL is
+    discarded when it reaches the head of the queue instead of delivered.
+    """
+
+    def __init__(self, transport: 'InProcessTransport', channel_number: int):
+        self.transport = transport
+        self.channel_number = channel_number
+        self.is_open = True
+
+        self._delivery_tags = itertools.count(1)
+        self._unacked: Dict[int, Tuple[InProcessQueue, QueuedMessage]] = {}
+        self._consumers: Dict[str, asyncio.Task] = {}
+
+    async def exchange_declare(self, exchange: str, exchange_type: str = 'direct', **kwargs):
+        self.transport.declare(exchange, exchange_type)
+
+    async def queue_declare(self, queue: str, **kwargs):
+        self.transport.queue(queue)
+
+    async def queue_bind(self, queue: str, exchange: str, routing_key: Optional[str] = None, **kwargs):
+        self.transport.exchange(exchange).bind(queue, routing_key or queue)
+        self.transport.queue(queue)
+
+    async def queue_unbind(self, queue: str, exchange: str, routing_key: Optional[str] = None, **kwargs):
+        self.transport.exchange(exchange).unbind(queue, routing_key or queue)
+
+    async def basic_consume(self,
+                            queue: str,
+                            on_message_callback: Callable,
+                            auto_ack: bool = False,
+                            consumer_tag: Optional[str] = None,
+                            **kwargs) -> str:
+        consumer_tag = consumer_tag or f'ctag{self.channel_number}.{len(self._consumers) + 1}'
+        self._consumers[consumer_tag] = asyncio.create_task(
+            self._consume(self.transport.queue(queue), on_message_callback, auto_ack, consumer_tag)
+        )
+        return consumer_tag
+
+    async def basic_cancel(self, consumer_tag: str, **kwargs):
+        task = self._consumers.pop(consumer_tag, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def basic_publish(self,
+                            exchange: str,
+                            routing_key: str,
+                            body: bytes,
+                            properties: Any = None,
+                            mandatory: bool = False,
+                            **kwargs):
+        self.transport.publish(exchange, routing_key, body, properties)
+
+    async def basic_ack(self, delivery_tag: int = 0, multiple: bool = False):
+        self.transport.stats['acked'] += len(self._settle(delivery_tag, multiple))
+
+    async def basic_nack(self, delivery_tag: int = 0, multiple: bool = False, requeue: bool = True):
+        for queue, message in self._settle(delivery_tag, multiple).values():
+            if requeue:
+                self._requeue(queue, message)
+            else:
+                self.transport.stats['rejected'] += 1
+
+    async def basic_reject(self, delivery_tag: int, requeue: bool = True):
+        await self.basic_nack(delivery_tag, requeue=requeue)
+
+    async def basic_qos(self, **kwargs):
+        """Accepted for compatibility; consumers already take one message at a time."""
+
+    async def confirm_delivery(self):
+        """Publishes are enqueued synchronously, so they are confirmed on return."""
+
+    async def close(self):
+        """Stop consumers and requeue unacknowledged deliveries."""
+        if not self.is_open:
+            return
+        self.is_open = False
+
+        for consumer_tag in list(self._consumers):
+            await self.basic_cancel(consumer_tag)
+
+        for queue, message in self._unacked.values():
+            self._requeue(queue, message)
+        self._unacked.clear()
+
+        self.transport.channels.discard(self)
+
+    async def _consume(self, queue: InProcessQueue, callback: Callable, auto_ack: bool, consumer_tag: str):
+        """Deliver messages from a queue to a consumer callback."""
+        while True:
+            message = await queue.get()
+            if message.expires_at is not None and message.expires_at <= time.monotonic():
+                self.transport.stats['expired'] += 1
+                continue
+
+            delivery_tag = next(self._delivery_tags)
+            if not auto_ack:
+                self._unacked[delivery_tag] = (queue, message)
+
+            method = Delivery(
+                delivery_tag=delivery_tag,
+                exchange=message.exchange,
+                routing_key=message.routing_key,
+                redelivered=message.redelivered,
+                consumer_tag=consumer_tag
+            )
+            self.transport.stats['delivered'] += 1
+
+            try:
+                result = callback(self, method, message.properties, message.body)
+                if inspect.isawaitable(result):
+                    await result
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.transport.logger.error(f"Error in consumer {consumer_tag}: {e}")
+
+    def _settle(self, delivery_tag: int, multiple: bool) -> Dict[int, Tuple[InProcessQueue, QueuedMessage]]:
+        """Remove and return the deliveries covered by an ack or nack."""
+        if multiple:
+            tags = [tag for tag in self._unacked if delivery_tag == 0 or tag <= delivery_tag]
+        else:
+            tags = [delivery_tag] if delivery_tag in self._unacked else []
+        return {tag: self._unacked.pop(tag) for tag in tags}
+
+    def _requeue(self, queue: InProcessQueue, message: QueuedMessage):
+        message.redelivered = True
+        queue.put(message)
+        self.transport.stats['requeued'] += 1
+
+
+class InProcessTransport(MessageTransport):
+    """
+    Message transport whose exchanges and queues live in this process.
+
+    Exchanges route with the same topic trie as the broker, so '*' and '#'
+    bindings behave as on a RabbitMQ topic exchange; the default exchange ''
+    routes to the queue named by the routing key. Bodies are shared between
+    the queues a message fans out to rather than copied.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+        self.exchanges: Dict[str, InProcessExchange] = {}
+        self.queues: Dict[str, InProcessQueue] = {}
+        self.channels: Set[InProcessChannel] = set()
+        self._channel_numbers = itertools.count(1)
+
+        self.stats = {
+            'published': 0,
+            'unroutable': 0,
+            'delivered': 0,
+            'acked': 0,
+            'rejected': 0,
+            'requeued': 0,
+            'expired': 0
+        }
+
+    async def acquire_channel(self, url: str = '', on_reopen: Optional[ChannelCallback] = None) -> InProcessChannel:
+        """Open a channel; the URL is ignored and channels are never dropped."""
+        channel = InProcessChannel(self, next(self._channel_numbers))
+        self.channels.add(channel)
+        return channel
+
+    async def release_channel(self, channel: InProcessChannel):
+        await channel.close()
+
+    async def declare_exchange(self,
+                               channel: Any,
+                               exchange: str = 'pfsense_agents',
+                               exchange_type: str = 'topic'):
+        self.declare(exchange, exchange_type)
+
+    async def close(self):
+        for channel in list(self.channels):
+            await channel.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self.stats.copy()
+        stats['open_channels'] = len(self.channels)
+        stats['queue_depths'] = {name: len(queue) for name, queue in self.queues.items() if len(queue)}
+        return stats
+
+    def declare(self, exchange: str, exchange_type: str = 'topic') -> InProcessExchange:
+        """Create an exchange unless it already exists."""
+        if exchange not in self.exchanges:
+            self.exchanges[exchange] = InProcessExchange(exchange, exchange_type)
+        return self.exchanges[exchange]
+
+    def exchange(self, exchange: str) -> InProcessExchange:
+        """Get a declared exchange; raises KeyError like a channel error would."""
+        try:
+            return self.exchanges[exchange]
+        except KeyError:
+            raise KeyError(f"Exchange not declared: {exchange}")
+
+    def queue(self, name: str) -> InProcessQueue:
+        """Get a queue, declaring it on first use."""
+        queue = self.queues.get(name)
+        if queue is None:
+            queue = self.queues[name] = InProcessQueue(name)
+        return queue
+
+    def publish(self, exchange: str, routing_key: str, body: bytes, properties: Any = None):
+        """Route a message to every bound queue."""
+        self.stats['published'] += 1
+
+        if exchange:
+            queue_names = self.exchange(exchange).route(routing_key)
+        else:
+            queue_names = {routing_key} if routing_key in self.queues else set()
+
+        if not queue_names:
+            self.stats['unroutable'] += 1
+            return
+
+        priority = getattr(properties, 'priority', None) or 0
+        expiration = getattr(properties, 'expiration', None)
+        expires_at = time.monotonic() + int(expiration) / 1000 if expiration is not None else None
+        for name in queue_names:
+            self.queues[name].put(QueuedMessage(
+                exchange=exchange,
+                routing_key=routing_key,
+                body=body,
+                properties=properties,
+                priority=priority,
+                expires_at=expires_at
+            ))
+
+
+# Singleton instance shared by all agents in the process
+_inprocess_transport = None
+
+def get_inprocess_transport() -> InProcessTransport:
+    """Get the process-wide in-process transport."""
+    global _inprocess_transport
+    if _inprocess_transport is None:
+        _inprocess_transport = InProcessTransport()
+    return _inprocess_transport
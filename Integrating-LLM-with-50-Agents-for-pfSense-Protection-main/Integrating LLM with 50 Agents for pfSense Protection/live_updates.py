@@ -0,0 +1,313 @@
+"""
+Live Updates for pfSense Multi-Agent System
+
+This module pushes broker activity to dashboard clients over a WebSocket.
+Clients subscribe to topic patterns, agent registry changes and periodic
+statistics; the hub coalesces everything that happened during a tick into a
+single frame per client, and a slow client only ever receives the latest
+state instead of building up a backlog.
+
+Client commands (JSON text frames):
+    {"subscribe": ["security.#", "system.alerts"]}
+    {"unsubscribe": ["security.#"]}
+    {"registry": true}    full registry snapshot, then per-agent deltas
+    {"stats": true}       broker statistics every stats_interval
+
+Server frames:
+    {"tick": 12, "messages": [{"topic": ..., "message": {...}}],
+     "registry": {"agent_id": {...} or null}, "stats": {...}, "dropped": 0}
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from aiohttp import WSMsgType, web
+
+from ..core.topic_trie import TopicTrie
+
+
+@dataclass
+class LiveClient:
+    """A connected WebSocket client and the frame waiting to be sent to it."""
+    client_id: int
+    ws: web.WebSocketResponse
+    max_pending_messages: int
+    patterns: Set[str] = field(default_factory=set)
+    registry: bool = False
+    stats: bool = False
+
+    # Pending frame contents, merged until the sender takes them
+    messages: Deque[str] = field(default_factory=deque)
+    registry_delta: Dict[str, str] = field(default_factory=dict)
+    latest_stats: Optional[str] = None
+    errors: List[str] = field(default_factory=list)
+    dropped: int = 0
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def queue_message(self, fragment: str):
+        """Add a message, dropping the oldest pending one when over the limit."""
+        if len(self.messages) >= self.max_pending_messages:
+            self.messages.popleft()
+            self.dropped += 1
+        self.messages.append(fragment)
+
+    def take_frame(self, tick: int) -> Optional[str]:
+        """Build the frame for everything pending and reset the pending state."""
+        if not (self.messages or self.registry_delta or self.latest_stats or self.errors):
+            return None
+
+        parts = [f'"tick":{tick}']
+        if self.messages:
+            parts.append('"messages":[' + ','.join(self.messages) + ']')
+        if self.registry_delta:
+            parts.append('"registry":{' + ','.join(
+                f'{json.dumps(agent_id)}:{data}' for agent_id, data in self.registry_delta.items()
+            ) + '}')
+        if self.latest_stats:
+            parts.append(f'"stats":{self.latest_stats}')
+        if self.errors:
+            parts.append('"errors":' + json.dumps(self.errors))
+        if self.dropped:
+            parts.append(f'"dropped":{self.dropped}')
+
+        self.messages.clear()
+        self.registry_delta = {}
+        self.latest_stats = None
+        self.errors = []
+        self.dropped = 0
+        return '{' + ','.join(parts) + '}'
+
+
+class LiveUpdateHub:
+    """
+    Fan-out of broker events to WebSocket clients.
+
+    The broker reports routed messages and registry changes as they happen;
+    they are buffered and processed once per tick. Each message's topic is
+    matched once against a trie of all client patterns, and every payload is
+    encoded once per tick no matter how many clients receive it. Each client
+    has one sender task: while a send is in flight, newer ticks merge into its
+    pending frame, where registry deltas and stats keep only the latest value
+    and messages beyond max_pending_messages are dropped oldest first.
+    """
+
+    def __init__(self,
+                 snapshot_provider: Callable[[], Dict[str, Dict[str, Any]]],
+                 stats_provider: Callable[[], Dict[str, Any]],
+                 tick_interval: float = 0.25,
+                 stats_interval: float = 5.0,
+                 max_pending_messages: int = 500,
+                 logger: Optional[logging.Logger] = None):
+        self.snapshot_provider = snapshot_provider
+        self.stats_provider = stats_provider
+        self.tick_interval = tick_interval
+        self.stats_interval = stats_interval
+        self.max_pending_messages = max_pending_messages
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.clients: Dict[int, LiveClient] = {}
+        self._client_ids = itertools.count(1)
+        self._topic_index = TopicTrie()
+
+        # Events since the last tick
+        self._messages: List[Tuple[str, bytes]] = []
+        self._registry_changes: Dict[str, Optional[Dict[str, Any]]] = {}
+
+        self._tick = 0
+        self._last_stats = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+        self.stats = {
+            'clients_connected': 0,
+            'frames_sent': 0,
+            'messages_pushed': 0,
+            'messages_dropped': 0
+        }
+
+    @property
+    def has_message_subscribers(self) -> bool:
+        return self._topic_index.stats['patterns'] > 0
+
+    @property
+    def has_registry_subscribers(self) -> bool:
+        return any(client.registry for client in self.clients.values())
+
+    def publish_message(self, topic: str, body: bytes):
+        """Report a routed message (JSON body) to topic subscribers."""
+        if self.has_message_subscribers:
+            self._messages.append((topic, body))
+
+    def registry_changed(self, agent_id: str, agent_data: Optional[Dict[str, Any]]):
+        """Report an agent's new state, or None once it has been removed."""
+        if self.has_registry_subscribers:
+            self._registry_changes[agent_id] = agent_data
+
+    def start(self) -> asyncio.Task:
+        """Start the tick loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._tick_loop())
+        return self._task
+
+    async def stop(self):
+        """Stop the tick loop and disconnect all clients."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        for client in list(self.clients.values()):
+            await client.ws.close()
+
+    async def handle_websocket(self, request: web.Request) -> web.WebSocketResponse:
+        """aiohttp handler for the live update WebSocket."""
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+
+        client = LiveClient(
+            client_id=next(self._client_ids),
+            ws=ws,
+            max_pending_messages=self.max_pending_messages
+        )
+        self.clients[client.client_id] = client
+        self.stats['clients_connected'] = len(self.clients)
+        sender = asyncio.create_task(self._send_loop(client))
+
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    self._handle_command(client, msg.data)
+                elif msg.type == WSMsgType.ERROR:
+                    self.logger.warning(f"Live client {client.client_id} error: {ws.exception()}")
+                    break
+        finally:
+            sender.cancel()
+            self._remove_client(client)
+
+        return ws
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.stats.copy()
+
+    def _handle_command(self, client: LiveClient, data: str):
+        """Apply a subscription command from a client."""
+        try:
+            command = json.loads(data)
+            if not isinstance(command, dict):
+                raise ValueError("command must be a JSON object")
+
+            for pattern in command.get('subscribe', []):
+                if pattern not in client.patterns:
+                    client.patterns.add(pattern)
+                    self._topic_index.add(pattern, client.client_id)
+
+            for pattern in command.get('unsubscribe', []):
+                if pattern in client.patterns:
+                    client.patterns.discard(pattern)
+                    self._topic_index.remove(pattern, client.client_id)
+
+            if 'registry' in command:
+                client.registry = bool(command['registry'])
+                if client.registry:
+                    # Start from a full snapshot so no initial poll is needed
+                    for agent_id, agent_data in self.snapshot_provider().items():
+                        client.registry_delta[agent_id] = json.dumps(agent_data, default=str)
+
+            if 'stats' in command:
+                client.stats = bool(command['stats'])
+                if client.stats:
+                    client.latest_stats = json.dumps(self.stats_provider(), default=str)
+
+        except Exception as e:
+            client.errors.append(f"Invalid command: {e}")
+
+        client.ready.set()
+
+    def _remove_client(self, client: LiveClient):
+        for pattern in client.patterns:
+            self._topic_index.remove(pattern, client.client_id)
+        self.clients.pop(client.client_id, None)
+        self.stats['clients_connected'] = len(self.clients)
+
+    async def _tick_loop(self):
+        """Coalesce buffered events into one frame per client every tick."""
+        while True:
+            try:
+                await asyncio.sleep(self.tick_interval)
+                self._run_tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Error in live update tick: {e}")
+
+    def _run_tick(self):
+        """Distribute the events gathered since the last tick."""
+        self._tick += 1
+        messages, self._messages = self._messages, []
+        registry_changes, self._registry_changes = self._registry_changes, {}
+
+        touched: Dict[int, LiveClient] = {}
+
+        for topic, body in messages:
+            client_ids = self._topic_index.match(topic)
+            if not client_ids:
+                continue
+
+            fragment = '{"topic":' + json.dumps(topic) + ',"message":' + body.decode() + '}'
+            for client_id in client_ids:
+                client = self.clients.get(client_id)
+                if client is not None:
+                    client.queue_message(fragment)
+                    touched[client_id] = client
+            self.stats['messages_pushed'] += 1
+
+        if registry_changes:
+            encoded = {
+                agent_id: json.dumps(agent_data, default=str) if agent_data is not None else 'null'
+                for agent_id, agent_data in registry_changes.items()
+            }
+            for client in self.clients.values():
+                if client.registry:
+                    client.registry_delta.update(encoded)
+                    touched[client.client_id] = client
+
+        now = time.monotonic()
+        if now - self._last_stats >= self.stats_interval:
+            stats_clients = [client for client in self.clients.values() if client.stats]
+            if stats_clients:
+                self._last_stats = now
+                encoded_stats = json.dumps(self.stats_provider(), default=str)
+                for client in stats_clients:
+                    client.latest_stats = encoded_stats
+                    touched[client.client_id] = client
+
+        for client in touched.values():
+            client.ready.set()
+
+    async def _send_loop(self, client: LiveClient):
+        """Send a client's pending frame whenever it has one."""
+        while not client.ws.closed:
+            try:
+                await client.ready.wait()
+                client.ready.clear()
+
+                dropped = client.dropped
+                frame = client.take_frame(self._tick)
+                if frame is None:
+                    continue
+
+                await client.ws.send_str(frame)
+                self.stats['frames_sent'] += 1
+                self.stats['messages_dropped'] += dropped
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.debug(f"Error sending to live client {client.client_id}: {e}")
+                await client.ws.close()
+                return
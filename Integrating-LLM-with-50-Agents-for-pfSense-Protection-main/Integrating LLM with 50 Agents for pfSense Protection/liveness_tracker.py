@@ -0,0 +1,155 @@
+"""
+Liveness Tracker for pfSense Multi-Agent System
+
+This module tracks per-agent heartbeat deadlines in a min-heap so that stale
+agents are detected exactly when their timeout elapses, without periodically
+scanning the whole agent registry.
+"""
+
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+ExpiryCallback = Callable[[str], Any]
+
+
+class LivenessTracker:
+    """
+    Min-heap of heartbeat deadlines with staged expiry callbacks.
+
+    Each stage is a (timeout_seconds, callback) pair measured from the last
+    heartbeat, e.g. mark an agent inactive after 5 minutes and remove it
+    after 30. touch() records a heartbeat in O(log n) and restarts the stages;
+    superseded heap entries are skipped lazily when they surface. A single
+    background task sleeps until the earliest deadline and fires the callback
+    of the stage that expired.
+    """
+
+    def __init__(self,
+                 stages: List[Tuple[float, ExpiryCallback]],
+                 logger: Optional[logging.Logger] = None):
+        self.stages = sorted(stages, key=lambda stage: stage[0])
+        self.logger = logger or logging.getLogger(__name__)
+
+        # agent_id -> (last_seen, token of its live heap entry)
+        self._entries: Dict[str, Tuple[float, int]] = {}
+        self._heap: List[Tuple[float, int, str, int]] = []  # (deadline, token, agent_id, stage)
+        self._tokens = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.stats = {
+            'tracked': 0,
+            'expirations': [0] * len(self.stages)
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, agent_id: str) -> bool:
+        return agent_id in self._entries
+
+    def touch(self, agent_id: str):
+        """Record a heartbeat and restart the agent's expiry stages."""
+        self._schedule(agent_id, time.monotonic(), 0)
+
+    def forget(self, agent_id: str):
+        """Stop tracking an agent; its pending heap entries become stale."""
+        self._entries.pop(agent_id, None)
+        self.stats['tracked'] = len(self._entries)
+
+    def start(self) -> asyncio.Task:
+        """Start the background expiry task."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        """Stop the background expiry task."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get tracker counters and heap size."""
+        return {
+            'tracked': len(self._entries),
+            'heap_size': len(self._heap),
+            'expirations': list(self.stats['expirations'])
+        }
+
+    def _schedule(self, agent_id: str, last_seen: float, stage: int):
+        """Push the deadline for one stage of an agent."""
+        token = next(self._tokens)
+        deadline = last_seen + self.stages[stage][0]
+
+        self._entries[agent_id] = (last_seen, token)
+        self.stats['tracked'] = len(self._entries)
+
+        if not self._heap or deadline < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (deadline, token, agent_id, stage))
+
+        # Rebuild when superseded entries dominate the heap
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._compact()
+
+    def _compact(self):
+        """Drop heap entries that no longer belong to a tracked agent."""
+        self._heap = [
+            item for item in self._heap
+            if self._entries.get(item[2], (None, None))[1] == item[1]
+        ]
+        heapq.heapify(self._heap)
+
+    async def _run(self):
+        """Sleep until the next deadline and fire expired stages."""
+        while True:
+            try:
+                self._wakeup.clear()
+                delay = self._heap[0][0] - time.monotonic() if self._heap else None
+
+                if delay is None or delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+
+                await self._expire_due()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Error in liveness tracker: {e}")
+
+    async def _expire_due(self):
+        """Pop every deadline that has passed and run its stage callback."""
+        now = time.monotonic()
+
+        while self._heap and self._heap[0][0] <= now:
+            deadline, token, agent_id, stage = heapq.heappop(self._heap)
+
+            entry = self._entries.get(agent_id)
+            if entry is None or entry[1] != token:
+                continue  # superseded by a newer heartbeat or forgotten
+
+            last_seen = entry[0]
+            if stage + 1 < len(self.stages):
+                self._schedule(agent_id, last_seen, stage + 1)
+            else:
+                self.forget(agent_id)
+
+            self.stats['expirations'][stage] += 1
+
+            try:
+                result = self.stages[stage][1](agent_id)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                self.logger.error(f"Error in liveness callback for {agent_id}: {e}")
@@ -8,12 +8,64 @@ to enhance agent decision-making and analysis capabilities.
 import asyncio
 import json
 import logging
-from typing import Dict, Any, List, Optional
-from dataclasses import dataclass
+import time
+from functools import partial
+from typing import Dict, Any, Awaitable, Callable, List, Optional, Tuple
+from dataclasses import dataclass, field
 import aiohttp
 import openai
 from openai import AsyncOpenAI
 
+from ..core.metrics import get_metrics
+from .request_batcher import LLMRequestBatcher
+from .request_scheduler import LLMRequestScheduler, RateLimitExceeded
+from .response_cache import ResponseCache, request_key
+from .stream_parser import IncrementalJSONParser
+
+
+# Awaited with the name and value of each response field as it is streamed
+FieldCallback = Callable[[str, Any], Awaitable[None]]
+
+# Cache TTLs in seconds by analysis type, as in default_config.yaml
+DEFAULT_CACHE_TTLS = {
+    'security_analysis': 120,
+    'incident_response': 120,
+    'traffic_analysis': 300,
+    'log_analysis': 300,
+    'general_query': 300
+}
+
+
+@dataclass
+class _InflightRequest:
+    """A provider call shared by identical concurrent requests."""
+    streamed: bool
+    future: Optional[asyncio.Future] = None
+    # Fields streamed so far, and a queue per caller following the stream
+    fields: List[Tuple[str, Any]] = field(default_factory=list)
+    listeners: List[asyncio.Queue] = field(default_factory=list)
+    
+    def publish(self, name: str, value: Any):
+        self.fields.append((name, value))
+        for queue in self.listeners:
+            queue.put_nowait((name, value))
+    
+    def follow(self) -> asyncio.Queue:
+        """Queue of the fields streamed so far and from now on, then None."""
+        queue = asyncio.Queue()
+        for streamed_field in self.fields:
+            queue.put_nowait(streamed_field)
+        if self.future.done():
+            queue.put_nowait(None)
+        else:
+            self.listeners.append(queue)
+        return queue
+    
+    def finish(self):
+        for queue in self.listeners:
+            queue.put_nowait(None)
+        self.listeners.clear()
+
 
 @dataclass
 class LLMRequest:
@@ -44,16 +96,86 @@ class LLMClient:
     Supports OpenAI API and can be extended for other LLM providers.
     Provides specialized methods for security analysis, threat detection,
     and decision-making in the context of pfSense network monitoring.
+    
+    config is the 'llm' section of the system configuration; its 'cache'
+    subsection configures the response cache, which is on by default.
+    Provider calls are admitted by a scheduler that enforces rate_limit
+    requests and tokens_per_minute tokens per minute, in priority order.
+    The 'batching' subsection controls which analysis types are combined
+    into multi-item requests when several are made at once.
+    
+    The analyze_* methods accept an on_field callback. With one, the
+    completion is streamed and each top-level field of the JSON response is
+    passed to it as soon as it closes, before the full response is returned.
     """
     
-    def __init__(self, api_key: str = None, base_url: str = None):
+    def __init__(self, api_key: str = None, base_url: str = None, config: Dict[str, Any] = None):
         self.logger = logging.getLogger(__name__)
+        self.metrics = get_metrics()
+        config = config or {}
         
         # Initialize OpenAI client
         self.client = AsyncOpenAI(
             api_key=api_key,
             base_url=base_url
         )
+        self.model = config.get('model', 'gpt-4')
+        self.temperature = config.get('temperature', 0.7)
+        
+        # Provider calls in progress by request key, shared by identical requests
+        self._inflight: Dict[str, _InflightRequest] = {}
+        
+        self.stats = {
+            'provider_calls': 0,
+            'streamed': 0,
+            'coalesced': 0
+        }
+        
+        # Rate limits and priority order of provider calls
+        self.scheduler = LLMRequestScheduler(
+            requests_per_minute=config.get('rate_limit', 100),
+            tokens_per_minute=config.get('tokens_per_minute', 0),
+            max_concurrency=config.get('max_concurrent_requests', 8),
+            max_wait=config.get('max_queue_wait'),
+            wait_observer=self.metrics.observe_llm_queue_wait,
+            shed_observer=self.metrics.observe_llm_shed
+        )
+        
+        # Default priority class of each analysis type
+        self.priorities = {
+            'incident_response': 'high',
+            'security_analysis': 'high',
+            'general_query': 'normal',
+            'traffic_analysis': 'routine',
+            'log_analysis': 'routine',
+            **config.get('priorities', {})
+        }
+        
+        # Concurrent analyses of the same type sent as one multi-item request
+        self.batcher: Optional[LLMRequestBatcher] = None
+        batching_config = config.get('batching', {})
+        if batching_config.get('enabled', True):
+            self.batcher = LLMRequestBatcher(
+                send=self._call_provider,
+                analysis_types=batching_config.get('analysis_types', ['log_analysis', 'traffic_analysis']),
+                max_items=batching_config.get('max_items', 8),
+                max_delay=batching_config.get('max_delay', 0.05),
+                max_batch_tokens=batching_config.get('max_tokens', 12000),
+                fallback_errors=(openai.BadRequestError,),
+                observer=self.metrics.observe_llm_batch
+            )
+        
+        # Exact-match cache of completions, optionally persisted to SQLite
+        self.cache: Optional[ResponseCache] = None
+        cache_config = config.get('cache', {})
+        if cache_config.get('enabled', True):
+            self.cache = ResponseCache(
+                max_entries=cache_config.get('max_entries', 1000),
+                max_bytes=cache_config.get('max_bytes', 16 * 1024 * 1024),
+                default_ttl=cache_config.get('default_ttl', 300),
+                ttls={**DEFAULT_CACHE_TTLS, **cache_config.get('ttls', {})},
+                sqlite_path=cache_config.get('sqlite_path') or None
+            )
         
         # System prompts for different types of analysis
         self.system_prompts = {
@@ -120,13 +242,15 @@ Provide structured response including:
     
     async def analyze_security_event(self, 
                                    event_data: Dict[str, Any],
-                                   agent_context: Dict[str, Any] = None) -> LLMResponse:
+                                   agent_context: Dict[str, Any] = None,
+                                   on_field: Optional[FieldCallback] = None) -> LLMResponse:
         """
         Analyze a security event using LLM.
         
         Args:
             event_data: Security event information
             agent_context: Additional context from the requesting agent
+            on_field: Awaited with each response field as soon as it is streamed
             
         Returns:
             LLMResponse with analysis results
@@ -136,18 +260,21 @@ Provide structured response including:
         return await self._query_llm(
             prompt=prompt,
             system_prompt=self.system_prompts['security_analysis'],
-            analysis_type='security_analysis'
+            analysis_type='security_analysis',
+            on_field=on_field
         )
     
     async def analyze_traffic_pattern(self,
                                     traffic_data: Dict[str, Any],
-                                    baseline_data: Dict[str, Any] = None) -> LLMResponse:
+                                    baseline_data: Dict[str, Any] = None,
+                                    on_field: Optional[FieldCallback] = None) -> LLMResponse:
         """
         Analyze network traffic patterns for anomalies.
         
         Args:
             traffic_data: Current traffic statistics and patterns
             baseline_data: Historical baseline for comparison
+            on_field: Awaited with each response field as soon as it is streamed
             
         Returns:
             LLMResponse with traffic analysis results
@@ -157,18 +284,21 @@ Provide structured response including:
         return await self._query_llm(
             prompt=prompt,
             system_prompt=self.system_prompts['traffic_analysis'],
-            analysis_type='traffic_analysis'
+            analysis_type='traffic_analysis',
+            on_field=on_field
         )
     
     async def analyze_logs(self,
                           log_entries: List[Dict[str, Any]],
-                          log_type: str = 'firewall') -> LLMResponse:
+                          log_type: str = 'firewall',
+                          on_field: Optional[FieldCallback] = None) -> LLMResponse:
         """
         Analyze log entries for patterns and anomalies.
         
         Args:
             log_entries: List of log entries to analyze
             log_type: Type of logs (firewall, system, vpn, etc.)
+            on_field: Awaited with each response field as soon as it is streamed
             
         Returns:
             LLMResponse with log analysis results
@@ -178,18 +308,21 @@ Provide structured response including:
         return await self._query_llm(
             prompt=prompt,
             system_prompt=self.system_prompts['log_analysis'],
-            analysis_type='log_analysis'
+            analysis_type='log_analysis',
+            on_field=on_field
         )
     
     async def recommend_incident_response(self,
                                         incident_data: Dict[str, Any],
-                                        severity: str = 'medium') -> LLMResponse:
+                                        severity: str = 'medium',
+                                        on_field: Optional[FieldCallback] = None) -> LLMResponse:
         """
         Get incident response recommendations.
         
         Args:
             incident_data: Information about the security incident
             severity: Incident severity level
+            on_field: Awaited with each response field as soon as it is streamed
             
         Returns:
             LLMResponse with incident response recommendations
@@ -199,7 +332,9 @@ Provide structured response including:
         return await self._query_llm(
             prompt=prompt,
             system_prompt=self.system_prompts['incident_response'],
-            analysis_type='incident_response'
+            analysis_type='incident_response',
+            priority='critical' if severity in ('critical', 'high') else None,
+            on_field=on_field
         )
     
     async def general_query(self,
@@ -227,18 +362,13 @@ Please provide a clear, actionable response based on the context and your expert
 """
         
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a network security expert specializing in pfSense firewall management and network monitoring."},
-                    {"role": "user", "content": full_prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.7
+            return await self._complete(
+                system_prompt="You are a network security expert specializing in pfSense firewall management and network monitoring.",
+                prompt=full_prompt,
+                analysis_type='general_query',
+                max_tokens=1000
             )
             
-            return response.choices[0].message.content
-            
         except Exception as e:
             self.logger.error(f"Error in general LLM query: {e}")
             return f"Error processing query: {str(e)}"
@@ -367,7 +497,9 @@ Format your response as structured JSON with the following fields:
     async def _query_llm(self,
                         prompt: str,
                         system_prompt: str,
-                        analysis_type: str) -> LLMResponse:
+                        analysis_type: str,
+                        priority: Optional[str] = None,
+                        on_field: Optional[FieldCallback] = None) -> LLMResponse:
         """
         Internal method to query the LLM and parse structured responses.
         
@@ -375,23 +507,22 @@ Format your response as structured JSON with the following fields:
             prompt: The analysis prompt
             system_prompt: System prompt for context
             analysis_type: Type of analysis being performed
+            priority: Scheduling class; defaults to the analysis type's class
+            on_field: If set, stream the completion and pass it each field
             
         Returns:
             LLMResponse with parsed results
         """
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
+            response_text = await self._complete(
+                system_prompt=system_prompt,
+                prompt=prompt,
+                analysis_type=analysis_type,
                 max_tokens=1500,
-                temperature=0.7
+                priority=priority,
+                on_field=on_field
             )
             
-            response_text = response.choices[0].message.content
-            
             # Try to parse as JSON for structured responses
             try:
                 parsed_response = json.loads(response_text)
@@ -404,7 +535,7 @@ Format your response as structured JSON with the following fields:
                     metadata={
                         'analysis_type': analysis_type,
                         'parsed_data': parsed_response,
-                        'model_used': 'gpt-4'
+                        'model_used': self.model
                     }
                 )
                 
@@ -417,10 +548,20 @@ Format your response as structured JSON with the following fields:
                     suggested_actions=[],
                     metadata={
                         'analysis_type': analysis_type,
-                        'model_used': 'gpt-4'
+                        'model_used': self.model
                     }
                 )
                 
+        except RateLimitExceeded as e:
+            self.logger.warning(f"LLM request not sent: {e}")
+            return LLMResponse(
+                response=f"Error: {str(e)}",
+                confidence=0.0,
+                reasoning="LLM request shed by rate limiter",
+                suggested_actions=[],
+                metadata={'error': str(e), 'shed': True}
+            )
+            
         except Exception as e:
             self.logger.error(f"Error querying LLM: {e}")
             return LLMResponse(
@@ -430,15 +571,215 @@ Format your response as structured JSON with the following fields:
                 suggested_actions=[],
                 metadata={'error': str(e)}
             )
+    
+    async def _complete(self,
+                        system_prompt: str,
+                        prompt: str,
+                        analysis_type: str,
+                        max_tokens: int,
+                        priority: Optional[str] = None,
+                        on_field: Optional[FieldCallback] = None) -> str:
+        """
+        Get the completion text for a request, from the cache when possible.
+        
+        Concurrent identical requests share one provider call. Raises on
+        provider errors, in every caller sharing the call, and
+        RateLimitExceeded if the call was shed; failed requests are never
+        cached. With on_field, a new provider call is streamed to it; a
+        cached or unstreamed shared response is passed to it field by field
+        on arrival. Every caller of a streamed call gets each field as it
+        closes, including those streamed before it joined; callbacks run in
+        their caller's task, so they stop when that caller is cancelled.
+        """
+        key = request_key(self.model, system_prompt, prompt, self.temperature, max_tokens)
+        cache = self.cache if self.cache is not None and self.cache.ttl_for(analysis_type) > 0 else None
+        if cache is not None:
+            cached = cache.get(key)
+            self.metrics.observe_llm_cache(analysis_type, cached is not None, cached.latency if cached else 0.0)
+            if cached is not None:
+                if on_field is not None:
+                    await self._replay_fields(cached.response, on_field)
+                return cached.response
+        
+        request = self._inflight.get(key)
+        if request is not None:
+            self.stats['coalesced'] += 1
+            self.metrics.observe_llm_coalesced(analysis_type)
+        else:
+            request = _InflightRequest(streamed=on_field is not None)
+            request.future = asyncio.ensure_future(
+                self._fetch(key, cache, system_prompt, prompt, analysis_type, max_tokens,
+                            priority or self.priorities.get(analysis_type, 'normal'),
+                            request.publish if request.streamed else None)
+            )
+            self._inflight[key] = request
+            request.future.add_done_callback(partial(self._request_done, key, request))
+        
+        if on_field is not None and request.streamed:
+            queue = request.follow()
+            try:
+                while True:
+                    streamed_field = await queue.get()
+                    if streamed_field is None:
+                        break
+                    await self._emit_field(on_field, *streamed_field)
+            finally:
+                if queue in request.listeners:
+                    request.listeners.remove(queue)
+        
+        # Shielded: a caller being cancelled must not cancel the call for the
+        # others. If every caller goes away, the call still completes and its
+        # response is cached.
+        response_text = await asyncio.shield(request.future)
+        if on_field is not None and not request.streamed:
+            await self._replay_fields(response_text, on_field)
+        return response_text
+    
+    def _request_done(self, key: str, request: _InflightRequest, future: asyncio.Future):
+        if self._inflight.get(key) is request:
+            del self._inflight[key]
+        request.finish()
+        if not future.cancelled():
+            # Retrieve the exception in case no caller is left waiting for it
+            future.exception()
+    
+    async def _fetch(self,
+                     key: str,
+                     cache: Optional[ResponseCache],
+                     system_prompt: str,
+                     prompt: str,
+                     analysis_type: str,
+                     max_tokens: int,
+                     priority: str,
+                     publish: Optional[Callable[[str, Any], None]] = None) -> str:
+        """Get a completion, streamed or batched with concurrent requests, and cache it."""
+        start_time = time.perf_counter()
+        if publish is not None:
+            response_text = await self._stream_provider(
+                system_prompt, prompt, analysis_type, max_tokens, priority, publish
+            )
+        elif self.batcher is not None and self.batcher.batches(analysis_type):
+            response_text = await self.batcher.submit(system_prompt, prompt, analysis_type, max_tokens, priority)
+        else:
+            response_text = await self._call_provider(system_prompt, prompt, analysis_type, max_tokens, priority)
+        
+        if cache is not None:
+            cache.put(key, analysis_type, response_text, time.perf_counter() - start_time)
+        return response_text
+    
+    async def _call_provider(self,
+                             system_prompt: str,
+                             prompt: str,
+                             analysis_type: str,
+                             max_tokens: int,
+                             priority: str) -> str:
+        """Wait for the scheduler and make one provider call."""
+        # Roughly four characters per prompt token, plus the completion allowance
+        estimated_tokens = (len(system_prompt) + len(prompt)) // 4 + max_tokens
+        
+        async with self.scheduler.reserve(priority, estimated_tokens) as reservation:
+            self.stats['provider_calls'] += 1
+            start_time = time.perf_counter()
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=max_tokens,
+                    temperature=self.temperature
+                )
+            except Exception:
+                self.metrics.observe_llm(analysis_type, time.perf_counter() - start_time, failed=True)
+                raise
+            
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                reservation.used_tokens = usage.total_tokens
+        
+        self.metrics.observe_llm(analysis_type, time.perf_counter() - start_time)
+        return response.choices[0].message.content
+    
+    async def _stream_provider(self,
+                               system_prompt: str,
+                               prompt: str,
+                               analysis_type: str,
+                               max_tokens: int,
+                               priority: str,
+                               publish: Callable[[str, Any], None]) -> str:
+        """Wait for the scheduler and stream one provider call, publishing fields as they close."""
+        estimated_tokens = (len(system_prompt) + len(prompt)) // 4 + max_tokens
+        parser = IncrementalJSONParser()
+        first_field = True
+        
+        # Streamed responses carry no usage, so the token estimate stands
+        async with self.scheduler.reserve(priority, estimated_tokens):
+            self.stats['provider_calls'] += 1
+            self.stats['streamed'] += 1
+            start_time = time.perf_counter()
+            try:
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=max_tokens,
+                    temperature=self.temperature,
+                    stream=True
+                )
+                async for chunk in stream:
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    for name, value in parser.feed(chunk.choices[0].delta.content):
+                        if first_field:
+                            self.metrics.observe_llm_first_field(analysis_type, time.perf_counter() - start_time)
+                            first_field = False
+                        publish(name, value)
+            except Exception:
+                self.metrics.observe_llm(analysis_type, time.perf_counter() - start_time, failed=True)
+                raise
+        
+        self.metrics.observe_llm(analysis_type, time.perf_counter() - start_time)
+        return parser.buffer
+    
+    async def _replay_fields(self, response_text: str, on_field: FieldCallback):
+        """Pass the fields of a complete response to a streaming caller."""
+        for name, value in IncrementalJSONParser().feed(response_text):
+            await self._emit_field(on_field, name, value)
+    
+    async def _emit_field(self, on_field: FieldCallback, name: str, value: Any):
+        # A failing callback must not abort the response for the other fields
+        try:
+            await on_field(name, value)
+        except Exception as e:
+            self.logger.error(f"Error handling streamed LLM field {name}: {e}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Provider call, coalescing, scheduler, batching and response cache statistics."""
+        stats = self.stats.copy()
+        stats['model'] = self.model
+        stats['inflight'] = len(self._inflight)
+        stats['scheduler'] = self.scheduler.get_stats()
+        stats['batching'] = self.batcher.get_stats() if self.batcher is not None else None
+        stats['cache'] = self.cache.get_stats() if self.cache is not None else None
+        return stats
 
 
 # Singleton instance for global access
 _llm_client = None
 
-def get_llm_client() -> LLMClient:
-    """Get the global LLM client instance."""
+def get_llm_client(config: Dict[str, Any] = None) -> LLMClient:
+    """
+    Get the global LLM client instance.
+    
+    config is the 'llm' section of the system configuration. The client is
+    created by the first call; later calls get the same instance and their
+    config is ignored, so every caller should pass the same section.
+    """
     global _llm_client
     if _llm_client is None:
-        _llm_client = LLMClient()
+        _llm_client = LLMClient(config=config)
     return _llm_client
 
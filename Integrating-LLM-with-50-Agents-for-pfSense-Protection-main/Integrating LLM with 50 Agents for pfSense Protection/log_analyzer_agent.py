@@ -81,7 +81,7 @@ class LogAnalyzerAgent(BaseAgent):
         }
         
         # LLM client
-        self.llm_client = get_llm_client()
+        self.llm_client = get_llm_client(config.llm)
         
         self.logger.info(f"Log Analyzer Agent initialized for types: {self.log_types}")
     
@@ -206,8 +206,9 @@ class LogAnalyzerAgent(BaseAgent):
         
         try:
             # Get current line count
-            stdin, stdout, stderr = self.ssh_client.exec_command(f"wc -l {log_path}")
-            current_lines = int(stdout.read().decode().split()[0])
+            with self.metrics.time_ssh_command('wc'):
+                stdin, stdout, stderr = self.ssh_client.exec_command(f"wc -l {log_path}")
+                current_lines = int(stdout.read().decode().split()[0])
             
             # Calculate new lines to read
             last_processed = self.processed_lines[log_type]
@@ -217,11 +218,12 @@ class LogAnalyzerAgent(BaseAgent):
             new_lines = current_lines - last_processed
             
             # Read new lines
-            stdin, stdout, stderr = self.ssh_client.exec_command(
-                f"tail -n {new_lines} {log_path}"
-            )
+            with self.metrics.time_ssh_command('tail'):
+                stdin, stdout, stderr = self.ssh_client.exec_command(
+                    f"tail -n {new_lines} {log_path}"
+                )
+                raw_lines = stdout.read().decode().strip().split('\n')
             
-            raw_lines = stdout.read().decode().strip().split('\n')
             self.processed_lines[log_type] = current_lines
             
             # Parse log entries
@@ -426,6 +428,7 @@ class LogAnalyzerAgent(BaseAgent):
     
     async def _perform_batch_analysis(self):
         """Perform batch analysis of recent log entries."""
+        analyses = []
         for log_type, entries in self.log_buffer.items():
             if not entries:
                 continue
@@ -448,17 +451,22 @@ class LogAnalyzerAgent(BaseAgent):
                 }
                 for entry in recent_entries[-50:]  # Last 50 entries
             ]
+            analyses.append(self._analyze_log_type(log_type, log_data))
+        
+        # Run concurrently, so the LLM client can send them as one batched request
+        await asyncio.gather(*analyses)
+    
+    async def _analyze_log_type(self, log_type: str, log_data: List[Dict[str, Any]]):
+        """Analyze one log type's recent entries with the LLM."""
+        try:
+            llm_response = await self.llm_client.analyze_logs(log_data, log_type)
             
-            # Use LLM for advanced analysis
-            try:
-                llm_response = await self.llm_client.analyze_logs(log_data, log_type)
+            # Process LLM recommendations
+            if llm_response.suggested_actions:
+                await self._process_llm_recommendations(llm_response, log_type)
                 
-                # Process LLM recommendations
-                if llm_response.suggested_actions:
-                    await self._process_llm_recommendations(llm_response, log_type)
-                    
-            except Exception as e:
-                self.logger.error(f"Error in LLM analysis: {e}")
+        except Exception as e:
+            self.logger.error(f"Error in LLM analysis: {e}")
     
     async def _process_llm_recommendations(self, llm_response, log_type: str):
         """Process recommendations from LLM analysis."""
@@ -628,6 +636,7 @@ class LogAnalyzerAgent(BaseAgent):
                     for log_type, entries in self.log_buffer.items()
                 },
                 'timestamp': datetime.now().isoformat()
-            }
+            },
+            ttl=30  # Superseded by the next report
         )
 
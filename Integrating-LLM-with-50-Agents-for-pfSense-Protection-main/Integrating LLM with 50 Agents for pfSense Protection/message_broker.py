@@ -8,17 +8,32 @@ communication between agents, message routing, and system coordination.
 import asyncio
 import json
 import logging
+import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Callable, Set
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, field, asdict
 import aiohttp
 from aiohttp import web
 import aioredis
 import pika
-from pika.adapters.asyncio_connection import AsyncioConnection
 import uuid
 
 from ..core.base_agent import AgentMessage
+from ..core.compression import MessageCompressor, decompress
+from ..core.connection_pool import get_transport
+from ..core.dedupe_cache import DedupeCache
+from ..core.liveness_tracker import LivenessTracker
+from ..core.metrics import get_metrics
+from ..core.topic_trie import TopicTrie
+from .history_writer import RedisHistoryWriter
+from .segment_log import SegmentedMessageLog
+from .live_updates import LiveUpdateHub
+from .shard_coordinator import ShardCoordinator
+from .history_stream import NDJSON_CONTENT_TYPE, NdjsonStream, decode_cursor, encode_cursor, ndjson_record
+from ..core.message_codec import (
+    JSON_CONTENT_TYPE, MessageEnvelope, amqp_expiration, get_codec, get_codec_by_name, negotiate_codec,
+    routing_headers
+)
 
 
 @dataclass
@@ -40,6 +55,8 @@ class AgentConnection:
     subscribed_topics: List[str]
     message_count: int
     status: str  # 'active', 'inactive', 'error'
+    content_types: List[str] = field(default_factory=lambda: [JSON_CONTENT_TYPE])
+    content_encodings: List[str] = field(default_factory=list)
 
 
 class MessageBroker:
@@ -55,6 +72,13 @@ class MessageBroker:
     - System-wide coordination
     """
     
+    # Message types handled by the broker itself; everything else is routed
+    # on its headers without decoding the payload
+    CONTROL_MESSAGE_TYPES = {'agent_registration', 'heartbeat', 'coordination_request', 'broadcast'}
+    
+    # Control messages handled by the shard owning the sending agent
+    OWNER_MESSAGE_TYPES = {'agent_registration', 'heartbeat'}
+    
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.logger = logging.getLogger(__name__)
@@ -63,16 +87,86 @@ class MessageBroker:
         self.connected_agents: Dict[str, AgentConnection] = {}
         self.agent_subscriptions: Dict[str, Set[str]] = {}  # topic -> set of agent_ids
         
+        # Secondary indexes over connected_agents
+        self.agents_by_type: Dict[str, Set[str]] = {}  # agent_type -> set of agent_ids
+        self.agents_by_status: Dict[str, Set[str]] = {}  # status -> set of agent_ids
+        
         # Message routing
         self.routing_rules: List[MessageRoute] = []
         self.message_handlers: Dict[str, Callable] = {}
         
-        # RabbitMQ connection
-        self.rabbitmq_connection = None
+        # Compiled subscriptions and routing rules: topic pattern -> agent_ids
+        self.topic_trie = TopicTrie()
+        
+        # Heartbeat deadlines: mark agents inactive, then remove them
+        self.liveness = LivenessTracker([
+            (config.get('agent_inactive_timeout', 300), self._on_agent_inactive),
+            (config.get('agent_removal_timeout', 1800), self._remove_agent)
+        ], logger=self.logger)
+        
+        # Channel on the process-wide transport (RabbitMQ pool or in-process)
+        self.transport = get_transport(
+            config.get('transport', 'amqp'),
+            max_connections=config.get('connection_pool_size', 2),
+            max_channels_per_connection=config.get('channels_per_connection', 32),
+            retry_attempts=config.get('retry_attempts', 3),
+            retry_delay=config.get('retry_delay', 5)
+        )
         self.rabbitmq_channel = None
+        self.codec = get_codec_by_name(config.get('message_codec', 'json'))
         
         # Redis for caching and persistence
         self.redis_client = None
+        self.history_writer: Optional[RedisHistoryWriter] = None
+        
+        # Local append-only history, used instead of Redis lists when enabled
+        self.message_log: Optional[SegmentedMessageLog] = None
+        
+        # Consistent-hash sharding across broker processes, when a shard_id is set
+        self.sharding: Optional[ShardCoordinator] = None
+        if config.get('shard_id'):
+            self.sharding = ShardCoordinator(
+                self,
+                config['shard_id'],
+                api_url=config.get('shard_api_url', f"http://localhost:{config.get('http_port', 8080)}"),
+                announce_interval=config.get('shard_announce_interval', 5),
+                shard_timeout=config.get('shard_timeout', 15),
+                sync_interval_ms=config.get('shard_sync_interval_ms', 50),
+                virtual_nodes=config.get('shard_virtual_nodes', 128),
+                logger=self.logger
+            )
+        
+        # Push updates for dashboard clients
+        self.live_updates = LiveUpdateHub(
+            snapshot_provider=self._registry_snapshot,
+            stats_provider=self._stats_snapshot,
+            tick_interval=config.get('live_tick_ms', 250) / 1000,
+            stats_interval=config.get('live_stats_interval', 5),
+            max_pending_messages=config.get('live_max_pending_messages', 500),
+            logger=self.logger
+        )
+        
+        # Recently processed message IDs, so a repeated publish is not fanned out again
+        self.dedupe = DedupeCache(
+            max_entries=config.get('dedupe_window_size', 100000),
+            ttl=config.get('dedupe_ttl', 600),
+            bloom_capacity=config.get('dedupe_bloom_capacity', 0)
+        )
+        
+        # Prometheus metrics, scraped from /metrics
+        self.metrics = get_metrics()
+        self.metrics.register_dedupe_cache(config.get('shard_id') or 'message_broker', self.dedupe)
+        self._expired_counter = self.metrics.child(
+            self.metrics.messages_expired, config.get('shard_id') or 'message_broker'
+        )
+        
+        # Large bodies are compressed once per message for agents that accept it
+        self.compressor = MessageCompressor(
+            threshold=config.get('compression_threshold', 0),
+            topic_thresholds=config.get('compression_thresholds'),
+            level=config.get('compression_level', 6),
+            observer=self.metrics.observe_compression
+        )
         
         # HTTP server for REST API
         self.app = web.Application()
@@ -84,6 +178,8 @@ class MessageBroker:
             'agents_connected': 0,
             'topics_active': 0,
             'errors': 0,
+            'duplicates_dropped': 0,
+            'messages_expired': 0,
             'start_time': datetime.now()
         }
         
@@ -99,6 +195,7 @@ class MessageBroker:
         try:
             # Initialize connections
             await self._setup_rabbitmq()
+            self._setup_message_log()
             await self._setup_redis()
             
             # Start background tasks
@@ -120,15 +217,23 @@ class MessageBroker:
         """Stop the message broker."""
         self.logger.info("Stopping Message Broker")
         
+        # Hand this shard's agents over before disconnecting
+        if self.sharding:
+            await self.sharding.stop()
+        
         # Cancel background tasks
         for task in self.background_tasks:
             task.cancel()
+        await self.liveness.stop()
+        await self.live_updates.stop()
         
         # Close connections
         if self.rabbitmq_channel:
-            await self.rabbitmq_channel.close()
-        if self.rabbitmq_connection:
-            await self.rabbitmq_connection.close()
+            await self.transport.release_channel(self.rabbitmq_channel)
+        if self.history_writer:
+            await self.history_writer.stop()
+        if self.message_log:
+            self.message_log.close()
         if self.redis_client:
             await self.redis_client.close()
     
@@ -138,39 +243,33 @@ class MessageBroker:
         self.app.router.add_get('/api/agents', self.handle_get_agents)
         self.app.router.add_get('/api/topics', self.handle_get_topics)
         self.app.router.add_get('/api/stats', self.handle_get_stats)
+        self.app.router.add_get('/api/shards', self.handle_get_shards)
         self.app.router.add_post('/api/agents/register', self.handle_agent_registration)
         self.app.router.add_post('/api/agents/{agent_id}/subscribe', self.handle_topic_subscription)
         self.app.router.add_get('/api/messages/{agent_id}', self.handle_get_messages)
+        self.app.router.add_get('/api/live', self.live_updates.handle_websocket)
+        self.app.router.add_get('/metrics', self.handle_metrics)
         
-        # Enable CORS
-        self.app.middlewares.append(self._cors_middleware)
+        # Enable CORS; added when headers are sent so streamed responses get them too
+        self.app.on_response_prepare.append(self._add_cors_headers)
     
-    async def _cors_middleware(self, request, handler):
-        """CORS middleware for HTTP API."""
-        response = await handler(request)
+    async def _add_cors_headers(self, request, response):
+        """Add CORS headers to every HTTP API response."""
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-        return response
     
     async def _setup_rabbitmq(self):
         """Setup RabbitMQ connection."""
         try:
             rabbitmq_url = self.config.get('rabbitmq_url', 'amqp://localhost:5672')
-            connection_params = pika.URLParameters(rabbitmq_url)
             
-            self.rabbitmq_connection = await AsyncioConnection.create(connection_params)
-            self.rabbitmq_channel = await self.rabbitmq_connection.channel()
-            
-            # Declare main exchange
-            await self.rabbitmq_channel.exchange_declare(
-                exchange='pfsense_agents',
-                exchange_type='topic',
-                durable=True
+            # Share connections with agents running in the same process
+            self.rabbitmq_channel = await self.transport.acquire_channel(
+                rabbitmq_url,
+                on_reopen=self._setup_channel
             )
-            
-            # Setup message consumption
-            await self._setup_message_consumption()
+            await self._setup_channel(self.rabbitmq_channel)
             
             self.logger.info("RabbitMQ connection established")
             
@@ -182,11 +281,26 @@ class MessageBroker:
         """Setup Redis connection."""
         try:
             redis_url = self.config.get('redis_url', 'redis://localhost:6379')
-            self.redis_client = await aioredis.from_url(redis_url)
+            # Bounds history flushes too; the writer never cancels a pipeline
+            self.redis_client = await aioredis.from_url(
+                redis_url,
+                socket_timeout=self.config.get('redis_socket_timeout', 1.0)
+            )
             
             # Test connection
             await self.redis_client.ping()
             
+            if not self.message_log:
+                self.history_writer = RedisHistoryWriter(
+                    self.redis_client,
+                    max_length=self.config.get('history_max_length', 1000),
+                    batch_size=self.config.get('history_batch_size', 200),
+                    flush_interval_ms=self.config.get('history_flush_interval_ms', 100),
+                    max_pending=self.config.get('history_max_pending', 10000),
+                    timeout_errors=(aioredis.exceptions.TimeoutError,),
+                    logger=self.logger
+                )
+            
             self.logger.info("Redis connection established")
             
         except Exception as e:
@@ -194,6 +308,40 @@ class MessageBroker:
             # Redis is optional, continue without it
             self.redis_client = None
     
+    def _setup_message_log(self):
+        """Open the local segmented message log if it is the history backend."""
+        if self.config.get('history_backend', 'redis') != 'segment_log':
+            return
+        
+        try:
+            self.message_log = SegmentedMessageLog(
+                self.config.get('message_log_dir', '/var/lib/pfsense-agents/message_log'),
+                segment_bytes=self.config.get('message_log_segment_mb', 16) * 1024 * 1024,
+                index_interval_bytes=self.config.get('message_log_index_interval', 4096),
+                retention_bytes=self.config.get('message_log_retention_mb', 256) * 1024 * 1024,
+                retention_seconds=self.config.get('message_log_retention_hours', 168) * 3600,
+                logger=self.logger
+            )
+            self.logger.info("Segmented message log opened")
+            
+        except Exception as e:
+            self.logger.error(f"Failed to open message log: {e}")
+            self.message_log = None
+    
+    async def _setup_channel(self, channel):
+        """Declare the exchange and consumers on a (re)opened channel."""
+        self.rabbitmq_channel = channel
+        
+        # Declare main exchange
+        await self.transport.declare_exchange(channel, 'pfsense_agents', 'topic')
+        
+        # Setup message consumption
+        await self._setup_message_consumption()
+        
+        # Private shard queue for cluster messages and forwarded routes
+        if self.sharding:
+            await self.sharding.setup_channel(channel)
+    
     async def _setup_message_consumption(self):
         """Setup message consumption from RabbitMQ."""
         # Create broker queue for system messages
@@ -224,8 +372,18 @@ class MessageBroker:
     async def _on_message_received(self, channel, method, properties, body):
         """Handle incoming messages."""
         try:
-            message = AgentMessage.from_json(body.decode())
-            await self._process_broker_message(message)
+            wire_body = body
+            body = decompress(body, properties.content_encoding)
+            
+            envelope = MessageEnvelope.from_properties(properties, body)
+            if envelope is None:
+                # Publisher predates routing headers, recover them from the body
+                codec = get_codec(properties.content_type)
+                message = AgentMessage.decode(body, codec.content_type)
+                envelope = MessageEnvelope.from_message(message, codec, body)
+            envelope.keep_wire_body(wire_body, properties.content_encoding)
+            
+            await self._process_broker_message(envelope)
             
             # Acknowledge message
             await channel.basic_ack(delivery_tag=method.delivery_tag)
@@ -234,8 +392,59 @@ class MessageBroker:
             self.logger.error(f"Error processing message: {e}")
             await channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
     
-    async def _process_broker_message(self, message: AgentMessage):
+    async def _process_broker_message(self, envelope: MessageEnvelope):
         """Process messages received by the broker."""
+        # Stale messages are not worth routing after a backlog
+        if envelope.is_expired():
+            self._drop_expired()
+            return
+        
+        # Drop repeated publishes before they are routed or fanned out again
+        if self.dedupe.seen(envelope.id):
+            self.stats['duplicates_dropped'] += 1
+            return
+        
+        if envelope.message_type not in self.CONTROL_MESSAGE_TYPES:
+            # Route message to appropriate agents
+            await self._route_message(envelope)
+            return
+        
+        # Registrations and heartbeats go to the shard owning the agent
+        if (self.sharding and envelope.message_type in self.OWNER_MESSAGE_TYPES
+                and not self.sharding.owns(envelope.sender_id)):
+            await self.sharding.forward(envelope, self.sharding.owner(envelope.sender_id))
+            return
+        
+        await self._handle_control_message(envelope)
+    
+    async def _process_forwarded_message(self, envelope: MessageEnvelope, recipients: Optional[List[str]]):
+        """Process a message forwarded by another shard."""
+        if envelope.is_expired():
+            self._drop_expired()
+            return
+        
+        # Also set when a duplicate of the message reached this shard directly
+        if self.dedupe.seen(envelope.id):
+            self.stats['duplicates_dropped'] += 1
+            return
+        
+        if recipients is None:
+            # Control message about an agent this shard owns
+            await self._handle_control_message(envelope)
+            return
+        
+        for agent_id in recipients:
+            await self._send_message_to_agent(envelope, agent_id)
+    
+    def _drop_expired(self):
+        """Count a message skipped because it expired before it was routed."""
+        self.stats['messages_expired'] += 1
+        self._expired_counter.inc()
+    
+    async def _handle_control_message(self, envelope: MessageEnvelope):
+        """Decode and handle a message addressed to the broker itself."""
+        message = AgentMessage.decode(envelope.body, envelope.content_type)
+        
         if message.message_type == 'agent_registration':
             await self._handle_agent_registration(message)
         elif message.message_type == 'heartbeat':
@@ -244,9 +453,6 @@ class MessageBroker:
             await self._handle_coordination_request(message)
         elif message.message_type == 'broadcast':
             await self._handle_broadcast_message(message)
-        else:
-            # Route message to appropriate agents
-            await self._route_message(message)
     
     async def _handle_agent_registration(self, message: AgentMessage):
         """Handle agent registration."""
@@ -257,6 +463,12 @@ class MessageBroker:
             self.logger.warning("Received registration without agent_id")
             return
         
+        # Drop index entries and subscriptions of a previous registration, so
+        # topics the agent no longer lists stop being routed to it
+        if agent_id in self.connected_agents:
+            self._unindex_agent(self.connected_agents[agent_id])
+            self._unsubscribe_agent(agent_id)
+        
         # Register agent
         self.connected_agents[agent_id] = AgentConnection(
             agent_id=agent_id,
@@ -265,14 +477,17 @@ class MessageBroker:
             last_heartbeat=datetime.now(),
             subscribed_topics=agent_data.get('subscribed_topics', []),
             message_count=0,
-            status='active'
+            status='active',
+            content_types=agent_data.get('content_types', [JSON_CONTENT_TYPE]),
+            content_encodings=agent_data.get('content_encodings', [])
         )
+        self._index_agent(self.connected_agents[agent_id])
+        self.liveness.touch(agent_id)
+        self._publish_agent_update(agent_id)
         
         # Update subscriptions
         for topic in agent_data.get('subscribed_topics', []):
-            if topic not in self.agent_subscriptions:
-                self.agent_subscriptions[topic] = set()
-            self.agent_subscriptions[topic].add(agent_id)
+            self._subscribe_agent(agent_id, topic)
         
         self.stats['agents_connected'] = len(self.connected_agents)
         self.stats['topics_active'] = len(self.agent_subscriptions)
@@ -293,7 +508,13 @@ class MessageBroker:
         
         if agent_id in self.connected_agents:
             self.connected_agents[agent_id].last_heartbeat = datetime.now()
-            self.connected_agents[agent_id].status = message.payload.get('status', 'active')
+            self.liveness.touch(agent_id)
+            self._set_agent_status(self.connected_agents[agent_id], message.payload.get('status', 'active'))
+            if 'content_types' in message.payload:
+                self.connected_agents[agent_id].content_types = message.payload['content_types']
+            if 'content_encodings' in message.payload:
+                self.connected_agents[agent_id].content_encodings = message.payload['content_encodings']
+            self._publish_agent_update(agent_id)
     
     async def _handle_coordination_request(self, message: AgentMessage):
         """Handle coordination requests between agents."""
@@ -325,10 +546,7 @@ class MessageBroker:
             target_type = message.payload.get('target_type')
             broadcast_payload = message.payload.get('broadcast_payload', {})
             
-            target_agents = [
-                agent_id for agent_id, agent_conn in self.connected_agents.items()
-                if agent_conn.agent_type == target_type
-            ]
+            target_agents = list(self.agents_by_type.get(target_type, ()))
             
             for agent_id in target_agents:
                 broadcast_message = AgentMessage(
@@ -352,10 +570,7 @@ class MessageBroker:
         target_agents = []
         
         if 'agent_type' in target_filter:
-            target_agents = [
-                agent_id for agent_id, agent_conn in self.connected_agents.items()
-                if agent_conn.agent_type == target_filter['agent_type']
-            ]
+            target_agents = list(self.agents_by_type.get(target_filter['agent_type'], ()))
         else:
             target_agents = list(self.connected_agents.keys())
         
@@ -376,81 +591,201 @@ class MessageBroker:
     
     def _find_matching_agents(self, criteria: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Find agents matching given criteria."""
-        matching_agents = []
+        # Intersect the index entries for each criterion, smallest first
+        candidate_sets = []
+        if 'agent_type' in criteria:
+            candidate_sets.append(self.agents_by_type.get(criteria['agent_type'], set()))
+        if 'status' in criteria:
+            candidate_sets.append(self.agents_by_status.get(criteria['status'], set()))
+        if 'subscribed_to' in criteria:
+            candidate_sets.append(self.agent_subscriptions.get(criteria['subscribed_to'], set()))
         
-        for agent_id, agent_conn in self.connected_agents.items():
-            match = True
-            
-            if 'agent_type' in criteria and agent_conn.agent_type != criteria['agent_type']:
-                match = False
-            
-            if 'status' in criteria and agent_conn.status != criteria['status']:
-                match = False
-            
-            if 'subscribed_to' in criteria:
-                topic = criteria['subscribed_to']
-                if topic not in agent_conn.subscribed_topics:
-                    match = False
-            
-            if match:
-                matching_agents.append({
-                    'agent_id': agent_id,
-                    'agent_type': agent_conn.agent_type,
-                    'status': agent_conn.status,
-                    'subscribed_topics': agent_conn.subscribed_topics,
-                    'last_heartbeat': agent_conn.last_heartbeat.isoformat()
-                })
+        if candidate_sets:
+            candidate_sets.sort(key=len)
+            agent_ids = candidate_sets[0].intersection(*candidate_sets[1:])
+        else:
+            agent_ids = self.connected_agents.keys()
+        
+        matching_agents = []
+        for agent_id in agent_ids:
+            agent_conn = self.connected_agents[agent_id]
+            matching_agents.append({
+                'agent_id': agent_id,
+                'agent_type': agent_conn.agent_type,
+                'status': agent_conn.status,
+                'subscribed_topics': agent_conn.subscribed_topics,
+                'last_heartbeat': agent_conn.last_heartbeat.isoformat()
+            })
         
         return matching_agents
     
-    async def _route_message(self, message: AgentMessage):
-        """Route message to appropriate agents."""
-        self.stats['messages_routed'] += 1
-        
-        # If message has specific recipient, route directly
-        if message.recipient_id:
-            await self._send_message_to_agent(message, message.recipient_id)
+    def _index_agent(self, agent_conn: AgentConnection):
+        """Add an agent to the type and status indexes."""
+        self.agents_by_type.setdefault(agent_conn.agent_type, set()).add(agent_conn.agent_id)
+        self.agents_by_status.setdefault(agent_conn.status, set()).add(agent_conn.agent_id)
+    
+    def _unindex_agent(self, agent_conn: AgentConnection):
+        """Remove an agent from the type and status indexes."""
+        for index, key in ((self.agents_by_type, agent_conn.agent_type),
+                           (self.agents_by_status, agent_conn.status)):
+            agent_ids = index.get(key)
+            if agent_ids is not None:
+                agent_ids.discard(agent_conn.agent_id)
+                if not agent_ids:
+                    del index[key]
+    
+    def _set_agent_status(self, agent_conn: AgentConnection, status: str):
+        """Change an agent's status, keeping the status index in sync."""
+        if agent_conn.status == status:
             return
         
-        # Route based on topic subscriptions
-        topic = message.topic
-        if topic in self.agent_subscriptions:
-            for agent_id in self.agent_subscriptions[topic]:
-                if agent_id != message.sender_id:  # Don't send back to sender
-                    await self._send_message_to_agent(message, agent_id)
+        self._unindex_agent(agent_conn)
+        agent_conn.status = status
+        self._index_agent(agent_conn)
+        self._publish_agent_update(agent_conn.agent_id)
+    
+    def _agent_dict(self, agent_conn: AgentConnection) -> Dict[str, Any]:
+        """API representation of a connected agent."""
+        agent_dict = {
+            'agent_id': agent_conn.agent_id,
+            'agent_type': agent_conn.agent_type,
+            'status': agent_conn.status,
+            'connection_time': agent_conn.connection_time.isoformat(),
+            'last_heartbeat': agent_conn.last_heartbeat.isoformat(),
+            'subscribed_topics': agent_conn.subscribed_topics,
+            'message_count': agent_conn.message_count
+        }
+        
+        # Heartbeats, message counts and history are kept by the owning shard
+        if self.sharding:
+            agent_dict['shard'] = self.sharding.owner(agent_conn.agent_id)
+        
+        return agent_dict
+    
+    def _registry_snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """All connected agents keyed by agent_id."""
+        return {agent_id: self._agent_dict(agent_conn) for agent_id, agent_conn in self.connected_agents.items()}
+    
+    def _publish_agent_update(self, agent_id: str):
+        """Push an agent's current state, or its removal, to live clients and other shards."""
+        if self.sharding:
+            self.sharding.agent_changed(agent_id)
         
-        # Apply custom routing rules
-        for rule in self.routing_rules:
-            if self._topic_matches_pattern(topic, rule.topic_pattern):
-                for agent_id in rule.target_agents:
-                    if agent_id in self.connected_agents and agent_id != message.sender_id:
-                        await self._send_message_to_agent(message, agent_id)
+        if self.live_updates.has_registry_subscribers:
+            agent_conn = self.connected_agents.get(agent_id)
+            self.live_updates.registry_changed(agent_id, self._agent_dict(agent_conn) if agent_conn else None)
     
-    def _topic_matches_pattern(self, topic: str, pattern: str) -> bool:
-        """Check if topic matches routing pattern."""
-        # Simple wildcard matching
-        if pattern == '*':
-            return True
+    def _stats_snapshot(self) -> Dict[str, Any]:
+        """Broker statistics as served by /api/stats."""
+        uptime = datetime.now() - self.stats['start_time']
         
-        if pattern.endswith('*'):
-            return topic.startswith(pattern[:-1])
+        return {
+            'broker_stats': self.stats.copy(),
+            'uptime_seconds': uptime.total_seconds(),
+            'connected_agents': len(self.connected_agents),
+            'active_topics': len(self.agent_subscriptions),
+            'agent_types': self._agent_type_counts(),
+            'liveness': self.liveness.get_stats(),
+            'history': self.history_writer.get_stats() if self.history_writer else None,
+            'message_log': self.message_log.get_stats() if self.message_log else None,
+            'live_updates': self.live_updates.get_stats(),
+            'dedupe': self.dedupe.get_stats(),
+            'compression': self.compressor.get_stats(),
+            'sharding': self.sharding.get_stats() if self.sharding else None
+        }
+    
+    def _agent_type_counts(self) -> Dict[str, int]:
+        """Number of connected agents per agent type."""
+        return {agent_type: len(agent_ids) for agent_type, agent_ids in self.agents_by_type.items()}
+    
+    async def _route_message(self, envelope: MessageEnvelope):
+        """Route message to appropriate agents."""
+        self.stats['messages_routed'] += 1
+        start_time = time.perf_counter()
+        
+        try:
+            if self.live_updates.has_message_subscribers:
+                self.live_updates.publish_message(envelope.topic, envelope.body_for(JSON_CONTENT_TYPE))
+            
+            # If message has specific recipient, route directly
+            if envelope.recipient_id:
+                recipients = [envelope.recipient_id]
+            else:
+                # Route based on topic subscriptions and custom routing rules; an
+                # agent matched by several of them receives the message once
+                recipients = [
+                    agent_id for agent_id in self.topic_trie.match(envelope.topic)
+                    if agent_id in self.connected_agents and agent_id != envelope.sender_id
+                ]
+            
+            # Recipients owned by other shards get one forwarded copy per shard
+            if self.sharding:
+                recipients, remote = self.sharding.split_recipients(recipients)
+                for shard_id, shard_recipients in remote.items():
+                    await self.sharding.forward(envelope, shard_id, shard_recipients)
+            
+            for agent_id in recipients:
+                await self._send_message_to_agent(envelope, agent_id)
+        finally:
+            self.metrics.observe_route(envelope.message_type, time.perf_counter() - start_time)
+    
+    def add_routing_rule(self, rule: MessageRoute):
+        """
+        Add a custom routing rule.
         
-        return topic == pattern
+        Patterns use AMQP topic semantics: '*' matches one word and '#'
+        matches zero or more words.
+        """
+        self.routing_rules.append(rule)
+        for agent_id in rule.target_agents:
+            self.topic_trie.add(rule.topic_pattern, agent_id)
     
-    async def _send_message_to_agent(self, message: AgentMessage, agent_id: str):
+    def remove_routing_rule(self, rule: MessageRoute):
+        """Remove a custom routing rule."""
+        if rule in self.routing_rules:
+            self.routing_rules.remove(rule)
+            for agent_id in rule.target_agents:
+                self.topic_trie.remove(rule.topic_pattern, agent_id)
+    
+    def _subscribe_agent(self, agent_id: str, topic: str):
+        """Subscribe an agent to a topic pattern."""
+        subscribers = self.agent_subscriptions.setdefault(topic, set())
+        if agent_id not in subscribers:
+            subscribers.add(agent_id)
+            self.topic_trie.add(topic, agent_id)
+    
+    async def _send_message_to_agent(self, envelope: MessageEnvelope, agent_id: str):
         """Send message to specific agent."""
         try:
-            # Update message recipient
-            message.recipient_id = agent_id
+            # Forward the original body when the recipient accepts its format,
+            # otherwise transcode to the best format the recipient advertised
+            agent_conn = self.connected_agents.get(agent_id)
+            accepted = agent_conn.content_types if agent_conn else [JSON_CONTENT_TYPE]
+            if envelope.content_type in accepted:
+                content_type = envelope.content_type
+            else:
+                content_type = negotiate_codec(accepted).content_type
             
-            # Send via RabbitMQ
+            # Compressed only for agents that advertised they can decompress
+            body, content_encoding = envelope.body_for(content_type), None
+            if agent_conn and agent_conn.content_encodings:
+                wire_body, wire_encoding = envelope.wire_body_for(content_type, self.compressor)
+                if wire_encoding is None or wire_encoding in agent_conn.content_encodings:
+                    body, content_encoding = wire_body, wire_encoding
+            
+            # Send via RabbitMQ, recipient travels in the headers
             await self.rabbitmq_channel.basic_publish(
                 exchange='pfsense_agents',
                 routing_key=f'agent.{agent_id}',
-                body=message.to_json().encode(),
+                body=body,
                 properties=pika.BasicProperties(
-                    priority=message.priority,
-                    timestamp=int(message.timestamp.timestamp())
+                    content_type=content_type,
+                    content_encoding=content_encoding,
+                    message_id=envelope.id,
+                    type=envelope.message_type,
+                    priority=envelope.priority,
+                    expiration=amqp_expiration(envelope.expires_at),
+                    headers=routing_headers(envelope, agent_id)
                 )
             )
             
@@ -458,14 +793,11 @@ class MessageBroker:
             if agent_id in self.connected_agents:
                 self.connected_agents[agent_id].message_count += 1
             
-            # Store in Redis for persistence if available
-            if self.redis_client:
-                await self.redis_client.lpush(
-                    f'messages:{agent_id}',
-                    message.to_json()
-                )
-                # Keep only last 1000 messages
-                await self.redis_client.ltrim(f'messages:{agent_id}', 0, 999)
+            # Persist to the local log, or queue for Redis if available
+            if self.message_log:
+                self.message_log.append(agent_id, envelope.body_for(JSON_CONTENT_TYPE))
+            elif self.history_writer:
+                self.history_writer.record(agent_id, envelope.body_for(JSON_CONTENT_TYPE))
             
         except Exception as e:
             self.logger.error(f"Error sending message to agent {agent_id}: {e}")
@@ -473,70 +805,46 @@ class MessageBroker:
     
     async def _send_message(self, message: AgentMessage):
         """Send message through the broker."""
-        await self._route_message(message)
+        await self._route_message(MessageEnvelope.from_message(message, self.codec))
     
     def _start_background_tasks(self):
         """Start background maintenance tasks."""
-        # Agent health monitoring
-        task = asyncio.create_task(self._agent_health_monitor())
-        self.background_tasks.add(task)
-        task.add_done_callback(self.background_tasks.discard)
+        # Agent health monitoring, driven by heartbeat deadlines
+        self.liveness.start()
+        
+        # Live dashboard updates
+        self.live_updates.start()
         
         # Statistics reporting
         task = asyncio.create_task(self._statistics_reporter())
         self.background_tasks.add(task)
         task.add_done_callback(self.background_tasks.discard)
         
-        # Message cleanup
-        task = asyncio.create_task(self._message_cleanup())
-        self.background_tasks.add(task)
-        task.add_done_callback(self.background_tasks.discard)
+        # Message history persistence, capped per agent as it is written
+        if self.history_writer:
+            self.history_writer.start()
+        
+        # Local message log flushing and retention
+        if self.message_log:
+            task = asyncio.create_task(self._message_log_maintenance())
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+        
+        # Shard announcements and registry replication
+        if self.sharding:
+            self.sharding.start()
     
-    async def _agent_health_monitor(self):
-        """Monitor agent health and remove stale agents."""
-        while True:
-            try:
-                current_time = datetime.now()
-                stale_agents = []
-                
-                for agent_id, agent_conn in self.connected_agents.items():
-                    # Consider agent stale if no heartbeat for 5 minutes
-                    if current_time - agent_conn.last_heartbeat > timedelta(minutes=5):
-                        stale_agents.append(agent_id)
-                        agent_conn.status = 'inactive'
-                
-                # Remove very stale agents (no heartbeat for 30 minutes)
-                for agent_id, agent_conn in list(self.connected_agents.items()):
-                    if current_time - agent_conn.last_heartbeat > timedelta(minutes=30):
-                        await self._remove_agent(agent_id)
-                
-                if stale_agents:
-                    self.logger.warning(f"Detected {len(stale_agents)} stale agents")
-                
-                await asyncio.sleep(60)  # Check every minute
-                
-            except Exception as e:
-                self.logger.error(f"Error in agent health monitor: {e}")
-                await asyncio.sleep(60)
+    def _on_agent_inactive(self, agent_id: str):
+        """Mark an agent inactive once its heartbeat deadline has passed."""
+        agent_conn = self.connected_agents.get(agent_id)
+        if agent_conn is not None:
+            self._set_agent_status(agent_conn, 'inactive')
+            self.logger.warning(f"Agent {agent_id} missed its heartbeat deadline")
     
     async def _remove_agent(self, agent_id: str):
         """Remove agent from broker."""
         if agent_id in self.connected_agents:
-            # Remove from subscriptions
-            for topic, subscribers in self.agent_subscriptions.items():
-                subscribers.discard(agent_id)
-            
-            # Remove empty topics
-            empty_topics = [topic for topic, subscribers in self.agent_subscriptions.items() if not subscribers]
-            for topic in empty_topics:
-                del self.agent_subscriptions[topic]
-            
-            # Remove agent
-            del self.connected_agents[agent_id]
-            
-            # Update statistics
-            self.stats['agents_connected'] = len(self.connected_agents)
-            self.stats['topics_active'] = len(self.agent_subscriptions)
+            self._drop_agent(agent_id)
             
             self.logger.info(f"Removed stale agent: {agent_id}")
             
@@ -544,13 +852,71 @@ class MessageBroker:
             if self.redis_client:
                 await self.redis_client.hdel('agents', agent_id)
                 await self.redis_client.delete(f'messages:{agent_id}')
+            if self.message_log:
+                self.message_log.delete(agent_id)
+    
+    def _unsubscribe_agent(self, agent_id: str):
+        """Remove an agent from every topic it is subscribed to."""
+        for topic, subscribers in self.agent_subscriptions.items():
+            if agent_id in subscribers:
+                subscribers.discard(agent_id)
+                self.topic_trie.remove(topic, agent_id)
+        
+        # Remove empty topics
+        empty_topics = [topic for topic, subscribers in self.agent_subscriptions.items() if not subscribers]
+        for topic in empty_topics:
+            del self.agent_subscriptions[topic]
+    
+    def _drop_agent(self, agent_id: str):
+        """Remove an agent from the registry, indexes and subscriptions."""
+        agent_conn = self.connected_agents.pop(agent_id, None)
+        if agent_conn is None:
+            return
+        
+        self._unsubscribe_agent(agent_id)
+        self._unindex_agent(agent_conn)
+        self.liveness.forget(agent_id)
+        self._publish_agent_update(agent_id)
+        
+        # Update statistics
+        self.stats['agents_connected'] = len(self.connected_agents)
+        self.stats['topics_active'] = len(self.agent_subscriptions)
+    
+    def _apply_agent_state(self, agent_state: Dict[str, Any]):
+        """Apply an agent's registry entry replicated from another shard."""
+        agent_id = agent_state['agent_id']
+        previous = self.connected_agents.get(agent_id)
+        if previous is not None:
+            self._unsubscribe_agent(agent_id)
+            self._unindex_agent(previous)
+        
+        agent_conn = AgentConnection(
+            agent_id=agent_id,
+            agent_type=agent_state['agent_type'],
+            connection_time=datetime.fromisoformat(agent_state['connection_time']),
+            last_heartbeat=previous.last_heartbeat if previous else datetime.now(),
+            subscribed_topics=agent_state['subscribed_topics'],
+            message_count=previous.message_count if previous else 0,
+            status=agent_state['status'],
+            content_types=agent_state['content_types'],
+            content_encodings=agent_state.get('content_encodings', [])
+        )
+        self.connected_agents[agent_id] = agent_conn
+        self._index_agent(agent_conn)
+        for topic in agent_conn.subscribed_topics:
+            self._subscribe_agent(agent_id, topic)
+        self._publish_agent_update(agent_id)
+        
+        self.stats['agents_connected'] = len(self.connected_agents)
+        self.stats['topics_active'] = len(self.agent_subscriptions)
     
     async def _statistics_reporter(self):
         """Report broker statistics periodically."""
         while True:
             try:
                 # Update runtime statistics
-                uptime = datetime.now() - self.stats['start_time']
+                now = datetime.now()
+                uptime = now - self.stats['start_time']
                 
                 stats_message = AgentMessage(
                     id=str(uuid.uuid4()),
@@ -563,12 +929,10 @@ class MessageBroker:
                         'uptime_seconds': uptime.total_seconds(),
                         'connected_agents': len(self.connected_agents),
                         'active_topics': len(self.agent_subscriptions),
-                        'agent_types': {
-                            agent_type: len([a for a in self.connected_agents.values() if a.agent_type == agent_type])
-                            for agent_type in set(a.agent_type for a in self.connected_agents.values())
-                        }
+                        'agent_types': self._agent_type_counts()
                     },
-                    timestamp=datetime.now()
+                    timestamp=now,
+                    expires_at=now + timedelta(seconds=300)  # Superseded by the next report
                 )
                 
                 await self._send_message(stats_message)
@@ -579,21 +943,21 @@ class MessageBroker:
                 self.logger.error(f"Error in statistics reporter: {e}")
                 await asyncio.sleep(300)
     
-    async def _message_cleanup(self):
-        """Clean up old messages and data."""
+    async def _message_log_maintenance(self):
+        """Flush the local message log and apply its retention limits."""
         while True:
             try:
-                if self.redis_client:
-                    # Clean up old message queues
-                    for agent_id in self.connected_agents:
-                        # Keep only last 1000 messages per agent
-                        await self.redis_client.ltrim(f'messages:{agent_id}', 0, 999)
+                self.message_log.flush()
                 
-                await asyncio.sleep(3600)  # Clean up every hour
+                deleted = self.message_log.enforce_retention()
+                if deleted:
+                    self.logger.info(f"Deleted {deleted} expired message log segments")
+                
+                await asyncio.sleep(60)
                 
             except Exception as e:
-                self.logger.error(f"Error in message cleanup: {e}")
-                await asyncio.sleep(3600)
+                self.logger.error(f"Error in message log maintenance: {e}")
+                await asyncio.sleep(60)
     
     # HTTP API Handlers
     
@@ -630,18 +994,7 @@ class MessageBroker:
     async def handle_get_agents(self, request):
         """Handle get agents request."""
         try:
-            agents_data = []
-            
-            for agent_id, agent_conn in self.connected_agents.items():
-                agents_data.append({
-                    'agent_id': agent_id,
-                    'agent_type': agent_conn.agent_type,
-                    'status': agent_conn.status,
-                    'connection_time': agent_conn.connection_time.isoformat(),
-                    'last_heartbeat': agent_conn.last_heartbeat.isoformat(),
-                    'subscribed_topics': agent_conn.subscribed_topics,
-                    'message_count': agent_conn.message_count
-                })
+            agents_data = [self._agent_dict(agent_conn) for agent_conn in self.connected_agents.values()]
             
             return web.json_response({
                 'agents': agents_data,
@@ -679,21 +1032,25 @@ class MessageBroker:
                 'error': str(e)
             }, status=500)
     
+    async def handle_metrics(self, request):
+        """Prometheus scrape endpoint."""
+        body, content_type = self.metrics.render()
+        return web.Response(body=body, headers={'Content-Type': content_type})
+    
+    async def handle_get_shards(self, request):
+        """Handle get shard membership request."""
+        if not self.sharding:
+            return web.json_response({'sharding': False})
+        
+        return web.json_response({'sharding': True, **self.sharding.get_stats()})
+    
     async def handle_get_stats(self, request):
         """Handle get statistics request."""
         try:
-            uptime = datetime.now() - self.stats['start_time']
-            
-            return web.json_response({
-                'broker_stats': self.stats.copy(),
-                'uptime_seconds': uptime.total_seconds(),
-                'connected_agents': len(self.connected_agents),
-                'active_topics': len(self.agent_subscriptions),
-                'agent_types': {
-                    agent_type: len([a for a in self.connected_agents.values() if a.agent_type == agent_type])
-                    for agent_type in set(a.agent_type for a in self.connected_agents.values())
-                }
-            })
+            return web.json_response(
+                self._stats_snapshot(),
+                dumps=lambda data: json.dumps(data, default=str)
+            )
             
         except Exception as e:
             self.logger.error(f"Error handling get stats: {e}")
@@ -717,6 +1074,16 @@ class MessageBroker:
                 timestamp=datetime.now()
             )
             
+            # Like registrations over AMQP, the shard owning the agent tracks it
+            agent_id = registration_message.sender_id
+            if self.sharding and not self.sharding.owns(agent_id):
+                owner = self.sharding.owner(agent_id)
+                await self.sharding.forward(MessageEnvelope.from_message(registration_message, self.codec), owner)
+                return web.json_response({
+                    'status': 'success',
+                    'message': f'Agent registration forwarded to shard {owner}'
+                })
+            
             await self._handle_agent_registration(registration_message)
             
             return web.json_response({
@@ -744,9 +1111,8 @@ class MessageBroker:
                 
                 # Update topic subscriptions
                 for topic in topics:
-                    if topic not in self.agent_subscriptions:
-                        self.agent_subscriptions[topic] = set()
-                    self.agent_subscriptions[topic].add(agent_id)
+                    self._subscribe_agent(agent_id, topic)
+                self._publish_agent_update(agent_id)
                 
                 return web.json_response({
                     'status': 'success',
@@ -766,46 +1132,180 @@ class MessageBroker:
             }, status=500)
     
     async def handle_get_messages(self, request):
-        """Handle get messages for agent."""
+        """
+        Handle get messages for agent.
+        
+        Query parameters:
+            limit: Maximum number of messages (default 100)
+            cursor: Resume token from a previous response's next_cursor
+            offset: First log offset to return (message log only)
+            since, until: ISO 8601 time range (message log only)
+            format: 'ndjson' to stream one stored message per line
+        
+        Without offset or time range the newest messages are returned first.
+        NDJSON responses end with a {"next_cursor": ...} line; next_cursor is
+        null once there is nothing further to read.
+        """
         try:
             agent_id = request.match_info['agent_id']
             limit = int(request.query.get('limit', 100))
             
-            if not self.redis_client:
+            if not self.message_log and not self.redis_client:
                 return web.json_response({
                     'status': 'error',
                     'error': 'Message persistence not available'
                 }, status=503)
             
-            # Get messages from Redis
-            messages = await self.redis_client.lrange(f'messages:{agent_id}', 0, limit - 1)
+            state = self._history_query_state(request.query)
+            records = self._iter_history(agent_id, state, limit)
+            
+            if (request.query.get('format') == 'ndjson'
+                    or NDJSON_CONTENT_TYPE in request.headers.get('Accept', '')):
+                return await self._stream_history(request, records, state)
             
             message_data = []
-            for msg_json in messages:
+            async for body, offset in records:
                 try:
-                    message = AgentMessage.from_json(msg_json.decode())
-                    message_data.append({
-                        'id': message.id,
-                        'sender_id': message.sender_id,
-                        'message_type': message.message_type,
-                        'topic': message.topic,
-                        'timestamp': message.timestamp.isoformat(),
-                        'payload': message.payload
-                    })
+                    message_dict = self._stored_message_dict(body)
+                    if offset is not None:
+                        message_dict['offset'] = offset
+                    message_data.append(message_dict)
                 except Exception as e:
                     self.logger.debug(f"Error parsing stored message: {e}")
             
-            return web.json_response({
+            response = {
                 'messages': message_data,
-                'count': len(message_data)
-            })
+                'count': len(message_data),
+                'next_cursor': self._history_cursor(state)
+            }
+            if self.message_log:
+                response['first_offset'], response['next_offset'] = self.message_log.offsets(agent_id)
+            
+            return web.json_response(response)
             
+        except ValueError as e:
+            return web.json_response({
+                'status': 'error',
+                'error': f'Invalid query parameter: {e}'
+            }, status=400)
         except Exception as e:
             self.logger.error(f"Error handling get messages: {e}")
             return web.json_response({
                 'status': 'error',
                 'error': str(e)
             }, status=500)
+    
+    async def _stream_history(self, request, records, state: Dict[str, Any]) -> web.StreamResponse:
+        """Stream stored messages as NDJSON, forwarding the stored bytes."""
+        stream = NdjsonStream(request)
+        await stream.start()
+        
+        try:
+            async for body, offset in records:
+                await stream.write_line(ndjson_record(body, offset))
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            self.logger.error(f"Error streaming messages: {e}")
+            return await stream.finish({'error': str(e), 'next_cursor': self._history_cursor(state)})
+        
+        return await stream.finish({'next_cursor': self._history_cursor(state)})
+    
+    def _history_query_state(self, query) -> Dict[str, Any]:
+        """Build the resume state of a history query from its parameters or cursor."""
+        if 'cursor' in query:
+            state = decode_cursor(query['cursor'])
+            if ('i' in state) == bool(self.message_log):
+                raise ValueError("cursor does not match the history backend")
+            return state
+        
+        if not self.message_log:
+            return {'i': 0}
+        
+        if not any(key in query for key in ('offset', 'since', 'until')):
+            return {'r': 1, 'o': None}
+        
+        # Validate up front so bad parameters fail before streaming starts
+        for key in ('since', 'until'):
+            if key in query:
+                datetime.fromisoformat(query[key])
+        
+        return {
+            'o': int(query['offset']) if 'offset' in query else None,
+            's': query.get('since'),
+            'u': query.get('until')
+        }
+    
+    def _history_cursor(self, state: Dict[str, Any]) -> Optional[str]:
+        """Opaque token resuming a history query after its last returned message."""
+        if state.get('done'):
+            return None
+        return encode_cursor({key: value for key, value in state.items() if value is not None})
+    
+    async def _iter_history(self, agent_id: str, state: Dict[str, Any], limit: int):
+        """
+        Yield (body, offset) pairs for a history query, advancing state as it goes.
+        
+        The message log resumes from offsets, newest first or in offset order.
+        Redis resumes from a list index, shifted by the number of messages
+        pushed since the cursor was issued (approximate once the list is capped).
+        """
+        count = 0
+        
+        if self.message_log:
+            reverse = bool(state.get('r'))
+            if reverse:
+                records = self.message_log.iter_records_reverse(agent_id, before=state.get('o'))
+            else:
+                records = self.message_log.iter_records(
+                    agent_id,
+                    offset=state.get('o'),
+                    since=datetime.fromisoformat(state['s']) if state.get('s') else None,
+                    until=datetime.fromisoformat(state['u']) if state.get('u') else None
+                )
+            
+            for record in records:
+                if count >= limit:
+                    return
+                count += 1
+                state['o'] = record.offset if reverse else record.offset + 1
+                state.pop('s', None)
+                yield record.body, record.offset
+            
+            # Forward queries without an end time can be resumed as the log grows
+            if reverse or state.get('u'):
+                state['done'] = True
+            return
+        
+        key = f'messages:{agent_id}'
+        length = await self.redis_client.llen(key)
+        index = state.get('i', 0) + max(length - state.get('n', length), 0)
+        state['n'] = length
+        
+        while count < limit:
+            page_size = min(limit - count, 256)
+            page = await self.redis_client.lrange(key, index, index + page_size - 1)
+            
+            for body in page:
+                index += 1
+                count += 1
+                state['i'] = index
+                yield body, None
+            
+            if len(page) < page_size:
+                state['done'] = True
+                return
+    
+    def _stored_message_dict(self, body: bytes) -> Dict[str, Any]:
+        """Convert a stored message body to its API representation."""
+        message = AgentMessage.from_json(body.decode())
+        return {
+            'id': message.id,
+            'sender_id': message.sender_id,
+            'message_type': message.message_type,
+            'topic': message.topic,
+            'timestamp': message.timestamp.isoformat(),
+            'payload': message.payload
+        }
 
 
 # Factory function for creating message broker
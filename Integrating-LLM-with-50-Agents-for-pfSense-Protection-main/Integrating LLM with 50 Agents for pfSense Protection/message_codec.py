@@ -0,0 +1,368 @@
+"""
+Message Codecs for pfSense Multi-Agent System
+
+This module defines the wire formats used to serialize AgentMessage objects.
+Each codec is identified by the AMQP content type it publishes with, so agents
+using different encodings can share the same exchange during rolling upgrades:
+the receiver always selects the decoder from the message properties.
+"""
+
+import json
+import struct
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+
+JSON_CONTENT_TYPE = 'application/json'
+BINARY_CONTENT_TYPE = 'application/x-pfsense-agent-message'
+
+# AMQP headers carrying routing metadata next to the encoded body. Message id,
+# type and priority use the standard message_id, type and priority properties.
+HEADER_SENDER_ID = 'x-sender-id'
+HEADER_RECIPIENT_ID = 'x-recipient-id'
+HEADER_TOPIC = 'x-topic'
+HEADER_EXPIRES_AT = 'x-expires-at'  # epoch milliseconds
+
+
+def _json_default(value: Any) -> Any:
+    """Serialize values json does not know about (e.g. datetimes in stats)."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def dump_payload(payload: Dict[str, Any]) -> str:
+    """Serialize a message payload to compact JSON."""
+    return json.dumps(payload, separators=(',', ':'), default=_json_default)
+
+
+def expires_at_ms(message) -> Optional[int]:
+    """Expiry of a message or envelope in epoch milliseconds, None if it never expires."""
+    expires_at = getattr(message, 'expires_at', None)
+    if isinstance(expires_at, datetime):
+        return int(expires_at.timestamp() * 1000)
+    return expires_at
+
+
+def now_ms() -> int:
+    """Current time in epoch milliseconds, the unit expiry headers use."""
+    return int(time.time() * 1000)
+
+
+class MessageCodec(ABC):
+    """Base class for AgentMessage wire codecs."""
+
+    name: str = ''
+    content_type: str = ''
+
+    @abstractmethod
+    def encode(self, message) -> bytes:
+        """Encode an AgentMessage to bytes."""
+        pass
+
+    @abstractmethod
+    def decode_fields(self, body: bytes) -> Dict[str, Any]:
+        """Decode bytes into AgentMessage constructor arguments."""
+        pass
+
+
+class JsonCodec(MessageCodec):
+    """Legacy JSON document format, understood by every agent version."""
+
+    name = 'json'
+    content_type = JSON_CONTENT_TYPE
+
+    def encode(self, message) -> bytes:
+        # Build the document directly instead of dataclasses.asdict(), which
+        # deep-copies the whole payload before it is serialized.
+        document = {
+            'id': message.id,
+            'sender_id': message.sender_id,
+            'recipient_id': message.recipient_id,
+            'message_type': message.message_type,
+            'topic': message.topic,
+            'payload': message.payload,
+            'timestamp': message.timestamp.isoformat(),
+            'priority': message.priority
+        }
+        # Expiry travels only in the x-expires-at header and the AMQP
+        # expiration property: older decoders pass every document key to
+        # AgentMessage and reject the document over an unknown field.
+        return json.dumps(document, separators=(',', ':'), default=_json_default).encode()
+
+    def decode_fields(self, body: bytes) -> Dict[str, Any]:
+        data = json.loads(body)
+        data['timestamp'] = datetime.fromisoformat(data['timestamp'])
+        if data.get('expires_at') is not None:
+            data['expires_at'] = datetime.fromisoformat(data['expires_at'])
+        return data
+
+
+class BinaryCodec(MessageCodec):
+    """
+    Compact struct-packed envelope.
+
+    Layout (network byte order):
+        version:u8 flags:u8 priority:u8 timestamp_ms:i64
+        len(id):u16 len(sender_id):u16 len(recipient_id):u16
+        len(message_type):u16 len(topic):u16 len(payload):u32
+    followed by the UTF-8 envelope strings and the payload. The payload itself
+    stays compact JSON: the C json module is faster than any pure-Python
+    packer, and the envelope removes the datetime formatting and parsing.
+    Expiring messages set FLAG_HAS_EXPIRY and append expires_at_ms:i64 after
+    the payload, which decoders that predate the flag skip.
+    """
+
+    name = 'binary'
+    content_type = BINARY_CONTENT_TYPE
+
+    VERSION = 1
+    FLAG_HAS_RECIPIENT = 0x01
+    FLAG_HAS_EXPIRY = 0x02
+
+    _header = struct.Struct('!BBBqHHHHHI')
+    _expiry = struct.Struct('!q')
+
+    def encode(self, message) -> bytes:
+        message_id = message.id.encode()
+        sender_id = message.sender_id.encode()
+        recipient_id = message.recipient_id.encode() if message.recipient_id is not None else b''
+        message_type = message.message_type.encode()
+        topic = message.topic.encode()
+        payload = dump_payload(message.payload).encode()
+
+        flags = self.FLAG_HAS_RECIPIENT if message.recipient_id is not None else 0
+        expires_at = getattr(message, 'expires_at', None)
+        if expires_at is not None:
+            flags |= self.FLAG_HAS_EXPIRY
+
+        header = self._header.pack(
+            self.VERSION,
+            flags,
+            message.priority,
+            int(message.timestamp.timestamp() * 1000),
+            len(message_id),
+            len(sender_id),
+            len(recipient_id),
+            len(message_type),
+            len(topic),
+            len(payload)
+        )
+
+        parts = [header, message_id, sender_id, recipient_id, message_type, topic, payload]
+        if expires_at is not None:
+            parts.append(self._expiry.pack(int(expires_at.timestamp() * 1000)))
+        return b''.join(parts)
+
+    def decode_fields(self, body: bytes) -> Dict[str, Any]:
+        (version, flags, priority, timestamp_ms,
+         id_len, sender_len, recipient_len, type_len, topic_len, payload_len) = self._header.unpack_from(body)
+
+        if version != self.VERSION:
+            raise ValueError(f"Unsupported binary message version: {version}")
+
+        offset = self._header.size
+        fields = []
+        for length in (id_len, sender_len, recipient_len, type_len, topic_len):
+            fields.append(body[offset:offset + length].decode())
+            offset += length
+
+        payload = json.loads(body[offset:offset + payload_len])
+
+        decoded = {
+            'id': fields[0],
+            'sender_id': fields[1],
+            'recipient_id': fields[2] if flags & self.FLAG_HAS_RECIPIENT else None,
+            'message_type': fields[3],
+            'topic': fields[4],
+            'payload': payload,
+            'timestamp': datetime.fromtimestamp(timestamp_ms / 1000),
+            'priority': priority
+        }
+        if flags & self.FLAG_HAS_EXPIRY:
+            (expires_ms,) = self._expiry.unpack_from(body, offset + payload_len)
+            decoded['expires_at'] = datetime.fromtimestamp(expires_ms / 1000)
+        return decoded
+
+
+# Registry of available codecs, in order of preference
+_codecs_by_name: Dict[str, MessageCodec] = {}
+_codecs_by_content_type: Dict[str, MessageCodec] = {}
+
+
+def register_codec(codec: MessageCodec):
+    """Register a codec so it can be selected by name or content type."""
+    _codecs_by_name[codec.name] = codec
+    _codecs_by_content_type[codec.content_type] = codec
+
+
+def get_codec(content_type: Optional[str] = None) -> MessageCodec:
+    """
+    Get the codec for an AMQP content type.
+
+    Messages without a content type come from agents that predate codec
+    negotiation and are always JSON.
+    """
+    if not content_type:
+        return _codecs_by_content_type[JSON_CONTENT_TYPE]
+
+    codec = _codecs_by_content_type.get(content_type)
+    if codec is None:
+        raise ValueError(f"Unsupported message content type: {content_type}")
+    return codec
+
+
+def get_codec_by_name(name: str) -> MessageCodec:
+    """Get a codec by its configuration name (e.g. 'json', 'binary')."""
+    codec = _codecs_by_name.get(name)
+    if codec is None:
+        raise ValueError(f"Unknown message codec: {name}")
+    return codec
+
+
+def supported_content_types(preferred: Optional[MessageCodec] = None) -> List[str]:
+    """List the content types this process can decode, preferred one first."""
+    content_types = list(_codecs_by_content_type)
+    if preferred is not None:
+        content_types.remove(preferred.content_type)
+        content_types.insert(0, preferred.content_type)
+    return content_types
+
+
+def negotiate_codec(accepted_content_types: Optional[List[str]]) -> MessageCodec:
+    """Pick the first codec a peer accepts that this process also supports."""
+    for content_type in accepted_content_types or []:
+        codec = _codecs_by_content_type.get(content_type)
+        if codec is not None:
+            return codec
+    return _codecs_by_content_type[JSON_CONTENT_TYPE]
+
+
+def routing_headers(message, recipient_id: Optional[str] = None) -> Dict[str, Any]:
+    """Build the AMQP routing headers for a message or envelope."""
+    headers = {
+        HEADER_SENDER_ID: message.sender_id,
+        HEADER_TOPIC: message.topic
+    }
+    recipient_id = recipient_id or message.recipient_id
+    if recipient_id is not None:
+        headers[HEADER_RECIPIENT_ID] = recipient_id
+    expires_at = expires_at_ms(message)
+    if expires_at is not None:
+        headers[HEADER_EXPIRES_AT] = expires_at
+    return headers
+
+
+def amqp_expiration(expires_at: Optional[int]) -> Optional[str]:
+    """
+    Per-message TTL for the AMQP expiration property.
+
+    RabbitMQ takes the TTL relative to when the message reaches a queue, so
+    it is recomputed from the absolute expiry on every publish.
+    """
+    if expires_at is None:
+        return None
+    return str(max(0, expires_at - now_ms()))
+
+
+@dataclass
+class MessageEnvelope:
+    """
+    Routing metadata plus the encoded message body.
+
+    Lets the broker route, fan out and persist a message without decoding
+    its payload. The body is only re-encoded when a recipient does not accept
+    the original content type, and each such transcoding is done once. The
+    body is always uncompressed; compressed forms for recipients that accept
+    them are kept separately, including the one the message arrived in.
+    """
+    id: str
+    sender_id: str
+    recipient_id: Optional[str]
+    message_type: str
+    topic: str
+    priority: int
+    content_type: str
+    body: bytes
+    expires_at: Optional[int] = None  # epoch milliseconds
+    _bodies: Dict[str, bytes] = field(default_factory=dict, repr=False)
+    _wire_bodies: Dict[str, Tuple[bytes, Optional[str]]] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_message(cls, message, codec: MessageCodec, body: Optional[bytes] = None) -> 'MessageEnvelope':
+        """Wrap a message with its routing metadata, encoding it unless body is given."""
+        return cls(
+            id=message.id,
+            sender_id=message.sender_id,
+            recipient_id=message.recipient_id,
+            message_type=message.message_type,
+            topic=message.topic,
+            priority=message.priority,
+            content_type=codec.content_type,
+            body=body if body is not None else codec.encode(message),
+            expires_at=expires_at_ms(message)
+        )
+
+    @classmethod
+    def from_properties(cls, properties, body: bytes) -> Optional['MessageEnvelope']:
+        """
+        Build an envelope from AMQP properties alone.
+
+        Returns None for messages published without routing headers (agents
+        predating header routing); those have to be decoded instead.
+        """
+        headers = properties.headers or {}
+        if HEADER_TOPIC not in headers or not properties.type:
+            return None
+
+        return cls(
+            id=properties.message_id,
+            sender_id=headers.get(HEADER_SENDER_ID),
+            recipient_id=headers.get(HEADER_RECIPIENT_ID),
+            message_type=properties.type,
+            topic=headers[HEADER_TOPIC],
+            priority=properties.priority or 1,
+            content_type=get_codec(properties.content_type).content_type,
+            body=body,
+            expires_at=headers.get(HEADER_EXPIRES_AT)
+        )
+
+    def is_expired(self, now: Optional[int] = None) -> bool:
+        """Whether the message is past its expiry; now is in epoch milliseconds."""
+        return self.expires_at is not None and self.expires_at <= (now if now is not None else now_ms())
+
+    def body_for(self, content_type: str) -> bytes:
+        """Get the body encoded for a content type, transcoding at most once."""
+        if content_type == self.content_type:
+            return self.body
+
+        body = self._bodies.get(content_type)
+        if body is None:
+            fields = get_codec(self.content_type).decode_fields(self.body)
+            if fields.get('expires_at') is None and self.expires_at is not None:
+                # A JSON body leaves the expiry to the headers the envelope was built from
+                fields['expires_at'] = datetime.fromtimestamp(self.expires_at / 1000)
+            body = get_codec(content_type).encode(SimpleNamespace(**fields))
+            self._bodies[content_type] = body
+        return body
+
+    def keep_wire_body(self, body: bytes, content_encoding: Optional[str]):
+        """Remember the compressed body the message arrived in, to forward it as is."""
+        if content_encoding:
+            self._wire_bodies[self.content_type] = (body, content_encoding)
+
+    def wire_body_for(self, content_type: str, compressor) -> Tuple[bytes, Optional[str]]:
+        """Get the body and content encoding to publish, compressing at most once per content type."""
+        wire = self._wire_bodies.get(content_type)
+        if wire is None:
+            wire = compressor.compress(self.topic, self.body_for(content_type))
+            self._wire_bodies[content_type] = wire
+        return wire
+
+
+register_codec(JsonCodec())
+register_codec(BinaryCodec())
@@ -0,0 +1,261 @@
+"""
+Metrics Registry for pfSense Multi-Agent System
+
+This module provides the Prometheus counters and histograms shared by the
+message broker and every agent in a process: broker route latency, handler
+latency, per-priority queue depth, publish batch sizes, compression ratios
+per topic, LLM latency, time to the first streamed response field and
+response cache hits per analysis type, LLM rate-limit queue wait and shed
+requests per priority, LLM batch sizes, SSH command latency,
+duplicate-message hits and expired messages skipped. The broker serves them
+on /metrics, and processes without a broker can expose them on
+monitoring.metrics_port.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, start_http_server
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+
+ROUTE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+HANDLER_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUEUE_WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+SSH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+COMPRESSION_RATIO_BUCKETS = (1.0, 1.1, 1.5, 2.0, 3.0, 5.0, 8.0, 12.0, 20.0, 50.0)
+
+
+class _QueueDepthCollector:
+    """Reads agent queue depths at scrape time, so enqueueing records nothing."""
+
+    def __init__(self, metrics: 'SystemMetrics'):
+        self.metrics = metrics
+
+    def collect(self):
+        depth = GaugeMetricFamily(
+            'pfsense_agent_queue_depth',
+            'Messages waiting in an agent dispatch queue',
+            labels=['agent_id', 'priority']
+        )
+        for agent_id, queue in list(self.metrics.queues.items()):
+            for priority, count in queue.depths().items():
+                depth.add_metric([agent_id, priority], count)
+        yield depth
+
+
+class _DedupeCollector:
+    """Reads dedupe cache counters at scrape time."""
+
+    def __init__(self, metrics: 'SystemMetrics'):
+        self.metrics = metrics
+
+    def collect(self):
+        checks = CounterMetricFamily(
+            'pfsense_dedupe_checks', 'Message IDs checked against a dedupe window', labels=['consumer']
+        )
+        hits = CounterMetricFamily(
+            'pfsense_dedupe_hits', 'Duplicate messages dropped', labels=['consumer']
+        )
+        for consumer, cache in list(self.metrics.dedupe_caches.items()):
+            checks.add_metric([consumer], cache.stats['checks'])
+            hits.add_metric([consumer], cache.stats['hits'])
+        yield checks
+        yield hits
+
+
+class SystemMetrics:
+    """
+    Prometheus metrics for the broker and agents of one process.
+
+    Metrics live in their own registry rather than the global default one.
+    Labelled children are looked up once and cached, so recording on a hot
+    path is a dictionary lookup plus the observation itself.
+    """
+
+    def __init__(self, registry: CollectorRegistry = None):
+        self.registry = registry or CollectorRegistry()
+        self.queues: Dict[str, Any] = {}
+        self.dedupe_caches: Dict[str, Any] = {}
+        self._children: Dict[Tuple[Any, Tuple[str, ...]], Any] = {}
+        self._server_port = None
+        self._server_lock = threading.Lock()
+
+        # Broker
+        self.route_seconds = Histogram(
+            'pfsense_broker_route_seconds', 'Time to route a message to its recipients',
+            ['message_type'], buckets=ROUTE_BUCKETS, registry=self.registry
+        )
+
+        # Agents
+        self.handler_seconds = Histogram(
+            'pfsense_agent_handler_seconds', 'Time spent in agent message handlers',
+            ['agent_type', 'message_type'], buckets=HANDLER_BUCKETS, registry=self.registry
+        )
+        self.messages_received = Counter(
+            'pfsense_agent_messages_received', 'Messages received by agents',
+            ['agent_type'], registry=self.registry
+        )
+        self.messages_sent = Counter(
+            'pfsense_agent_messages_sent', 'Messages sent by agents',
+            ['agent_type'], registry=self.registry
+        )
+        self.agent_errors = Counter(
+            'pfsense_agent_errors', 'Errors while sending or handling messages',
+            ['agent_type'], registry=self.registry
+        )
+        self.messages_expired = Counter(
+            'pfsense_messages_expired', 'Messages skipped because they expired before being handled',
+            ['consumer'], registry=self.registry
+        )
+        self.publish_batch_size = Histogram(
+            'pfsense_publish_batch_size', 'Messages per published batch',
+            buckets=BATCH_SIZE_BUCKETS, registry=self.registry
+        )
+        self.compression_ratio = Histogram(
+            'pfsense_compression_ratio', 'Uncompressed to compressed size of compressed message bodies',
+            ['pattern'], buckets=COMPRESSION_RATIO_BUCKETS, registry=self.registry
+        )
+        self.registry.register(_QueueDepthCollector(self))
+        self.registry.register(_DedupeCollector(self))
+
+        # External calls
+        self.llm_seconds = Histogram(
+            'pfsense_llm_request_seconds', 'LLM request latency',
+            ['analysis_type'], buckets=LLM_BUCKETS, registry=self.registry
+        )
+        self.llm_first_field_seconds = Histogram(
+            'pfsense_llm_first_field_seconds', 'Time from sending a streamed LLM request to its first complete field',
+            ['analysis_type'], buckets=LLM_BUCKETS, registry=self.registry
+        )
+        self.llm_errors = Counter(
+            'pfsense_llm_errors', 'Failed LLM requests',
+            ['analysis_type'], registry=self.registry
+        )
+        self.llm_cache_lookups = Counter(
+            'pfsense_llm_cache_lookups', 'LLM response cache lookups',
+            ['analysis_type', 'result'], registry=self.registry
+        )
+        self.llm_coalesced = Counter(
+            'pfsense_llm_coalesced', 'LLM requests that shared an identical request already in flight',
+            ['analysis_type'], registry=self.registry
+        )
+        self.llm_cache_saved_seconds = Counter(
+            'pfsense_llm_cache_saved_seconds', 'Provider latency avoided by LLM response cache hits',
+            ['analysis_type'], registry=self.registry
+        )
+        self.llm_queue_wait_seconds = Histogram(
+            'pfsense_llm_queue_wait_seconds', 'Time LLM requests waited for rate-limit budget',
+            ['priority'], buckets=QUEUE_WAIT_BUCKETS, registry=self.registry
+        )
+        self.llm_shed = Counter(
+            'pfsense_llm_shed', 'LLM requests dropped after waiting too long for rate-limit budget',
+            ['priority'], registry=self.registry
+        )
+        self.llm_batch_items = Histogram(
+            'pfsense_llm_batch_items', 'Analysis items sent per batched LLM request',
+            ['analysis_type'], buckets=BATCH_SIZE_BUCKETS, registry=self.registry
+        )
+        self.ssh_seconds = Histogram(
+            'pfsense_ssh_command_seconds', 'pfSense SSH command latency, including reading output',
+            ['command'], buckets=SSH_BUCKETS, registry=self.registry
+        )
+
+    def child(self, metric, *labelvalues: str):
+        """Get a metric's labelled child, cached after the first lookup."""
+        key = (metric, labelvalues)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = metric.labels(*labelvalues)
+        return child
+
+    def observe_route(self, message_type: str, seconds: float):
+        self.child(self.route_seconds, message_type).observe(seconds)
+
+    def observe_handler(self, agent_type: str, message_type: str, seconds: float):
+        self.child(self.handler_seconds, agent_type, message_type).observe(seconds)
+
+    def observe_batch(self, batch_size: int):
+        self.publish_batch_size.observe(batch_size)
+
+    def observe_compression(self, pattern: str, original_size: int, compressed_size: int):
+        # Labelled by threshold pattern; raw topics include one per agent
+        self.child(self.compression_ratio, pattern).observe(original_size / max(compressed_size, 1))
+
+    def observe_llm(self, analysis_type: str, seconds: float, failed: bool = False):
+        self.child(self.llm_seconds, analysis_type).observe(seconds)
+        if failed:
+            self.child(self.llm_errors, analysis_type).inc()
+
+    def observe_llm_first_field(self, analysis_type: str, seconds: float):
+        self.child(self.llm_first_field_seconds, analysis_type).observe(seconds)
+
+    def observe_llm_cache(self, analysis_type: str, hit: bool, saved_seconds: float = 0.0):
+        self.child(self.llm_cache_lookups, analysis_type, 'hit' if hit else 'miss').inc()
+        if hit:
+            self.child(self.llm_cache_saved_seconds, analysis_type).inc(saved_seconds)
+
+    def observe_llm_coalesced(self, analysis_type: str):
+        self.child(self.llm_coalesced, analysis_type).inc()
+
+    def observe_llm_queue_wait(self, priority: str, seconds: float):
+        self.child(self.llm_queue_wait_seconds, priority).observe(seconds)
+
+    def observe_llm_shed(self, priority: str):
+        self.child(self.llm_shed, priority).inc()
+
+    def observe_llm_batch(self, analysis_type: str, items: int):
+        self.child(self.llm_batch_items, analysis_type).observe(items)
+
+    @contextmanager
+    def time_ssh_command(self, command: str) -> Iterator[None]:
+        """Time an SSH command, labelled by its program name (e.g. 'netstat')."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.child(self.ssh_seconds, command).observe(time.perf_counter() - start_time)
+
+    def register_queue(self, agent_id: str, queue: Any):
+        """Report a PriorityMessageQueue's depths per priority until unregistered."""
+        self.queues[agent_id] = queue
+
+    def unregister_queue(self, agent_id: str):
+        self.queues.pop(agent_id, None)
+
+    def register_dedupe_cache(self, consumer: str, cache: Any):
+        """Report a DedupeCache's checks and hits until unregistered."""
+        self.dedupe_caches[consumer] = cache
+
+    def unregister_dedupe_cache(self, consumer: str):
+        self.dedupe_caches.pop(consumer, None)
+
+    def render(self) -> Tuple[bytes, str]:
+        """Exposition-format body and content type for a scrape."""
+        return generate_latest(self.registry), CONTENT_TYPE_LATEST
+
+    def start_server(self, port: int) -> bool:
+        """Serve /metrics on a port; only the first call in a process starts a server."""
+        with self._server_lock:
+            if self._server_port is not None:
+                return False
+            start_http_server(port, registry=self.registry)
+            self._server_port = port
+            return True
+
+
+# Singleton instance shared by the broker and agents in the process
+_metrics = None
+
+def get_metrics() -> SystemMetrics:
+    """Get the process-wide metrics registry."""
+    global _metrics
+    if _metrics is None:
+        _metrics = SystemMetrics()
+    return _metrics
@@ -0,0 +1,81 @@
+"""
+Metrics Micro-Benchmark for pfSense Multi-Agent System
+
+Measures what recording Prometheus metrics costs on the hot paths: the timer
+and histogram observation added to every routed message and handled message,
+and the counter increments on send and receive. Costs are compared with
+encoding a heartbeat, which every message already pays at least once; the
+broker benchmark puts the full CPU cost of routing a message in context.
+
+Usage:
+    python -m core.metrics_benchmark [--iterations N] [--json]
+"""
+
+import argparse
+import json
+import time
+import timeit
+from typing import Any, Dict
+
+from prometheus_client import CollectorRegistry
+
+from .codec_benchmark import build_heartbeat_message
+from .message_codec import JsonCodec
+from .metrics import SystemMetrics
+
+
+def _measure_ns(func, iterations: int) -> float:
+    """Return nanoseconds per call of func, best of three runs."""
+    best = min(timeit.repeat(func, number=iterations, repeat=3))
+    return best / iterations * 1e9
+
+
+def _record_route(metrics: SystemMetrics):
+    """Everything MessageBroker._route_message records for one message."""
+    start_time = time.perf_counter()
+    metrics.observe_route('alert', time.perf_counter() - start_time)
+
+
+def run_benchmark(iterations: int = 200000) -> Dict[str, Any]:
+    """Run the benchmark and return nanoseconds per operation."""
+    # A private registry keeps benchmark samples out of the process metrics
+    metrics = SystemMetrics(CollectorRegistry())
+    received = metrics.child(metrics.messages_received, 'log_analyzer')
+    codec = JsonCodec()
+    message = build_heartbeat_message()
+
+    operations = {
+        'perf_counter': lambda: time.perf_counter(),
+        'counter_inc': lambda: received.inc(),
+        'histogram_observe_cached': lambda: metrics.observe_handler('log_analyzer', 'alert', 0.004),
+        'histogram_observe_labels': lambda: metrics.handler_seconds.labels('log_analyzer', 'alert').observe(0.004),
+        'route_recording': lambda: _record_route(metrics),
+        'heartbeat_encode': lambda: codec.encode(message)
+    }
+
+    results = {name: _measure_ns(func, iterations) for name, func in operations.items()}
+    results['route_overhead_vs_encode'] = results['route_recording'] / results['heartbeat_encode']
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prometheus metrics recording micro-benchmark")
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--json', action='store_true', help="Emit results as JSON")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.iterations)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'operation':<28} {'ns/op':>10}")
+    for name, value in results.items():
+        if name != 'route_overhead_vs_encode':
+            print(f"{name:<28} {value:>10,.0f}")
+    print(f"\nroute recording costs {results['route_overhead_vs_encode']:.1%} of a heartbeat encode")
+
+
+if __name__ == '__main__':
+    main()
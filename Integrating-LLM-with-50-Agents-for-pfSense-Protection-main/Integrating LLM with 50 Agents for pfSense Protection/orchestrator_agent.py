@@ -13,6 +13,7 @@ from typing import Dict, List, Any, Optional
 from dataclasses import dataclass, asdict
 
 from .base_agent import BaseAgent, AgentConfig, AgentMessage
+from .liveness_tracker import LivenessTracker
 from ..llm_integration.llm_client import get_llm_client
 
 
@@ -77,12 +78,19 @@ class OrchestratorAgent(BaseAgent):
         }
         
         # LLM client for decision making
-        self.llm_client = get_llm_client()
+        self.llm_client = get_llm_client(config.llm)
         
         # Configuration
         self.heartbeat_timeout = timedelta(seconds=config.heartbeat_interval * 3)
         self.task_assignment_interval = 10  # seconds
         
+        # Heartbeat deadlines: mark agents inactive, then remove them
+        timeout_seconds = self.heartbeat_timeout.total_seconds()
+        self.liveness = LivenessTracker([
+            (timeout_seconds, self._on_agent_stale),
+            (timeout_seconds * 2, self._remove_stale_agent)
+        ], logger=self.logger)
+        
         self.logger.info("Orchestrator Agent initialized")
     
     async def initialize(self):
@@ -99,7 +107,7 @@ class OrchestratorAgent(BaseAgent):
         ]
         
         # Start orchestrator-specific tasks
-        asyncio.create_task(self._health_monitor_loop())
+        self.liveness.start()
         asyncio.create_task(self._task_assignment_loop())
         asyncio.create_task(self._system_analysis_loop())
         
@@ -112,7 +120,6 @@ class OrchestratorAgent(BaseAgent):
         while self.is_running:
             try:
                 # Perform periodic system maintenance
-                await self._cleanup_stale_agents()
                 await self._update_system_health()
                 await self._process_pending_tasks()
                 
@@ -125,6 +132,7 @@ class OrchestratorAgent(BaseAgent):
     
     async def cleanup(self):
         """Cleanup orchestrator resources."""
+        await self.liveness.stop()
         self.logger.info("Orchestrator cleanup completed")
     
     async def handle_message(self, message: AgentMessage):
@@ -152,6 +160,8 @@ class OrchestratorAgent(BaseAgent):
         if not agent_id:
             return
         
+        self.liveness.touch(agent_id)
+        
         if agent_id in self.registered_agents:
             # Update existing agent
             agent_reg = self.registered_agents[agent_id]
@@ -194,6 +204,8 @@ class OrchestratorAgent(BaseAgent):
             config=payload.get('config', {})
         )
         
+        self.liveness.touch(agent_id)
+        
         # Update capability mapping
         self.agent_capabilities[agent_id] = payload.get('capabilities', [])
         
@@ -219,13 +231,24 @@ class OrchestratorAgent(BaseAgent):
         
         # Use LLM to analyze the alert and determine response
         if severity in ['high', 'critical']:
+            response_started = False
+            
+            async def on_field(name: str, value: Any):
+                # Start responding as soon as the immediate actions are
+                # streamed, without waiting for the rest of the plan
+                nonlocal response_started
+                if name == 'immediate_actions' and isinstance(value, list) and value and not response_started:
+                    response_started = True
+                    await self._create_response_task(alert_data, value)
+            
             llm_response = await self.llm_client.recommend_incident_response(
                 incident_data=alert_data,
-                severity=severity
+                severity=severity,
+                on_field=on_field
             )
             
             # Create response task based on LLM recommendations
-            if llm_response.suggested_actions:
+            if not response_started and llm_response.suggested_actions:
                 await self._create_response_task(alert_data, llm_response.suggested_actions)
         
         # Forward critical alerts to administrators
@@ -277,30 +300,12 @@ class OrchestratorAgent(BaseAgent):
             # Agent requesting collaboration with other agents
             await self._facilitate_agent_collaboration(message)
     
-    async def _health_monitor_loop(self):
-        """Monitor system and agent health."""
-        while self.is_running:
-            try:
-                current_time = datetime.now()
-                
-                # Check for stale agents
-                stale_agents = []
-                for agent_id, agent_reg in self.registered_agents.items():
-                    if current_time - agent_reg.last_heartbeat > self.heartbeat_timeout:
-                        stale_agents.append(agent_id)
-                        agent_reg.status = 'inactive'
-                
-                if stale_agents:
-                    self.logger.warning(f"Detected {len(stale_agents)} stale agents: {stale_agents}")
-                
-                # Update system health metrics
-                await self._update_system_health()
-                
-                await asyncio.sleep(30)  # Check every 30 seconds
-                
-            except Exception as e:
-                self.logger.error(f"Error in health monitor: {e}")
-                await asyncio.sleep(30)
+    def _on_agent_stale(self, agent_id: str):
+        """Mark an agent inactive once its heartbeat deadline has passed."""
+        agent_reg = self.registered_agents.get(agent_id)
+        if agent_reg is not None:
+            agent_reg.status = 'inactive'
+            self.logger.warning(f"Detected stale agent: {agent_id}")
     
     async def _task_assignment_loop(self):
         """Assign tasks to appropriate agents."""
@@ -461,19 +466,10 @@ class OrchestratorAgent(BaseAgent):
             'last_update': datetime.now()
         })
     
-    async def _cleanup_stale_agents(self):
-        """Remove agents that haven't sent heartbeats."""
-        current_time = datetime.now()
-        stale_agents = []
-        
-        for agent_id, agent_reg in list(self.registered_agents.items()):
-            if current_time - agent_reg.last_heartbeat > self.heartbeat_timeout * 2:
-                stale_agents.append(agent_id)
-        
-        for agent_id in stale_agents:
-            del self.registered_agents[agent_id]
-            if agent_id in self.agent_capabilities:
-                del self.agent_capabilities[agent_id]
+    def _remove_stale_agent(self, agent_id: str):
+        """Remove an agent that stayed silent for twice the heartbeat timeout."""
+        if self.registered_agents.pop(agent_id, None) is not None:
+            self.agent_capabilities.pop(agent_id, None)
             self.logger.info(f"Removed stale agent {agent_id}")
     
     async def _create_response_task(self, alert_data: Dict[str, Any], actions: List[str]):
@@ -0,0 +1,136 @@
+"""
+Priority Message Queue for pfSense Multi-Agent System
+
+This module provides the bounded, multi-level dispatch queue that sits between
+message reception and message handling in every agent. Higher-priority
+messages are dispatched first, waiting messages age into higher levels so low
+priorities are never starved, and when the queue is full the oldest
+lowest-priority messages are shed first.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+
+PRIORITY_LEVELS = {1: 'low', 2: 'medium', 3: 'high', 4: 'critical'}
+
+
+class PriorityMessageQueue:
+    """
+    Bounded multi-level priority queue for AgentMessage objects.
+
+    Each priority level is a FIFO. On get(), only the head of each level is
+    considered: its effective priority is its level plus one for every
+    aging_interval seconds it has waited, and the highest effective priority
+    wins (ties go to the higher base level).
+    """
+
+    def __init__(self, maxsize: int = 10000, aging_interval: float = 5.0):
+        self.maxsize = maxsize
+        self.aging_interval = aging_interval
+
+        self._levels: Dict[int, Deque[Tuple[float, Any]]] = {
+            level: deque() for level in PRIORITY_LEVELS
+        }
+        self._size = 0
+        self._not_empty = asyncio.Event()
+
+        self.stats = {
+            'enqueued': 0,
+            'dequeued': 0,
+            'aged_promotions': 0,
+            'shed': {name: 0 for name in PRIORITY_LEVELS.values()}
+        }
+
+    def qsize(self) -> int:
+        """Number of queued messages across all levels."""
+        return self._size
+
+    def empty(self) -> bool:
+        return self._size == 0
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= self._size
+
+    async def put(self, message: Any):
+        """Queue a message, shedding the oldest lowest-priority one when full."""
+        self.put_nowait(message)
+
+    def put_nowait(self, message: Any):
+        """Queue a message without waiting; never blocks the receive path."""
+        level = self._level_for(message)
+
+        if self.full():
+            lowest = min(lvl for lvl, items in self._levels.items() if items)
+            if lowest > level:
+                # Everything queued is more important than the new message
+                self.stats['shed'][PRIORITY_LEVELS[level]] += 1
+                return
+
+            self._levels[lowest].popleft()
+            self._size -= 1
+            self.stats['shed'][PRIORITY_LEVELS[lowest]] += 1
+
+        self._levels[level].append((time.monotonic(), message))
+        self._size += 1
+        self.stats['enqueued'] += 1
+        self._not_empty.set()
+
+    async def get(self) -> Any:
+        """Wait for and return the next message to dispatch."""
+        while self._size == 0:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+
+        return self.get_nowait()
+
+    def get_nowait(self) -> Any:
+        """Return the next message to dispatch; raises asyncio.QueueEmpty if empty."""
+        if self._size == 0:
+            raise asyncio.QueueEmpty()
+
+        now = time.monotonic()
+        best_level = None
+        best_priority = None
+
+        for level in sorted(self._levels, reverse=True):
+            items = self._levels[level]
+            if not items:
+                continue
+
+            enqueued_at = items[0][0]
+            effective = level + int((now - enqueued_at) / self.aging_interval) if self.aging_interval else level
+            if best_priority is None or effective > best_priority:
+                best_level, best_priority = level, effective
+
+        if best_level != max(lvl for lvl, items in self._levels.items() if items):
+            self.stats['aged_promotions'] += 1
+
+        _, message = self._levels[best_level].popleft()
+        self._size -= 1
+        self.stats['dequeued'] += 1
+        return message
+
+    def depths(self) -> Dict[str, int]:
+        """Current number of queued messages per priority level."""
+        return {name: len(self._levels[level]) for level, name in PRIORITY_LEVELS.items()}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue statistics for heartbeats and status reports."""
+        return {
+            'depths': self.depths(),
+            'size': self._size,
+            'maxsize': self.maxsize,
+            'enqueued': self.stats['enqueued'],
+            'dequeued': self.stats['dequeued'],
+            'aged_promotions': self.stats['aged_promotions'],
+            'shed': self.stats['shed'].copy()
+        }
+
+    @staticmethod
+    def _level_for(message: Any) -> int:
+        """Clamp a message priority to a known level."""
+        priority = getattr(message, 'priority', 1) or 1
+        return min(max(int(priority), 1), 4)
@@ -0,0 +1,239 @@
+"""
+LLM Request Batching for pfSense Multi-Agent System
+
+This module packs independent analysis requests that arrive together into a
+single LLM request. Each item is sent with an ID, the model is asked for a
+JSON array of results keyed by those IDs, and each result is handed back to
+the request that asked for it. The system prompt is sent once per batch
+instead of once per item, and periodic analyses of several log types or
+interfaces cost one provider call instead of one each. Items missing from
+or malformed in the batch response, including those lost when a response is
+cut off, are retried as individual requests.
+"""
+
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .request_scheduler import PRIORITY_CLASSES
+from .stream_parser import complete_array_elements
+
+
+# send(system_prompt, prompt, analysis_type, max_tokens, priority) -> completion text
+SendFunction = Callable[[str, str, str, int, str], Awaitable[str]]
+
+
+@dataclass
+class _BatchItem:
+    prompt: str
+    max_tokens: int
+    priority: str
+    future: asyncio.Future
+
+
+@dataclass
+class _PendingBatch:
+    analysis_type: str
+    system_prompt: str
+    items: List[_BatchItem] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def max_tokens(self) -> int:
+        return sum(item.max_tokens for item in self.items)
+
+
+def build_batch_prompt(prompts: List[str]) -> str:
+    """Combine item prompts into one prompt asking for a JSON array of results."""
+    parts = [
+        f"The following {len(prompts)} items are independent requests. "
+        f"Handle each one separately, exactly as if it had been sent on its own.",
+        ""
+    ]
+    for item_id, prompt in enumerate(prompts, 1):
+        parts.append(f'<item id="{item_id}">')
+        parts.append(prompt.strip())
+        parts.append('</item>')
+        parts.append("")
+    parts.append(
+        'Respond with only a JSON array containing one object per item. Each object must '
+        'have an "id" field with the item id as an integer and a "result" field holding '
+        'the JSON object that item asks for.'
+    )
+    return "\n".join(parts)
+
+
+def parse_batch_response(response_text: str) -> Dict[int, Dict[str, Any]]:
+    """
+    Results by item id; items that are missing or malformed are left out.
+
+    The complete results of a truncated array are kept, so only the items
+    after the cut have to be retried.
+    """
+    results = {}
+    for entry in complete_array_elements(response_text):
+        if not isinstance(entry, dict) or not isinstance(entry.get('result'), dict):
+            continue
+        try:
+            results[int(entry.get('id'))] = entry['result']
+        except (TypeError, ValueError):
+            continue
+    return results
+
+
+class LLMRequestBatcher:
+    """
+    Collects concurrent requests per analysis type and sends them together.
+
+    Requests with the same analysis type and system prompt are collected for
+    up to max_delay seconds, then sent as one request through send. A batch
+    is sent early once max_items are waiting, or when the next item's
+    completion allowance would take the batch's total past max_batch_tokens,
+    so every item gets the allowance it would have had on its own. A batch
+    is scheduled at the priority of its most urgent item. If the batch
+    request fails with one of fallback_errors (such as the provider
+    rejecting an oversized prompt), every item is retried individually;
+    other errors are raised in every item's caller.
+    """
+
+    def __init__(self,
+                 send: SendFunction,
+                 analysis_types: Optional[List[str]] = None,
+                 max_items: int = 8,
+                 max_delay: float = 0.05,
+                 max_batch_tokens: int = 12000,
+                 fallback_errors: Tuple[type, ...] = (),
+                 observer: Optional[Callable[[str, int], None]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.send = send
+        self.analysis_types = set(analysis_types or [])
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self.max_batch_tokens = max_batch_tokens
+        self.fallback_errors = fallback_errors
+        self.observer = observer
+
+        self._pending: Dict[Tuple[str, str], _PendingBatch] = {}
+        self._tasks = set()
+
+        self.stats = {
+            'items': 0,
+            'batches': 0,
+            'batched_items': 0,
+            'fallbacks': 0
+        }
+
+    def batches(self, analysis_type: str) -> bool:
+        return analysis_type in self.analysis_types
+
+    async def submit(self,
+                     system_prompt: str,
+                     prompt: str,
+                     analysis_type: str,
+                     max_tokens: int,
+                     priority: str) -> str:
+        """Queue a request for the next batch and wait for its own result."""
+        self.stats['items'] += 1
+        loop = asyncio.get_running_loop()
+        group = (analysis_type, system_prompt)
+
+        batch = self._pending.get(group)
+        if batch is not None and batch.max_tokens + max_tokens > self.max_batch_tokens:
+            self._flush(group)
+            batch = None
+        if batch is None:
+            batch = self._pending[group] = _PendingBatch(analysis_type, system_prompt)
+            batch.timer = loop.call_later(self.max_delay, self._flush, group)
+
+        item = _BatchItem(prompt, max_tokens, priority, loop.create_future())
+        batch.items.append(item)
+        if len(batch.items) >= self.max_items:
+            self._flush(group)
+
+        return await item.future
+
+    def _flush(self, group: Tuple[str, str]):
+        batch = self._pending.pop(group, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+
+        task = asyncio.ensure_future(self._send_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_batch(self, batch: _PendingBatch):
+        items = [item for item in batch.items if not item.future.done()]
+        if not items:
+            return
+
+        if self.observer:
+            self.observer(batch.analysis_type, len(items))
+
+        if len(items) == 1:
+            await self._send_individually(batch, items)
+            return
+
+        self.stats['batches'] += 1
+        self.stats['batched_items'] += len(items)
+        priority = min((item.priority for item in items), key=PRIORITY_CLASSES.index)
+        max_tokens = sum(item.max_tokens for item in items)
+
+        try:
+            response_text = await self.send(
+                batch.system_prompt,
+                build_batch_prompt([item.prompt for item in items]),
+                batch.analysis_type,
+                max_tokens,
+                priority
+            )
+        except self.fallback_errors as e:
+            self.logger.warning(f"Batched {batch.analysis_type} request failed, retrying items individually: {e}")
+            self.stats['fallbacks'] += len(items)
+            await self._send_individually(batch, items)
+            return
+        except Exception as e:
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+
+        results = parse_batch_response(response_text)
+        unanswered = []
+        for item_id, item in enumerate(items, 1):
+            result = results.get(item_id)
+            if result is None:
+                unanswered.append(item)
+            elif not item.future.done():
+                item.future.set_result(json.dumps(result))
+
+        if unanswered:
+            self.logger.warning(
+                f"{len(unanswered)} of {len(items)} batched {batch.analysis_type} results "
+                f"missing or malformed, retrying individually"
+            )
+            self.stats['fallbacks'] += len(unanswered)
+            await self._send_individually(batch, unanswered)
+
+    async def _send_individually(self, batch: _PendingBatch, items: List[_BatchItem]):
+        async def send_one(item: _BatchItem):
+            try:
+                result = await self.send(
+                    batch.system_prompt, item.prompt, batch.analysis_type, item.max_tokens, item.priority
+                )
+            except Exception as e:
+                if not item.future.done():
+                    item.future.set_exception(e)
+                return
+            if not item.future.done():
+                item.future.set_result(result)
+
+        await asyncio.gather(*(send_one(item) for item in items))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters and the average number of items per batched request."""
+        stats = self.stats.copy()
+        stats['items_per_batch'] = stats['batched_items'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
@@ -0,0 +1,239 @@
+"""
+LLM Request Scheduler for pfSense Multi-Agent System
+
+This module keeps LLM calls within the provider's rate limits. Requests are
+admitted against token buckets for requests and tokens per minute and a cap
+on concurrent calls. Requests that have to wait are queued by priority
+class, so incident response for a critical alert goes ahead of routine log
+and traffic analysis. A request that waits longer than its class allows is
+shed instead of being sent late.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+
+# Priority classes, most urgent first
+PRIORITY_CLASSES = ('critical', 'high', 'normal', 'routine')
+
+# Longest a request may wait for budget before it is shed; None waits forever
+DEFAULT_MAX_WAIT: Dict[str, Optional[float]] = {
+    'critical': None,
+    'high': 60.0,
+    'normal': 30.0,
+    'routine': 10.0
+}
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request is shed because no budget freed up in time."""
+
+
+class TokenBucket:
+    """
+    Continuously refilling budget of rate_per_minute units.
+
+    The bucket holds at most one minute of budget, so an idle period allows
+    a burst of up to rate_per_minute. The level can go negative when actual
+    usage exceeds what was reserved; later requests then wait for it to
+    recover. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate_per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.clock = clock
+        self.level = self.capacity
+        self._updated_at = clock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until amount is available; 0 if it is now."""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        # A request larger than the bucket waits for a full bucket instead of forever
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed / self.rate)
+
+    def take(self, amount: float):
+        if not self.unlimited:
+            self._refill()
+            self.level -= amount
+
+    def give_back(self, amount: float):
+        """Return unused budget, or charge more with a negative amount."""
+        if not self.unlimited:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    sequence: int
+    tokens: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+@dataclass
+class Reservation:
+    """An admitted request; set used_tokens to settle its token budget."""
+    estimated_tokens: int
+    used_tokens: Optional[int] = None
+
+
+class LLMRequestScheduler:
+    """
+    Priority admission of LLM requests under rate and concurrency limits.
+
+    Use reserve() around each provider call. Requests are admitted strictly
+    by priority class, then in arrival order; a request waiting for budget
+    holds back lower classes rather than letting them use up the budget it
+    is waiting for.
+    """
+
+    def __init__(self,
+                 requests_per_minute: float = 100,
+                 tokens_per_minute: float = 0,
+                 max_concurrency: int = 8,
+                 max_wait: Optional[Dict[str, Optional[float]]] = None,
+                 wait_observer: Optional[Callable[[str, float], None]] = None,
+                 shed_observer: Optional[Callable[[str], None]] = None):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_wait = {**DEFAULT_MAX_WAIT, **(max_wait or {})}
+        self.wait_observer = wait_observer
+        self.shed_observer = shed_observer
+
+        self._waiters: List[_Waiter] = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+        self.stats = {
+            'admitted': 0,
+            'queued': 0,
+            'shed': 0,
+            'wait_seconds': {name: 0.0 for name in PRIORITY_CLASSES}
+        }
+
+    @asynccontextmanager
+    async def reserve(self, priority: str, estimated_tokens: int = 0) -> AsyncIterator['Reservation']:
+        """
+        Wait for a slot and budget, then hold the slot for the block.
+
+        Raises RateLimitExceeded if the request waited longer than its
+        priority class allows. Set used_tokens on the yielded reservation
+        once actual usage is known to correct the token budget.
+        """
+        await self._admit(priority, estimated_tokens)
+        reservation = Reservation(estimated_tokens)
+        try:
+            yield reservation
+        finally:
+            self._active -= 1
+            if reservation.used_tokens is not None:
+                self.tokens.give_back(estimated_tokens - reservation.used_tokens)
+            self._dispatch()
+
+    async def _admit(self, priority: str, tokens: int):
+        start_time = time.monotonic()
+        rank = PRIORITY_CLASSES.index(priority)
+
+        # Fast path: nothing queued and budget available
+        if not self._waiters and self._can_start(tokens):
+            self._start(tokens)
+            self._observe_wait(priority, 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, _Waiter(rank, next(self._sequence), tokens, future))
+        self.stats['queued'] += 1
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(future, timeout=self.max_wait.get(priority))
+        except asyncio.TimeoutError:
+            # The timed-out future is cancelled, so _dispatch skips it
+            self.stats['shed'] += 1
+            if self.shed_observer:
+                self.shed_observer(priority)
+            raise RateLimitExceeded(f"LLM rate limit: {priority} request shed after waiting "
+                                    f"{time.monotonic() - start_time:.1f}s")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just as the caller was cancelled; free the slot
+                self._active -= 1
+                self._dispatch()
+            raise
+        finally:
+            self._dispatch()
+
+        self._observe_wait(priority, time.monotonic() - start_time)
+
+    def _can_start(self, tokens: int) -> bool:
+        return (self._active < self.max_concurrency
+                and self.requests.time_until(1) == 0
+                and self.tokens.time_until(tokens) == 0)
+
+    def _start(self, tokens: int):
+        self._active += 1
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.stats['admitted'] += 1
+
+    def _dispatch(self):
+        """Admit queued requests in priority order while budget and slots allow."""
+        while self._waiters and self._active < self.max_concurrency:
+            waiter = self._waiters[0]
+            if waiter.future.done():
+                heapq.heappop(self._waiters)
+                continue
+
+            delay = max(self.requests.time_until(1), self.tokens.time_until(waiter.tokens))
+            if delay > 0:
+                self._schedule_wakeup(delay)
+                return
+
+            heapq.heappop(self._waiters)
+            self._start(waiter.tokens)
+            waiter.future.set_result(None)
+
+    def _schedule_wakeup(self, delay: float):
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    def _observe_wait(self, priority: str, seconds: float):
+        self.stats['wait_seconds'][priority] += seconds
+        if self.wait_observer:
+            self.wait_observer(priority, seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Admission counters, queue length and remaining budget."""
+        stats = self.stats.copy()
+        stats['wait_seconds'] = dict(self.stats['wait_seconds'])
+        stats['active'] = self._active
+        stats['waiting'] = sum(1 for waiter in self._waiters if not waiter.future.done())
+        stats['requests_available'] = None if self.requests.unlimited else round(self.requests.level, 1)
+        stats['tokens_available'] = None if self.tokens.unlimited else round(self.tokens.level)
+        return stats
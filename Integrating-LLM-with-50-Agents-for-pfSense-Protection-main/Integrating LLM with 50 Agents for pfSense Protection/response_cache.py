@@ -0,0 +1,214 @@
+"""
+LLM Response Cache for pfSense Multi-Agent System
+
+This module provides an exact-match cache of LLM completions. Requests are
+keyed on a hash of the model, system prompt, whitespace-normalized user
+prompt and sampling parameters, so agents submitting the same analysis, or
+the orchestrator resending unchanged metrics, are answered without calling
+the provider. Entries expire per analysis type and are evicted least
+recently used by entry count and total size. An optional SQLite file keeps
+entries across restarts.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace, so prompts differing only in indentation share a key."""
+    return ' '.join(prompt.split())
+
+
+def request_key(model: str, system_prompt: str, prompt: str, temperature: float, max_tokens: int) -> str:
+    """Canonical hash of everything that determines a completion."""
+    canonical = json.dumps(
+        [model, normalize_prompt(system_prompt), normalize_prompt(prompt), temperature, max_tokens],
+        separators=(',', ':')
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+@dataclass
+class CachedResponse:
+    """A cached completion and what it cost to produce."""
+    response: str
+    analysis_type: str
+    expires_at: float  # time.time()
+    latency: float  # seconds the original request took
+
+    @property
+    def size(self) -> int:
+        return len(self.response)
+
+
+class ResponseCache:
+    """
+    LRU cache of LLM completions with per-analysis-type TTLs.
+
+    ttls maps analysis types to seconds; types without an entry use
+    default_ttl, and a TTL of 0 disables caching for a type. The in-memory
+    tier is bounded by max_entries and max_bytes of response text. With
+    sqlite_path set, every entry is also written to SQLite and memory misses
+    are looked up there, so a restarted process starts warm.
+    """
+
+    PRUNE_INTERVAL = 1000  # puts between removals of expired SQLite rows
+
+    def __init__(self,
+                 max_entries: int = 1000,
+                 max_bytes: int = 16 * 1024 * 1024,
+                 default_ttl: float = 300.0,
+                 ttls: Optional[Dict[str, float]] = None,
+                 sqlite_path: Optional[str] = None):
+        self.logger = logging.getLogger(__name__)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+
+        self._entries: 'OrderedDict[str, CachedResponse]' = OrderedDict()
+        self._bytes = 0
+        self._puts = 0
+
+        self.db: Optional[sqlite3.Connection] = None
+        if sqlite_path:
+            self.db = self._open_db(sqlite_path)
+
+        self.stats = {
+            'hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'latency_saved_seconds': 0.0
+        }
+
+    def _open_db(self, path: str) -> sqlite3.Connection:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        db = sqlite3.connect(path)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                key TEXT PRIMARY KEY,
+                analysis_type TEXT NOT NULL,
+                response TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                latency REAL NOT NULL
+            )
+        """)
+        db.execute('DELETE FROM llm_responses WHERE expires_at <= ?', (time.time(),))
+        db.commit()
+        return db
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def ttl_for(self, analysis_type: str) -> float:
+        return self.ttls.get(analysis_type, self.default_ttl)
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Look up a completion; counts a hit or a miss."""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self._record_hit(entry)
+                return entry
+            self._remove(key)
+            self.stats['expirations'] += 1
+
+        if self.db is not None:
+            entry = self._load(key, now)
+            if entry is not None:
+                # Promote to memory; later hits skip SQLite
+                self._insert(key, entry)
+                self.stats['disk_hits'] += 1
+                self._record_hit(entry)
+                return entry
+
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key: str, analysis_type: str, response: str, latency: float):
+        """Cache a completion for its analysis type's TTL."""
+        ttl = self.ttl_for(analysis_type)
+        if ttl <= 0 or len(response) > self.max_bytes:
+            return
+
+        entry = CachedResponse(response, analysis_type, time.time() + ttl, latency)
+        self._insert(key, entry)
+
+        if self.db is not None:
+            self._store(key, entry)
+
+    def _record_hit(self, entry: CachedResponse):
+        self.stats['hits'] += 1
+        self.stats['latency_saved_seconds'] += entry.latency
+
+    def _insert(self, key: str, entry: CachedResponse):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats['evictions'] += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _load(self, key: str, now: float) -> Optional[CachedResponse]:
+        try:
+            row = self.db.execute(
+                'SELECT response, analysis_type, expires_at, latency FROM llm_responses '
+                'WHERE key = ? AND expires_at > ?',
+                (key, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error reading LLM response cache: {e}")
+            return None
+        return CachedResponse(*row) if row else None
+
+    def _store(self, key: str, entry: CachedResponse):
+        try:
+            self.db.execute(
+                'INSERT OR REPLACE INTO llm_responses (key, analysis_type, response, expires_at, latency) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, entry.analysis_type, entry.response, entry.expires_at, entry.latency)
+            )
+            self._puts += 1
+            if self._puts % self.PRUNE_INTERVAL == 0:
+                self.db.execute('DELETE FROM llm_responses WHERE expires_at <= ?', (time.time(),))
+            self.db.commit()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error writing LLM response cache: {e}")
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters, current size and hit rate."""
+        stats = self.stats.copy()
+        lookups = stats['hits'] + stats['misses']
+        stats['entries'] = len(self._entries)
+        stats['bytes'] = self._bytes
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['persistent'] = self.db is not None
+        return stats
@@ -0,0 +1,470 @@
+"""
+Segmented Message Log for pfSense Multi-Agent System
+
+This module provides an embedded, append-only message history for the message
+broker. Each agent gets its own directory of segment files; records carry a
+per-agent offset and an append timestamp, a sparse index maps offsets and
+times to file positions, and reads go through memory-mapped segments. Old
+segments are removed by size and age retention.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+
+RECORD_HEADER = struct.Struct('!QqI')  # offset, timestamp_ms, body length
+INDEX_ENTRY = struct.Struct('!QqQ')    # offset, timestamp_ms, file position
+
+LOG_SUFFIX = '.log'
+INDEX_SUFFIX = '.index'
+
+
+@dataclass
+class LogRecord:
+    """A stored message body with its position in the agent's log."""
+    offset: int
+    timestamp_ms: int
+    body: bytes
+
+    @property
+    def timestamp(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp_ms / 1000)
+
+
+def _to_ms(value: Optional[datetime]) -> Optional[int]:
+    return int(value.timestamp() * 1000) if value is not None else None
+
+
+class _Segment:
+    """One log file and its sparse index, starting at base_offset."""
+
+    def __init__(self, directory: str, base_offset: int):
+        self.base_offset = base_offset
+        self.log_path = os.path.join(directory, f'{base_offset:020d}{LOG_SUFFIX}')
+        self.index_path = os.path.join(directory, f'{base_offset:020d}{INDEX_SUFFIX}')
+
+        # Sparse index as parallel lists so they can be bisected
+        self.index_offsets: List[int] = []
+        self.index_times: List[int] = []
+        self.index_positions: List[int] = []
+
+        self.size = 0
+        self.next_offset = base_offset
+        self.first_timestamp_ms: Optional[int] = None
+        self.last_timestamp_ms: Optional[int] = None
+        self.bytes_since_index = 0
+
+        self._log_file = None
+        self._index_file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._mapped_size = 0
+
+    def open(self):
+        """Load the index and recover the tail of an existing segment."""
+        if os.path.exists(self.log_path):
+            self.size = os.path.getsize(self.log_path)
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as index_file:
+                data = index_file.read()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            for offset, timestamp_ms, position in INDEX_ENTRY.iter_unpack(data[:usable]):
+                if position >= self.size:
+                    break
+                self._add_index_entry(offset, timestamp_ms, position)
+
+        if self.index_times:
+            self.first_timestamp_ms = self.index_times[0]
+
+        # Scan forward from the last indexed record to find the end of the log
+        position = self.index_positions[-1] if self.index_positions else 0
+        with open(self.log_path, 'a+b') as log_file:
+            log_file.seek(position)
+            while True:
+                header = log_file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                offset, timestamp_ms, length = RECORD_HEADER.unpack(header)
+                if len(log_file.read(length)) < length:
+                    break
+
+                if self.first_timestamp_ms is None:
+                    self.first_timestamp_ms = timestamp_ms
+                self.next_offset = offset + 1
+                self.last_timestamp_ms = timestamp_ms
+                position += RECORD_HEADER.size + length
+
+            # Drop a partially written trailing record
+            if position < self.size:
+                log_file.truncate(position)
+
+        self.size = position
+        self.bytes_since_index = position - (self.index_positions[-1] if self.index_positions else 0)
+        self._rewrite_index()
+
+    def append(self, offset: int, timestamp_ms: int, body: bytes, index_interval: int):
+        """Append one record, adding an index entry every index_interval bytes."""
+        if self._log_file is None:
+            self._log_file = open(self.log_path, 'ab')
+            self._index_file = open(self.index_path, 'ab')
+
+        if not self.index_positions or self.bytes_since_index >= index_interval:
+            self._index_file.write(INDEX_ENTRY.pack(offset, timestamp_ms, self.size))
+            self._add_index_entry(offset, timestamp_ms, self.size)
+            self.bytes_since_index = 0
+
+        record_size = RECORD_HEADER.size + len(body)
+        self._log_file.write(RECORD_HEADER.pack(offset, timestamp_ms, len(body)))
+        self._log_file.write(body)
+
+        if self.first_timestamp_ms is None:
+            self.first_timestamp_ms = timestamp_ms
+        self.last_timestamp_ms = timestamp_ms
+        self.next_offset = offset + 1
+        self.size += record_size
+        self.bytes_since_index += record_size
+
+    def flush(self):
+        if self._log_file is not None:
+            self._log_file.flush()
+            self._index_file.flush()
+
+    def seal(self):
+        """Stop writing to this segment."""
+        self.flush()
+        if self._log_file is not None:
+            self._log_file.close()
+            self._index_file.close()
+            self._log_file = self._index_file = None
+
+    def close(self):
+        # Maps are released by reference counting so that readers still
+        # iterating over an old view are not cut off
+        self.seal()
+        self._mmap = None
+        self._mapped_size = 0
+
+    def delete(self):
+        self.close()
+        for path in (self.log_path, self.index_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def position_for_offset(self, offset: int) -> int:
+        """File position of the last indexed record at or before offset."""
+        slot = bisect_right(self.index_offsets, offset) - 1
+        return self.index_positions[slot] if slot >= 0 else 0
+
+    def position_for_time(self, timestamp_ms: int) -> int:
+        """File position of the last indexed record before timestamp_ms."""
+        slot = bisect_left(self.index_times, timestamp_ms) - 1
+        return self.index_positions[slot] if slot >= 0 else 0
+
+    def scan(self, position: int) -> Iterator[LogRecord]:
+        """Yield records from a file position to the end of the segment."""
+        view = self._view()
+        end = self._mapped_size
+
+        while position + RECORD_HEADER.size <= end:
+            offset, timestamp_ms, length = RECORD_HEADER.unpack_from(view, position)
+            start = position + RECORD_HEADER.size
+            yield LogRecord(offset, timestamp_ms, view[start:start + length])
+            position = start + length
+
+    def _view(self) -> Any:
+        """Memory-map the segment, remapping when it has grown."""
+        if self._mapped_size != self.size:
+            self.flush()
+            self._mmap = None
+            if self.size:
+                with open(self.log_path, 'rb') as log_file:
+                    self._mmap = mmap.mmap(log_file.fileno(), self.size, access=mmap.ACCESS_READ)
+            self._mapped_size = self.size
+
+        return self._mmap if self._mmap is not None else b''
+
+    def _add_index_entry(self, offset: int, timestamp_ms: int, position: int):
+        self.index_offsets.append(offset)
+        self.index_times.append(timestamp_ms)
+        self.index_positions.append(position)
+
+    def _rewrite_index(self):
+        """Persist the index entries that survived recovery."""
+        with open(self.index_path, 'wb') as index_file:
+            for entry in zip(self.index_offsets, self.index_times, self.index_positions):
+                index_file.write(INDEX_ENTRY.pack(*entry))
+
+
+class _AgentLog:
+    """The ordered segments of one agent's history."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        base_offsets = sorted(
+            int(name[:-len(LOG_SUFFIX)]) for name in os.listdir(directory)
+            if name.endswith(LOG_SUFFIX) and name[:-len(LOG_SUFFIX)].isdigit()
+        )
+        self.segments: List[_Segment] = []
+        for base_offset in base_offsets:
+            segment = _Segment(directory, base_offset)
+            segment.open()
+            self.segments.append(segment)
+
+        if not self.segments:
+            self.segments.append(_Segment(directory, 0))
+
+    @property
+    def active(self) -> _Segment:
+        return self.segments[-1]
+
+    @property
+    def first_offset(self) -> int:
+        return self.segments[0].base_offset
+
+    @property
+    def next_offset(self) -> int:
+        return self.active.next_offset
+
+    @property
+    def size(self) -> int:
+        return sum(segment.size for segment in self.segments)
+
+    def roll(self):
+        """Seal the active segment and start a new one."""
+        self.active.seal()
+        self.segments.append(_Segment(self.directory, self.active.next_offset))
+
+    def segment_index_for_offset(self, offset: int) -> int:
+        bases = [segment.base_offset for segment in self.segments]
+        return max(bisect_right(bases, offset) - 1, 0)
+
+    def segment_index_for_time(self, timestamp_ms: int) -> int:
+        for index, segment in enumerate(self.segments):
+            if segment.last_timestamp_ms is not None and segment.last_timestamp_ms >= timestamp_ms:
+                return index
+        return len(self.segments) - 1
+
+
+class SegmentedMessageLog:
+    """
+    Append-only per-agent message history on local disk.
+
+    Records are appended to the active segment of the agent's directory and a
+    new segment is started once segment_bytes is reached. Every
+    index_interval_bytes an (offset, timestamp, position) entry is added to
+    the segment's sparse index, so a read bisects the index and scans at most
+    index_interval_bytes before reaching its first record. Append timestamps
+    never go backwards, which keeps the time index sorted.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 segment_bytes: int = 16 * 1024 * 1024,
+                 index_interval_bytes: int = 4096,
+                 retention_bytes: int = 256 * 1024 * 1024,
+                 retention_seconds: float = 7 * 24 * 3600,
+                 logger: Optional[logging.Logger] = None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval_bytes = index_interval_bytes
+        self.retention_bytes = retention_bytes
+        self.retention_seconds = retention_seconds
+        self.logger = logger or logging.getLogger(__name__)
+
+        os.makedirs(directory, exist_ok=True)
+        self._logs: Dict[str, _AgentLog] = {}
+
+        self.stats = {
+            'records_appended': 0,
+            'bytes_appended': 0,
+            'records_read': 0,
+            'segments_rolled': 0,
+            'segments_deleted': 0
+        }
+
+    def append(self, agent_id: str, body: bytes, timestamp: Optional[datetime] = None) -> int:
+        """Append a message body to an agent's log and return its offset."""
+        log = self._log_for(agent_id)
+        if log.active.size >= self.segment_bytes:
+            log.roll()
+            self.stats['segments_rolled'] += 1
+
+        timestamp_ms = _to_ms(timestamp) if timestamp is not None else int(time.time() * 1000)
+        last_timestamp_ms = log.active.last_timestamp_ms
+        if last_timestamp_ms is None and len(log.segments) > 1:
+            last_timestamp_ms = log.segments[-2].last_timestamp_ms
+        if last_timestamp_ms is not None:
+            timestamp_ms = max(timestamp_ms, last_timestamp_ms)
+
+        offset = log.next_offset
+        log.active.append(offset, timestamp_ms, body, self.index_interval_bytes)
+
+        self.stats['records_appended'] += 1
+        self.stats['bytes_appended'] += len(body)
+        return offset
+
+    def iter_records(self,
+                     agent_id: str,
+                     offset: Optional[int] = None,
+                     since: Optional[datetime] = None,
+                     until: Optional[datetime] = None) -> Iterator[LogRecord]:
+        """
+        Iterate an agent's records in offset order.
+
+        Args:
+            agent_id: Agent whose history to read
+            offset: First offset to return
+            since: Skip records appended before this time
+            until: Stop at records appended after this time
+        """
+        log = self._log_for(agent_id, create=False)
+        if log is None:
+            return
+
+        since_ms, until_ms = _to_ms(since), _to_ms(until)
+        start_offset = max(offset or 0, log.first_offset)
+
+        if since_ms is not None and offset is None:
+            segment_index = log.segment_index_for_time(since_ms)
+            position = log.segments[segment_index].position_for_time(since_ms)
+        else:
+            segment_index = log.segment_index_for_offset(start_offset)
+            position = log.segments[segment_index].position_for_offset(start_offset)
+
+        for segment in log.segments[segment_index:]:
+            for record in segment.scan(position):
+                if record.offset < start_offset:
+                    continue
+                if since_ms is not None and record.timestamp_ms < since_ms:
+                    continue
+                if until_ms is not None and record.timestamp_ms > until_ms:
+                    return
+                self.stats['records_read'] += 1
+                yield record
+            position = 0
+
+    def read(self,
+             agent_id: str,
+             offset: Optional[int] = None,
+             since: Optional[datetime] = None,
+             until: Optional[datetime] = None,
+             limit: int = 100) -> List[LogRecord]:
+        """Read up to limit records in offset order."""
+        records = []
+        for record in self.iter_records(agent_id, offset=offset, since=since, until=until):
+            if len(records) >= limit:
+                break
+            records.append(record)
+        return records
+
+    def iter_records_reverse(self,
+                             agent_id: str,
+                             before: Optional[int] = None,
+                             page_size: int = 256) -> Iterator[LogRecord]:
+        """Iterate an agent's records newest first, reading page_size at a time."""
+        first_offset, next_offset = self.offsets(agent_id)
+        end = next_offset if before is None else min(before, next_offset)
+
+        while end > first_offset:
+            start = max(end - page_size, first_offset)
+            # Retention may have moved the first offset past start meanwhile
+            page = [record for record in self.read(agent_id, offset=start, limit=end - start)
+                    if record.offset < end]
+            if not page:
+                return
+
+            yield from reversed(page)
+            end = page[0].offset
+
+    def tail(self, agent_id: str, limit: int = 100) -> List[LogRecord]:
+        """Read the newest limit records, newest first."""
+        return list(islice(self.iter_records_reverse(agent_id, page_size=min(limit, 256)), limit))
+
+    def offsets(self, agent_id: str) -> Tuple[int, int]:
+        """First retained offset and next offset to be written for an agent."""
+        log = self._log_for(agent_id, create=False)
+        if log is None:
+            return 0, 0
+        return log.first_offset, log.next_offset
+
+    def flush(self):
+        """Flush buffered appends of every agent log to the OS."""
+        for log in self._logs.values():
+            log.active.flush()
+
+    def enforce_retention(self) -> int:
+        """Delete sealed segments beyond the size or age limits; returns the count."""
+        cutoff_ms = int((time.time() - self.retention_seconds) * 1000)
+        deleted = 0
+
+        for log in self._logs.values():
+            size = log.size
+            while len(log.segments) > 1:
+                oldest = log.segments[0]
+                too_old = oldest.last_timestamp_ms is not None and oldest.last_timestamp_ms < cutoff_ms
+                if size <= self.retention_bytes and not too_old:
+                    break
+
+                size -= oldest.size
+                oldest.delete()
+                log.segments.pop(0)
+                deleted += 1
+
+        self.stats['segments_deleted'] += deleted
+        return deleted
+
+    def delete(self, agent_id: str):
+        """Remove an agent's history entirely."""
+        log = self._log_for(agent_id, create=False)
+        if log is None:
+            return
+
+        for segment in log.segments:
+            segment.delete()
+        del self._logs[agent_id]
+
+        try:
+            os.rmdir(log.directory)
+        except OSError as e:
+            self.logger.debug(f"Could not remove log directory {log.directory}: {e}")
+
+    def close(self):
+        """Flush and close all segment files."""
+        for log in self._logs.values():
+            for segment in log.segments:
+                segment.close()
+        self._logs.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get log counters and the on-disk size of loaded agent logs."""
+        stats = self.stats.copy()
+        stats['agents'] = len(self._logs)
+        stats['segments'] = sum(len(log.segments) for log in self._logs.values())
+        stats['bytes_on_disk'] = sum(log.size for log in self._logs.values())
+        return stats
+
+    def _log_for(self, agent_id: str, create: bool = True) -> Optional[_AgentLog]:
+        """Get an agent's log, loading it from disk on first use."""
+        log = self._logs.get(agent_id)
+        if log is None:
+            directory = os.path.join(self.directory, self._directory_name(agent_id))
+            if not create and not os.path.isdir(directory):
+                return None
+            log = self._logs[agent_id] = _AgentLog(directory)
+        return log
+
+    @staticmethod
+    def _directory_name(agent_id: str) -> str:
+        """Filesystem-safe directory name for an agent id."""
+        return quote(agent_id, safe='').replace('.', '%2E') or '%00'
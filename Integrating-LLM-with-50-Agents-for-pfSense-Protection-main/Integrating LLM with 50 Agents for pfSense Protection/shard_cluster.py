@@ -0,0 +1,100 @@
+"""
+Local Shard Cluster for pfSense Multi-Agent System
+
+Starts several sharded message broker processes on one host, sharing a
+RabbitMQ server, so consistent-hash ownership, cross-shard forwarding and
+rebalancing can be exercised without a multi-host deployment. Shard i
+serves its HTTP API on base_port + i; /api/shards on any shard shows the
+membership and how many agents each shard owns. Stopping a shard process
+(SIGTERM) makes the remaining shards take over its agents.
+
+Usage:
+    python -m communication.shard_cluster [--shards 3] [--base-port 8080]
+        [--rabbitmq-url URL] [--redis-url URL] [--history-dir DIR]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+from typing import Any, Dict, List
+
+from .message_broker import create_message_broker
+
+
+def shard_config(index: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """Broker configuration for the shard with the given index."""
+    shard_id = f'shard-{index}'
+    config = {
+        'shard_id': shard_id,
+        'http_port': args.base_port + index,
+        'rabbitmq_url': args.rabbitmq_url,
+        'redis_url': args.redis_url,
+        'shard_announce_interval': args.announce_interval,
+        'shard_timeout': args.announce_interval * 3
+    }
+
+    # Each shard keeps the history of the agents it owns in its own directory
+    if args.history_dir:
+        config['history_backend'] = 'segment_log'
+        config['message_log_dir'] = os.path.join(args.history_dir, shard_id)
+
+    return config
+
+
+async def _run_shard(config: Dict[str, Any]):
+    """Run one broker shard until SIGINT or SIGTERM."""
+    broker = create_message_broker(config)
+    stop_event = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await broker.start()
+    await stop_event.wait()
+    await broker.stop()
+
+
+def _shard_main(config: Dict[str, Any]):
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s - {config['shard_id']} - %(levelname)s - %(message)s"
+    )
+    asyncio.run(_run_shard(config))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run sharded message brokers on this host")
+    parser.add_argument('--shards', type=int, default=3)
+    parser.add_argument('--base-port', type=int, default=8080)
+    parser.add_argument('--rabbitmq-url', default='amqp://localhost:5672')
+    parser.add_argument('--redis-url', default='redis://localhost:6379')
+    parser.add_argument('--history-dir', help="Keep per-shard history in segment logs under this directory")
+    parser.add_argument('--announce-interval', type=float, default=5.0)
+    args = parser.parse_args()
+
+    processes: List[multiprocessing.Process] = []
+    for index in range(args.shards):
+        process = multiprocessing.Process(
+            target=_shard_main,
+            args=(shard_config(index, args),),
+            name=f'shard-{index}'
+        )
+        process.start()
+        processes.append(process)
+        print(f"Started shard-{index} (pid {process.pid}) on port {args.base_port + index}")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Children got the same SIGINT and leave the cluster on their own
+        for process in processes:
+            process.join()
+
+
+if __name__ == '__main__':
+    main()
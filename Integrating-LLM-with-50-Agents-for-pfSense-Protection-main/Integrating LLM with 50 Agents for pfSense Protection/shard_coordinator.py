@@ -0,0 +1,475 @@
+"""
+Shard Coordinator for pfSense Multi-Agent System
+
+This module lets several message broker processes share the agent registry
+and routing work. Agents are assigned to broker shards by consistent hashing
+of their agent_id; the owning shard tracks their heartbeats and keeps their
+message history, while every shard holds a replica of the registry so any
+of them can resolve routes. Messages picked up by a shard that does not own
+the sender or the recipients are forwarded to the owning shards, once per
+shard rather than once per recipient.
+
+Shards find each other through periodic announcements on the agent exchange.
+When a shard joins or leaves, every shard rebuilds its hash ring and adopts
+or releases agents accordingly; because the registry is replicated, no agent
+state has to be handed over.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pika
+
+from ..core.base_agent import AgentMessage
+from ..core.compression import decompress
+from ..core.liveness_tracker import LivenessTracker
+from ..core.message_codec import MessageEnvelope, amqp_expiration, get_codec_by_name, routing_headers
+
+
+ANNOUNCE_TOPIC = 'system.shard.announce'
+SYNC_TOPIC = 'system.shard.sync'
+SHARD_MESSAGE_TYPES = {'shard_announce', 'shard_sync'}
+
+# Header listing the recipients of a message forwarded to their owning shard
+HEADER_SHARD_RECIPIENTS = 'x-shard-recipients'
+
+
+class ConsistentHashRing:
+    """
+    Hash ring mapping keys to nodes through virtual nodes.
+
+    Each node is placed on the ring virtual_nodes times, so keys spread
+    evenly and adding or removing a node only moves about 1/N of the keys.
+    """
+
+    def __init__(self, virtual_nodes: int = 128):
+        self.virtual_nodes = virtual_nodes
+        self.nodes: Set[str] = set()
+        self._points: List[int] = []
+        self._owners: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def add(self, node: str) -> bool:
+        """Add a node; returns False if it was already on the ring."""
+        if node in self.nodes:
+            return False
+        self.nodes.add(node)
+        self._rebuild()
+        return True
+
+    def remove(self, node: str) -> bool:
+        """Remove a node; returns False if it was not on the ring."""
+        if node not in self.nodes:
+            return False
+        self.nodes.discard(node)
+        self._rebuild()
+        return True
+
+    def owner(self, key: str) -> Optional[str]:
+        """Node owning a key: the first virtual node clockwise of its hash."""
+        if not self._points:
+            return None
+        index = bisect.bisect_right(self._points, self._hash(key))
+        return self._owners[index % len(self._owners)]
+
+    def _rebuild(self):
+        points = sorted(
+            (self._hash(f'{node}#{replica}'), node)
+            for node in self.nodes
+            for replica in range(self.virtual_nodes)
+        )
+        self._points = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+
+class ShardCoordinator:
+    """
+    Membership, ownership and forwarding for one broker shard.
+
+    Each shard consumes the shared broker queue, so incoming messages are
+    spread over all shards, plus a private queue that receives shard
+    announcements, registry updates and messages forwarded to it. Registry
+    changes made on a shard are batched for sync_interval and published to
+    all shards; only the fields that matter for routing are replicated, so
+    heartbeats stay local to the owning shard.
+
+    The broker calls owns()/owner() to decide where work belongs,
+    split_recipients() before delivering, forward() for control messages
+    about agents it does not own, and agent_changed() whenever an agent's
+    registry entry changes.
+    """
+
+    def __init__(self,
+                 broker: Any,
+                 shard_id: str,
+                 api_url: Optional[str] = None,
+                 announce_interval: float = 5.0,
+                 shard_timeout: float = 15.0,
+                 sync_interval_ms: int = 50,
+                 virtual_nodes: int = 128,
+                 logger: Optional[logging.Logger] = None):
+        self.broker = broker
+        self.shard_id = shard_id
+        self.api_url = api_url
+        self.announce_interval = announce_interval
+        self.sync_interval = sync_interval_ms / 1000
+        self.logger = logger or logging.getLogger(__name__)
+        self.codec = get_codec_by_name('json')
+
+        self.ring = ConsistentHashRing(virtual_nodes)
+        self.ring.add(shard_id)
+        self.members: Dict[str, Dict[str, Any]] = {shard_id: {'api_url': api_url}}
+        self.member_liveness = LivenessTracker([(shard_timeout, self._on_shard_lost)], logger=self.logger)
+        self._owners: Dict[str, str] = {}
+
+        # Last replicated state per agent, and changes waiting to be synced
+        self._synced: Dict[str, Tuple] = {}
+        self._dirty: Set[str] = set()
+        self._removed: Set[str] = set()
+        self._sync_pending = asyncio.Event()
+
+        self._tasks: List[asyncio.Task] = []
+
+        self.stats = {
+            'forwarded_out': 0,
+            'forwarded_in': 0,
+            'syncs_sent': 0,
+            'syncs_applied': 0,
+            'rebalances': 0,
+            'agents_adopted': 0,
+            'agents_released': 0
+        }
+
+    @staticmethod
+    def queue_for(shard_id: str) -> str:
+        """Name of a shard's private queue."""
+        return f'message_broker.shard.{shard_id}'
+
+    def owner(self, agent_id: str) -> str:
+        """Shard owning an agent, cached until the ring changes."""
+        owner = self._owners.get(agent_id)
+        if owner is None:
+            owner = self._owners[agent_id] = self.ring.owner(agent_id)
+        return owner
+
+    def owns(self, agent_id: str) -> bool:
+        return self.owner(agent_id) == self.shard_id
+
+    async def setup_channel(self, channel):
+        """Declare this shard's queue and consume cluster and forwarded messages."""
+        queue = self.queue_for(self.shard_id)
+        await channel.queue_declare(queue=queue, auto_delete=True)
+        for topic in (ANNOUNCE_TOPIC, SYNC_TOPIC):
+            await channel.queue_bind(exchange='pfsense_agents', queue=queue, routing_key=topic)
+        await channel.basic_consume(queue=queue, on_message_callback=self._on_message_received)
+
+    def start(self):
+        """Start announcing this shard and syncing registry changes."""
+        self.member_liveness.start()
+        self._tasks = [
+            asyncio.create_task(self._announce_loop()),
+            asyncio.create_task(self._sync_loop())
+        ]
+
+    async def stop(self):
+        """Announce that this shard is leaving so the others take over its agents."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.member_liveness.stop()
+
+        try:
+            await self._flush_sync()
+            await self._announce(leaving=True)
+        except Exception as e:
+            self.logger.error(f"Error leaving shard cluster: {e}")
+
+    def agent_changed(self, agent_id: str):
+        """Queue an agent's new registry entry, or its removal, for the other shards."""
+        agent_conn = self.broker.connected_agents.get(agent_id)
+
+        if agent_conn is None:
+            if self._synced.pop(agent_id, None) is not None:
+                self._dirty.discard(agent_id)
+                self._removed.add(agent_id)
+                self._sync_pending.set()
+            return
+
+        state = self._state_key(agent_conn)
+        if self._synced.get(agent_id) != state:
+            self._synced[agent_id] = state
+            self._removed.discard(agent_id)
+            self._dirty.add(agent_id)
+            self._sync_pending.set()
+
+    def split_recipients(self, recipients: List[str]) -> Tuple[List[str], Dict[str, List[str]]]:
+        """Split recipients into local ones and the others grouped by owning shard."""
+        if len(self.ring) == 1:
+            return recipients, {}
+
+        local: List[str] = []
+        remote: Dict[str, List[str]] = {}
+        for agent_id in recipients:
+            owner = self.owner(agent_id)
+            if owner == self.shard_id:
+                local.append(agent_id)
+            else:
+                remote.setdefault(owner, []).append(agent_id)
+        return local, remote
+
+    async def forward(self, envelope: MessageEnvelope, shard_id: str, recipients: Optional[List[str]] = None):
+        """
+        Send a message to another shard's queue without re-encoding it.
+
+        With recipients, the other shard delivers the message to those
+        agents; without, it handles the message as if it had received it.
+        """
+        headers = routing_headers(envelope)
+        if recipients is not None:
+            headers[HEADER_SHARD_RECIPIENTS] = recipients
+
+        # Shards run the same version, so they always accept compressed bodies
+        body, content_encoding = envelope.wire_body_for(envelope.content_type, self.broker.compressor)
+
+        await self.broker.rabbitmq_channel.basic_publish(
+            exchange='',
+            routing_key=self.queue_for(shard_id),
+            body=body,
+            properties=pika.BasicProperties(
+                content_type=envelope.content_type,
+                content_encoding=content_encoding,
+                message_id=envelope.id,
+                type=envelope.message_type,
+                priority=envelope.priority,
+                expiration=amqp_expiration(envelope.expires_at),
+                headers=headers
+            )
+        )
+        self.stats['forwarded_out'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Membership, ownership and forwarding counters."""
+        owned: Dict[str, int] = {shard_id: 0 for shard_id in self.members}
+        for agent_id in self.broker.connected_agents:
+            owner = self.owner(agent_id)
+            owned[owner] = owned.get(owner, 0) + 1
+
+        stats = self.stats.copy()
+        stats.update({
+            'shard_id': self.shard_id,
+            'members': {
+                shard_id: {'api_url': member.get('api_url'), 'agents': owned.get(shard_id, 0)}
+                for shard_id, member in self.members.items()
+            },
+            'agents_tracked': len(self.broker.liveness)
+        })
+        return stats
+
+    async def _on_message_received(self, channel, method, properties, body):
+        """Handle a message on this shard's private queue."""
+        try:
+            envelope = MessageEnvelope.from_properties(properties, decompress(body, properties.content_encoding))
+            if envelope is None:
+                raise ValueError("shard message without routing headers")
+            envelope.keep_wire_body(body, properties.content_encoding)
+
+            if envelope.message_type in SHARD_MESSAGE_TYPES:
+                if envelope.sender_id != self.shard_id:
+                    message = AgentMessage.decode(envelope.body, envelope.content_type)
+                    if message.message_type == 'shard_announce':
+                        await self._handle_announce(message.payload)
+                    else:
+                        self._apply_sync(message.payload)
+            else:
+                self.stats['forwarded_in'] += 1
+                recipients = (properties.headers or {}).get(HEADER_SHARD_RECIPIENTS)
+                await self.broker._process_forwarded_message(envelope, recipients)
+
+            await channel.basic_ack(delivery_tag=method.delivery_tag)
+
+        except Exception as e:
+            self.logger.error(f"Error processing shard message: {e}")
+            await channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+
+    async def _handle_announce(self, payload: Dict[str, Any]):
+        """Track a shard announcing itself, or remove one that is leaving."""
+        shard_id = payload['shard_id']
+
+        if payload.get('leaving'):
+            self.member_liveness.forget(shard_id)
+            self._remove_member(shard_id)
+            return
+
+        self.member_liveness.touch(shard_id)
+        self.members[shard_id] = {'api_url': payload.get('api_url')}
+
+        if self.ring.add(shard_id):
+            self.logger.info(f"Shard {shard_id} joined")
+
+            # Let the new shard know about us right away, with our agents
+            await self._announce(target=shard_id)
+            await self._send_snapshot(shard_id)
+            self._rebalance()
+
+    def _on_shard_lost(self, shard_id: str):
+        """Take over the agents of a shard that stopped announcing itself."""
+        self.logger.warning(f"Shard {shard_id} missed its announcements")
+        self._remove_member(shard_id)
+
+    def _remove_member(self, shard_id: str):
+        self.members.pop(shard_id, None)
+        if self.ring.remove(shard_id):
+            self.logger.info(f"Shard {shard_id} left")
+            self._rebalance()
+
+    def _rebalance(self):
+        """Adopt agents that now hash to this shard and release the rest."""
+        self._owners.clear()
+        self.stats['rebalances'] += 1
+        liveness = self.broker.liveness
+
+        for agent_id in list(self.broker.connected_agents):
+            if self.owns(agent_id):
+                if agent_id not in liveness:
+                    liveness.touch(agent_id)
+                    self.stats['agents_adopted'] += 1
+            elif agent_id in liveness:
+                liveness.forget(agent_id)
+                self.stats['agents_released'] += 1
+
+    def _apply_sync(self, payload: Dict[str, Any]):
+        """Apply registry changes published by another shard."""
+        for agent_state in payload.get('upserts', []):
+            agent_id = agent_state['agent_id']
+            self._synced[agent_id] = self._state_key_from_dict(agent_state)
+            self._dirty.discard(agent_id)
+            self.broker._apply_agent_state(agent_state)
+
+            if self.owns(agent_id) and agent_id not in self.broker.liveness:
+                self.broker.liveness.touch(agent_id)
+
+        for agent_id in payload.get('removed', []):
+            self._synced.pop(agent_id, None)
+            self._dirty.discard(agent_id)
+            self.broker._drop_agent(agent_id)
+
+        self.stats['syncs_applied'] += 1
+
+    async def _announce_loop(self):
+        """Announce this shard to the others periodically."""
+        while True:
+            try:
+                await self._announce()
+                await asyncio.sleep(self.announce_interval)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Error announcing shard: {e}")
+                await asyncio.sleep(self.announce_interval)
+
+    async def _sync_loop(self):
+        """Publish batched registry changes."""
+        while True:
+            try:
+                await self._sync_pending.wait()
+                await asyncio.sleep(self.sync_interval)
+                await self._flush_sync()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Error syncing shard registry: {e}")
+                await asyncio.sleep(self.sync_interval)
+
+    async def _flush_sync(self):
+        self._sync_pending.clear()
+        dirty, self._dirty = self._dirty, set()
+        removed, self._removed = self._removed, set()
+        if not dirty and not removed:
+            return
+
+        upserts = [
+            self._agent_state(self.broker.connected_agents[agent_id])
+            for agent_id in dirty if agent_id in self.broker.connected_agents
+        ]
+        await self._publish('shard_sync', SYNC_TOPIC, {'upserts': upserts, 'removed': list(removed)})
+        self.stats['syncs_sent'] += 1
+
+    async def _send_snapshot(self, shard_id: str):
+        """Send the agents this shard owns to a shard that just joined."""
+        upserts = [
+            self._agent_state(agent_conn)
+            for agent_id, agent_conn in self.broker.connected_agents.items()
+            if self.owns(agent_id)
+        ]
+        if upserts:
+            await self._publish('shard_sync', SYNC_TOPIC, {'upserts': upserts}, target=shard_id)
+            self.stats['syncs_sent'] += 1
+
+    async def _announce(self, leaving: bool = False, target: Optional[str] = None):
+        await self._publish('shard_announce', ANNOUNCE_TOPIC, {
+            'shard_id': self.shard_id,
+            'api_url': self.api_url,
+            'leaving': leaving
+        }, target=target)
+
+    async def _publish(self, message_type: str, topic: str, payload: Dict[str, Any], target: Optional[str] = None):
+        """Publish a shard message to all shards, or to one shard's queue."""
+        message = AgentMessage(
+            id=str(uuid.uuid4()),
+            sender_id=self.shard_id,
+            recipient_id=None,
+            message_type=message_type,
+            topic=topic,
+            payload=payload,
+            timestamp=datetime.now()
+        )
+
+        await self.broker.rabbitmq_channel.basic_publish(
+            exchange='' if target else 'pfsense_agents',
+            routing_key=self.queue_for(target) if target else topic,
+            body=self.codec.encode(message),
+            properties=pika.BasicProperties(
+                content_type=self.codec.content_type,
+                message_id=message.id,
+                type=message_type,
+                headers=routing_headers(message)
+            )
+        )
+
+    @staticmethod
+    def _agent_state(agent_conn: Any) -> Dict[str, Any]:
+        """Replicated part of an agent's registry entry."""
+        return {
+            'agent_id': agent_conn.agent_id,
+            'agent_type': agent_conn.agent_type,
+            'status': agent_conn.status,
+            'subscribed_topics': list(agent_conn.subscribed_topics),
+            'content_types': list(agent_conn.content_types),
+            'content_encodings': list(agent_conn.content_encodings),
+            'connection_time': agent_conn.connection_time.isoformat()
+        }
+
+    @staticmethod
+    def _state_key(agent_conn: Any) -> Tuple:
+        return (agent_conn.agent_type, agent_conn.status,
+                tuple(agent_conn.subscribed_topics), tuple(agent_conn.content_types),
+                tuple(agent_conn.content_encodings))
+
+    @staticmethod
+    def _state_key_from_dict(agent_state: Dict[str, Any]) -> Tuple:
+        return (agent_state['agent_type'], agent_state['status'],
+                tuple(agent_state['subscribed_topics']), tuple(agent_state['content_types']),
+                tuple(agent_state.get('content_encodings', [])))
@@ -0,0 +1,171 @@
+"""
+Incremental JSON Field Parser for pfSense Multi-Agent System
+
+This module extracts the top-level fields of a JSON object while it is still
+being streamed. Each field is returned as soon as its value closes, so a
+caller can act on an early field of an LLM response, such as the immediate
+actions of an incident response plan, while the rest is still being
+generated. The complete elements of a JSON array can likewise be recovered
+from a response that was cut off part way through.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Marker for text that did not parse, distinct from a JSON null
+_INVALID = object()
+
+
+def _loads(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return _INVALID
+
+
+class IncrementalJSONParser:
+    """
+    Streaming extractor of the top-level fields of one JSON object.
+
+    feed() takes text chunks of any size and returns the (name, value) pairs
+    that completed within them. Strings, arrays and objects complete at
+    their closing character; numbers, booleans and null complete at the
+    following comma or closing brace. Text before the opening brace, such as
+    a Markdown code fence, is skipped. A field whose value is not valid JSON
+    is dropped, and parsing carries on with the next field.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.fields: Dict[str, Any] = {}
+        self.complete = False
+
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Add streamed text; returns the fields completed by it, in order."""
+        self.buffer += chunk
+        completed = []
+
+        while self._position < len(self.buffer) and not self.complete:
+            position = self._position
+            char = self.buffer[position]
+            self._position += 1
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        text = self.buffer[self._string_start:position + 1]
+                        if self._key is None:
+                            self._key = _loads(text)
+                        elif self._value_start is not None:
+                            self._complete_field(text, completed)
+                continue
+
+            if self._depth == 0:
+                if char == '{':
+                    self._depth = 1
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = position
+            elif char == ':' and self._depth == 1:
+                self._value_start = self._position
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 1 and self._value_start is not None:
+                    self._complete_field(self.buffer[self._value_start:position + 1], completed)
+                elif self._depth == 0:
+                    self._complete_scalar(position, completed)
+                    self.complete = True
+            elif char == ',' and self._depth == 1:
+                self._complete_scalar(position, completed)
+
+        return completed
+
+    def _complete_scalar(self, end: int, completed: List[Tuple[str, Any]]):
+        """Complete a number, boolean or null value ending before a delimiter."""
+        if self._value_start is not None and self.buffer[self._value_start:end].strip():
+            self._complete_field(self.buffer[self._value_start:end], completed)
+
+    def _complete_field(self, text: str, completed: List[Tuple[str, Any]]):
+        name = self._key
+        self._key = None
+        self._value_start = None
+
+        value = _loads(text)
+        if isinstance(name, str) and value is not _INVALID:
+            self.fields[name] = value
+            completed.append((name, value))
+
+
+def complete_array_elements(text: str) -> List[Any]:
+    """
+    The elements of a JSON array that are complete, even if it is truncated.
+
+    Text before the opening bracket is skipped. Parsing stops at the end of
+    the array or of the text; an element cut off part way is left out, as
+    is any element that is not valid JSON.
+    """
+    start = text.find('[')
+    if start < 0:
+        return []
+
+    elements = []
+    depth = 1
+    in_string = False
+    escaped = False
+    element_start: Optional[int] = start + 1
+
+    for position in range(start + 1, len(text)):
+        char = text[position]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            depth += 1
+        elif char in '}]':
+            depth -= 1
+            if depth == 1 and element_start is not None:
+                _append_element(text[element_start:position + 1], elements)
+                element_start = None
+            elif depth == 0:
+                if element_start is not None:
+                    _append_element(text[element_start:position], elements)
+                break
+        elif char == ',' and depth == 1:
+            if element_start is not None:
+                _append_element(text[element_start:position], elements)
+            element_start = position + 1
+
+    return elements
+
+
+def _append_element(text: str, elements: List[Any]):
+    if text.strip():
+        value = _loads(text)
+        if value is not _INVALID:
+            elements.append(value)
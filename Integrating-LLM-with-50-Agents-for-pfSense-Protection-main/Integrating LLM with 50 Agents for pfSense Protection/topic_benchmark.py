@@ -0,0 +1,111 @@
+"""
+Topic Matching Benchmark for pfSense Multi-Agent System
+
+Compares resolving routing targets by scanning every rule linearly with the
+compiled TopicTrie (cold and memoized) for thousands of routing rules.
+
+Usage:
+    python -m communication.topic_benchmark [--rules N] [--topics N] [--json]
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import Any, Dict, List, Tuple
+
+from ..core.topic_trie import TopicTrie, topic_matches
+
+
+DOMAINS = ['security', 'network', 'pfsense', 'system', 'alerts', 'agent']
+CATEGORIES = ['events', 'alerts', 'anomalies', 'logs', 'traffic', 'tasks', 'statistics', 'heartbeat']
+DETAILS = ['firewall', 'dhcp', 'vpn', 'wan', 'lan', 'opt1', 'critical', 'high', 'medium', 'low']
+
+
+def generate_rules(count: int, agents: int, rng: random.Random) -> List[Tuple[str, str]]:
+    """Generate (pattern, agent_id) pairs mixing literal, '*' and '#' patterns."""
+    rules = []
+    for _ in range(count):
+        words = [rng.choice(DOMAINS), rng.choice(CATEGORIES), rng.choice(DETAILS)]
+        roll = rng.random()
+        if roll < 0.2:
+            words[rng.randrange(3)] = '*'
+        elif roll < 0.3:
+            words = words[:rng.randrange(1, 3)] + ['#']
+        rules.append(('.'.join(words), f'agent_{rng.randrange(agents)}'))
+    return rules
+
+
+def generate_topics(count: int, rng: random.Random) -> List[str]:
+    """Generate concrete topics of two to four words."""
+    topics = []
+    for _ in range(count):
+        words = [rng.choice(DOMAINS), rng.choice(CATEGORIES), rng.choice(DETAILS)]
+        topics.append('.'.join(words[:rng.randrange(2, 4)]))
+    return topics
+
+
+def run_benchmark(rule_count: int = 5000, topic_count: int = 2000, agents: int = 500,
+                  seed: int = 42) -> Dict[str, Any]:
+    """Run the benchmark and return lookups per second for each strategy."""
+    rng = random.Random(seed)
+    rules = generate_rules(rule_count, agents, rng)
+    topics = generate_topics(topic_count, rng)
+
+    # Linear scan over every rule, as the broker did before the trie
+    start = time.perf_counter()
+    linear_results = [
+        {agent_id for pattern, agent_id in rules if topic_matches(pattern, topic)}
+        for topic in topics
+    ]
+    linear_seconds = time.perf_counter() - start
+
+    trie = TopicTrie(cache_size=topic_count * 2)
+    start = time.perf_counter()
+    for pattern, agent_id in rules:
+        trie.add(pattern, agent_id)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    trie_results = [trie.match(topic) for topic in topics]
+    cold_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for topic in topics:
+        trie.match(topic)
+    memoized_seconds = time.perf_counter() - start
+
+    mismatches = sum(1 for a, b in zip(linear_results, trie_results) if a != set(b))
+
+    return {
+        'rules': rule_count,
+        'topics': topic_count,
+        'unique_topics': len(set(topics)),
+        'trie_build_ms': build_seconds * 1000,
+        'linear_lookups_per_sec': topic_count / linear_seconds,
+        'trie_cold_lookups_per_sec': topic_count / cold_seconds,
+        'trie_memoized_lookups_per_sec': topic_count / memoized_seconds,
+        'result_mismatches': mismatches
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Topic matching benchmark")
+    parser.add_argument('--rules', type=int, default=5000)
+    parser.add_argument('--topics', type=int, default=2000)
+    parser.add_argument('--agents', type=int, default=500)
+    parser.add_argument('--json', action='store_true', help="Emit results as JSON")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.rules, args.topics, args.agents)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for key, value in results.items():
+        print(f"{key:<32} {value:>14,.1f}" if isinstance(value, float) else f"{key:<32} {value:>14,}")
+
+
+if __name__ == '__main__':
+    main()
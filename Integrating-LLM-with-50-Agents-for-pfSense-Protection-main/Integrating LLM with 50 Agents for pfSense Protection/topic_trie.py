@@ -0,0 +1,141 @@
+"""
+Topic Trie for pfSense Multi-Agent System
+
+This module provides a compiled matcher for AMQP topic patterns, used by the
+message broker to resolve routing rules and subscriptions and by the
+in-process transport and message compression. Patterns follow RabbitMQ
+topic exchange semantics: words are separated by '.', '*' matches exactly
+one word and '#' matches zero or more words.
+"""
+
+from collections import Counter
+from typing import Dict, FrozenSet, Hashable, List, Set
+
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    """Check a single topic against a single pattern (AMQP semantics)."""
+    return _words_match(pattern.split('.'), topic.split('.'))
+
+
+def _words_match(pattern_words: List[str], topic_words: List[str]) -> bool:
+    if not pattern_words:
+        return not topic_words
+
+    head, rest = pattern_words[0], pattern_words[1:]
+    if head == '#':
+        return any(_words_match(rest, topic_words[i:]) for i in range(len(topic_words) + 1))
+    if not topic_words:
+        return False
+    if head == '*' or head == topic_words[0]:
+        return _words_match(rest, topic_words[1:])
+    return False
+
+
+class _TrieNode:
+    """One pattern word; values are reference-counted per pattern."""
+
+    __slots__ = ('children', 'values')
+
+    def __init__(self):
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.values: Counter = Counter()
+
+
+class TopicTrie:
+    """
+    Trie of topic patterns mapping concrete topics to a set of values.
+
+    Matching walks one trie level per topic word, so its cost depends on the
+    topic depth rather than the number of patterns. Results are memoized per
+    concrete topic and the memo is cleared whenever a pattern is added or
+    removed. The same value may be added several times for one pattern; it
+    stays matched until it has been removed as many times.
+    """
+
+    def __init__(self, cache_size: int = 10000):
+        self.root = _TrieNode()
+        self.cache_size = cache_size
+        self._cache: Dict[str, FrozenSet[Hashable]] = {}
+
+        self.stats = {
+            'patterns': 0,
+            'cache_hits': 0,
+            'cache_misses': 0
+        }
+
+    def add(self, pattern: str, value: Hashable):
+        """Add a value under a topic pattern."""
+        node = self.root
+        for word in pattern.split('.'):
+            node = node.children.setdefault(word, _TrieNode())
+
+        if not node.values[value]:
+            self.stats['patterns'] += 1
+        node.values[value] += 1
+        self._cache.clear()
+
+    def remove(self, pattern: str, value: Hashable) -> bool:
+        """Remove one reference of a value from a pattern; returns False if absent."""
+        path = [self.root]
+        for word in pattern.split('.'):
+            child = path[-1].children.get(word)
+            if child is None:
+                return False
+            path.append(child)
+
+        node = path[-1]
+        if node.values.get(value, 0) == 0:
+            return False
+
+        node.values[value] -= 1
+        if not node.values[value]:
+            del node.values[value]
+            self.stats['patterns'] -= 1
+
+        # Prune nodes left without values or children
+        words = pattern.split('.')
+        for index in range(len(words), 0, -1):
+            current = path[index]
+            if current.values or current.children:
+                break
+            del path[index - 1].children[words[index - 1]]
+
+        self._cache.clear()
+        return True
+
+    def match(self, topic: str) -> FrozenSet[Hashable]:
+        """Get the deduplicated set of values whose patterns match a topic."""
+        result = self._cache.get(topic)
+        if result is not None:
+            self.stats['cache_hits'] += 1
+            return result
+
+        self.stats['cache_misses'] += 1
+        matched: Set[Hashable] = set()
+        self._collect(self.root, topic.split('.'), 0, matched)
+        result = frozenset(matched)
+
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[topic] = result
+        return result
+
+    def _collect(self, node: _TrieNode, words: List[str], index: int, matched: Set[Hashable]):
+        """Collect values of all patterns under node matching words[index:]."""
+        hash_node = node.children.get('#')
+        if hash_node is not None:
+            # '#' can absorb any number of the remaining words, including none
+            for next_index in range(index, len(words) + 1):
+                self._collect(hash_node, words, next_index, matched)
+
+        if index == len(words):
+            matched.update(node.values)
+            return
+
+        child = node.children.get(words[index])
+        if child is not None:
+            self._collect(child, words, index + 1, matched)
+
+        star_node = node.children.get('*')
+        if star_node is not None:
+            self._collect(star_node, words, index + 1, matched)
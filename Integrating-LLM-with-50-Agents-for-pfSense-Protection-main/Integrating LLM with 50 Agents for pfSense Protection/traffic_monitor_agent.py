@@ -93,7 +93,7 @@ class TrafficMonitorAgent(BaseAgent):
         }
         
         # LLM client
-        self.llm_client = get_llm_client()
+        self.llm_client = get_llm_client(config.llm)
         
         self.logger.info(f"Traffic Monitor Agent initialized for interfaces: {self.interfaces}")
     
@@ -212,11 +212,12 @@ class TrafficMonitorAgent(BaseAgent):
         
         try:
             # Get interface statistics using netstat
-            stdin, stdout, stderr = self.ssh_client.exec_command(
-                f"netstat -I {interface} -b"
-            )
+            with self.metrics.time_ssh_command('netstat'):
+                stdin, stdout, stderr = self.ssh_client.exec_command(
+                    f"netstat -I {interface} -b"
+                )
+                output = stdout.read().decode().strip()
             
-            output = stdout.read().decode().strip()
             lines = output.split('\n')
             
             if len(lines) < 2:
@@ -258,11 +259,12 @@ class TrafficMonitorAgent(BaseAgent):
     async def _get_connection_count(self, interface: str) -> int:
         """Get the number of active connections on an interface."""
         try:
-            stdin, stdout, stderr = self.ssh_client.exec_command(
-                "netstat -an | grep ESTABLISHED | wc -l"
-            )
+            with self.metrics.time_ssh_command('netstat'):
+                stdin, stdout, stderr = self.ssh_client.exec_command(
+                    "netstat -an | grep ESTABLISHED | wc -l"
+                )
+                count = int(stdout.read().decode().strip())
             
-            count = int(stdout.read().decode().strip())
             return count
             
         except Exception as e:
@@ -352,7 +354,8 @@ class TrafficMonitorAgent(BaseAgent):
             message_type='alert',
             topic='network.bandwidth_alerts',
             payload=alert_data,
-            priority=3 if alert_data['severity'] == 'high' else 2
+            priority=3 if alert_data['severity'] == 'high' else 2,
+            ttl=self.sampling_interval  # The next sample raises a fresh alert
         )
         
         self.monitoring_stats['alerts_generated'] += 1
@@ -423,6 +426,7 @@ class TrafficMonitorAgent(BaseAgent):
     
     async def _perform_traffic_analysis(self):
         """Perform comprehensive traffic analysis."""
+        analyses = []
         for interface in self.interfaces:
             if interface not in self.traffic_history or not self.traffic_history[interface]:
                 continue
@@ -450,20 +454,25 @@ class TrafficMonitorAgent(BaseAgent):
                 },
                 'baseline': self.baseline_data.get(interface, {})
             }
+            analyses.append(self._analyze_interface_traffic(interface, traffic_data))
+        
+        # Run concurrently, so the LLM client can send them as one batched request
+        await asyncio.gather(*analyses)
+    
+    async def _analyze_interface_traffic(self, interface: str, traffic_data: Dict[str, Any]):
+        """Analyze one interface's recent traffic with the LLM."""
+        try:
+            llm_response = await self.llm_client.analyze_traffic_pattern(
+                traffic_data=traffic_data,
+                baseline_data=self.baseline_data.get(interface)
+            )
             
-            # Use LLM for analysis
-            try:
-                llm_response = await self.llm_client.analyze_traffic_pattern(
-                    traffic_data=traffic_data,
-                    baseline_data=self.baseline_data.get(interface)
-                )
+            # Process LLM recommendations
+            if llm_response.confidence > 0.7:
+                await self._process_traffic_analysis_results(llm_response, interface)
                 
-                # Process LLM recommendations
-                if llm_response.confidence > 0.7:
-                    await self._process_traffic_analysis_results(llm_response, interface)
-                    
-            except Exception as e:
-                self.logger.error(f"Error in LLM traffic analysis: {e}")
+        except Exception as e:
+            self.logger.error(f"Error in LLM traffic analysis: {e}")
     
     async def _process_traffic_analysis_results(self, llm_response, interface: str):
         """Process traffic analysis results from LLM."""
@@ -517,11 +526,12 @@ class TrafficMonitorAgent(BaseAgent):
         
         try:
             # Get active connections
-            stdin, stdout, stderr = self.ssh_client.exec_command(
-                "netstat -an | grep ESTABLISHED"
-            )
+            with self.metrics.time_ssh_command('netstat'):
+                stdin, stdout, stderr = self.ssh_client.exec_command(
+                    "netstat -an | grep ESTABLISHED"
+                )
+                output = stdout.read().decode().strip()
             
-            output = stdout.read().decode().strip()
             connections = []
             
             for line in output.split('\n'):
@@ -676,7 +686,8 @@ class TrafficMonitorAgent(BaseAgent):
                     for interface in self.interfaces
                 },
                 'timestamp': datetime.now().isoformat()
-            }
+            },
+            ttl=60  # Superseded by the next report
         )
     
     async def _handle_traffic_analysis_request(self, message: AgentMessage):
@@ -0,0 +1,47 @@
+"""
+Message Transport Interface for pfSense Multi-Agent System
+
+This module defines how agents and the message broker obtain channels. A
+transport hands out channels that speak the subset of the AMQP channel API
+used across the system (exchange_declare, queue_declare, queue_bind,
+basic_consume, basic_publish, basic_ack, basic_nack, confirm_delivery, close).
+"""
+
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+ChannelCallback = Callable[[Any], Awaitable[None]]
+
+
+class MessageTransport(ABC):
+    """Process-wide source of message channels."""
+
+    @abstractmethod
+    async def acquire_channel(self, url: str, on_reopen: Optional[ChannelCallback] = None) -> Any:
+        """
+        Get a channel.
+
+        Args:
+            url: Address of the message server, if the transport uses one
+            on_reopen: Called with a replacement channel after a reconnect
+        """
+
+    @abstractmethod
+    async def release_channel(self, channel: Any):
+        """Close a channel obtained from acquire_channel."""
+
+    @abstractmethod
+    async def declare_exchange(self,
+                               channel: Any,
+                               exchange: str = 'pfsense_agents',
+                               exchange_type: str = 'topic'):
+        """Declare an exchange, skipping redundant declarations where possible."""
+
+    @abstractmethod
+    async def close(self):
+        """Close every channel and connection of the transport."""
+
+    @abstractmethod
+    def get_stats(self) -> Dict[str, Any]:
+        """Get transport statistics."""